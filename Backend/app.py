@@ -1,40 +1,59 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
+from werkzeug.security import safe_join
 from flask_cors import CORS
 import os
+import logging
+from logging_setup import setup_logging, logging_stats
 from dotenv import load_dotenv
 import google.generativeai as genai
-from werkzeug.utils import secure_filename
 from auth import hash_password, verify_password, create_token, get_current_user
 from models import db, User, History
+from migrations import run_migrations
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.engine import make_url
 from datetime import datetime, timedelta
-from auth import get_admin_user
+from auth import get_admin_user, invalidate_user, principal_cache, password_hasher
+from password_hasher import HashingBusy
 import json
 import random
-import requests
 import time
+from jobs import JobManager, JobError, ProgressFanout, FAILED
+from workflow_registry import WorkflowRegistry, WorkflowError
+from llm_cache import LLMCache, LLM_CACHE_ENABLED
+from gemini_client import GeminiClient, GeminiUnavailable
+from singleflight import SingleFlight
+from result_cache import ResultCache, result_key, RESULT_CACHE_ENABLED, RESULT_CACHE_MAX_MB
+from comfy_client import ComfyPool, ComfyRejected, ComfyUnavailable
+from history_writer import HistoryWriter, HISTORY_WRITE_BEHIND
+from tool_pipeline import ToolRegistry, TOOL_MAX_UPLOAD_MB
+from upload_store import UploadStore
+from thumbnails import ThumbnailCache, snap_width
+from assets import AssetManifest
+from file_delivery import FileDelivery
+import usage_stats
+import metrics
 
 
 
 load_dotenv()
+# Before anything logs: queue-based handler, LOG_* settings from .env
+setup_logging()
+log = logging.getLogger(__name__)
 
 BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
 FRONTEND_DIR = os.path.abspath(os.path.join(BACKEND_DIR, '..', 'Frontend'))
 
 
-def load_workflow(workflow_name):
-    try:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        workflow_path = os.path.join(base_dir, "workflows", f"{workflow_name}.json")
-
-        with open(workflow_path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"Workflow load error: {e}")
-        return None
+workflow_registry = WorkflowRegistry(os.path.join(BACKEND_DIR, "workflows"))
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY','fallback-secret-key') #Get from env or use fallback
 CORS(app)
+# Per-route latency and SQL per request for GET /metrics, see metrics.py
+metrics.init_app(app)
+# Backstop for bodies without Content-Length; tools have tighter limits
+app.config['MAX_CONTENT_LENGTH'] = int(TOOL_MAX_UPLOAD_MB * 2 * 1024 * 1024)
+# Every AI tool is registered through this: size check -> auth -> validation
+tools = ToolRegistry(app, get_current_user)
 
 # ----------------------------
 # PROMPT ENHANCER CONFIG
@@ -45,9 +64,23 @@ GEMINI_API_KEY = os.getenv("NANOBANANA_KEY")
 if not GEMINI_API_KEY:
     raise RuntimeError("NANOBANANA_KEY not found in .env file")
 
-genai.configure(api_key=GEMINI_API_KEY)
+# Point at another Gemini-compatible host (e.g. fakes/gemini.py for load
+# tests). Only the REST transport can do that, and it has no async client.
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+
+if GEMINI_API_ENDPOINT:
+    genai.configure(api_key=GEMINI_API_KEY, transport="rest",
+                    client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+else:
+    genai.configure(api_key=GEMINI_API_KEY)
 prompt_model = genai.GenerativeModel("gemini-2.5-flash")
 
+llm_cache = LLMCache(
+    os.getenv("LLM_CACHE_PATH", os.path.join(BACKEND_DIR, "cache", "llm_cache.sqlite")),
+    enabled=LLM_CACHE_ENABLED
+)
+gemini = GeminiClient(prompt_model, llm_cache, native_async=not GEMINI_API_ENDPOINT)
+
 
 # ======================================================
 #  DATABASE CONFIGURATION
@@ -55,7 +88,7 @@ prompt_model = genai.GenerativeModel("gemini-2.5-flash")
 # GET database URL from environment variable 
 # Falls back to SQLITE if not set
 DATABASE_URL =os.getenv('DATABASE_URL','sqlite:///default.db')
-print(DATABASE_URL)
+log.info("Database: %s", make_url(DATABASE_URL).render_as_string(hide_password=True))
 app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = 'supersecretkey'
@@ -106,10 +139,8 @@ app.config['SQLALCHEMY_ENGINE_OPTIONS'] ={
 # PATH CONFIG
 # ----------------------------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-print(BASE_DIR)
 
 GENERATED_FOLDER = os.path.join(BASE_DIR, "generated")
-print("==============================================a")
 
 # --- Add this right below your PATH CONFIG section ---
 
@@ -121,6 +152,45 @@ def get_full_url(filename):
 # Ensure folder exists
 os.makedirs(GENERATED_FOLDER, exist_ok=True)
 
+# User uploads, stored by content digest (History.input_img holds the key)
+upload_store = UploadStore(
+    os.getenv("UPLOAD_DIR", os.path.join(BASE_DIR, "uploads"))
+)
+# Resized copies for list views (?w=256), see thumbnails.py
+thumbnails = ThumbnailCache(
+    os.getenv("THUMBNAIL_DIR", os.path.join(BASE_DIR, "cache", "thumbnails"))
+)
+# Image bytes: sent by the app (sendfile, Range, 304) or handed to a fronting
+# proxy via X-Accel-Redirect / X-Sendfile, see file_delivery.py
+file_delivery = FileDelivery()
+file_delivery.add_root("generated", GENERATED_FOLDER)
+file_delivery.add_root("uploads", upload_store.root)
+
+
+# ----------------------------
+# SERVER-SENT EVENTS (opt-in streaming)
+# ----------------------------
+def wants_stream():
+    """Streaming is opt-in: ?stream=1, or "stream": true in the JSON/form body."""
+    if request.args.get("stream") in ("1", "true"):
+        return True
+    if request.form.get("stream") in ("1", "true"):
+        return True
+    data = request.get_json(silent=True) if request.is_json else None
+    return bool(data and data.get("stream") is True)
+
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+def sse_response(events):
+    return Response(
+        stream_with_context(events),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 
 
 
@@ -132,76 +202,144 @@ os.makedirs(GENERATED_FOLDER, exist_ok=True)
 # HEALTH CHECK
 # ----------------------------
 
+# Frontend/ is loaded into an in-memory manifest at start-up (assets.py):
+# fingerprinted, precompressed, ETag/304 - no filesystem probe per request
+assets = AssetManifest(FRONTEND_DIR)
+
+
 @app.route('/')
 def home():
-    return send_from_directory(FRONTEND_DIR, 'Home.html')
-print("ddd===============================")
+    return assets.response('Home.html')
 
 
 # 2. The Private Dashboard
 @app.route('/dashboard')
 def index():
-    return send_from_directory(FRONTEND_DIR, 'index.html')
+    return assets.response('index.html')
 
 @app.route('/login')
 def login_page():
-    return send_from_directory(FRONTEND_DIR, 'login.html')
+    return assets.response('login.html')
 
 @app.route('/register')
 def register_page():
-    return send_from_directory(FRONTEND_DIR,'register.html')
+    return assets.response('register.html')
 
 
 @app.route('/admin')
 def admin_page():
-    return send_from_directory(FRONTEND_DIR,'admin.html')
+    return assets.response('admin.html')
 
 @app.route('/<path:filename>')
 def serve_frontend(filename):
     # Serve ANY file from frontend folder
-    file_path = os.path.join(FRONTEND_DIR, filename)
-    
+    response = assets.response(filename)
+    if response is not None:
+        return response
 
+    # Fallback → home page
+    return assets.response('Home.html')
 
-    if os.path.exists(file_path):
-        return send_from_directory(FRONTEND_DIR, filename)
 
-    # Fallback → home page
-    return send_from_directory(FRONTEND_DIR, 'home.html')
 
 
 
+HISTORY_PAGE_SIZE = 50
+HISTORY_PAGE_MAX = 200
+
+
+def parse_date_arg(name, end_of_day=False):
+    """
+    ?from= / ?to= as YYYY-MM-DD or ISO datetime. A bare date used as the
+    upper bound covers that whole day. Raises ValueError on bad input.
+    """
+    value = request.args.get(name)
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if end_of_day and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+
+def history_page_args():
+    """Common ?limit, ?cursor, ?tool_name, ?from, ?to parsing for list views."""
+    limit = request.args.get("limit", HISTORY_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, HISTORY_PAGE_MAX))
+    cursor = request.args.get("cursor", type=int)
+    tool_name = request.args.get("tool_name") or None
+    date_from = parse_date_arg("from")
+    date_to = parse_date_arg("to", end_of_day=True)
+    return limit, cursor, tool_name, date_from, date_to
 
 
 @app.route("/api/history", methods=["GET"])
 def get_history():
-    print("=====================ooo")
-
-      # Step 1: Check if user is logged in (validate token)
+    """
+    Current user's history, newest first, keyset-paginated on (user_id, id).
+
+    Query params:
+      limit      page size (default 50, max 200)
+      cursor     next_cursor from the previous page
+      tool_name  only this tool
+      from, to   created_at range (YYYY-MM-DD or ISO datetime)
+      fields     "summary" skips output_text in list views
+    """
+    # Step 1: Check if user is logged in (validate token)
     current_user, error = get_current_user()
     if error:
         return error  # Returns 401 if token is missing/invalid
 
-
-
-    
-  
-    # Step 2: Get only this user's history
-    records = History.query.filter_by(user_id=current_user.id).order_by(History.id.asc()).all()
-
-    return jsonify([
-        {
+    try:
+        limit, cursor, tool_name, date_from, date_to = history_page_args()
+    except ValueError:
+        return jsonify({"error": "Dates must be YYYY-MM-DD or ISO format"}), 400
+
+    summary = request.args.get("fields") == "summary"
+
+    columns = [
+        History.id, History.tool_name, History.input_text, History.input_img,
+        History.output_img, History.user_id, History.created_at
+    ]
+    if not summary:
+        columns.append(History.output_text)
+
+    # Step 2: Get only this user's history (one page)
+    query = db.session.query(*columns).filter(History.user_id == current_user.id)
+    if cursor:
+        query = query.filter(History.id < cursor)
+    if tool_name:
+        query = query.filter(History.tool_name == tool_name)
+    if date_from:
+        query = query.filter(History.created_at >= date_from)
+    if date_to:
+        query = query.filter(History.created_at < date_to)
+
+    # One extra row tells us whether there is a next page
+    rows = query.order_by(History.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    items = []
+    for r in rows:
+        item = {
             "id": r.id,
             "tool_name": r.tool_name,
             "input_text": r.input_text,
             "input_img": r.input_img,
-            "output_text": r.output_text,
             "output_img": r.output_img,
             "user_id": r.user_id,
             "created_at": r.created_at.strftime("%Y-%m-%d %H:%M:%S") if r.created_at else None
         }
-        for r in records
-    ])
+        if not summary:
+            item["output_text"] = r.output_text
+        items.append(item)
+
+    return jsonify({
+        "items": items,
+        "next_cursor": str(rows[-1].id) if has_more else None,
+        "limit": limit
+    })
 
 
 
@@ -212,6 +350,13 @@ def get_history():
 # AUTH API ROUTES
 # =============================================================================
 
+def hashing_busy():
+    """Login/register burst: shed load instead of queueing without bound."""
+    response = jsonify({'error': 'Server busy, please retry in a moment'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+
 @app.route('/api/register', methods=['POST'])
 def api_register():
     data = request.get_json()
@@ -228,12 +373,18 @@ def api_register():
     if User.query.filter_by(email=email).first():
         return jsonify({'error': 'Email already registered'}), 400
 
+    try:
+        password_hash = hash_password(password)
+    except HashingBusy:
+        return hashing_busy()
+
     new_user = User(
         username=username,
         email=email,
-        password_hash=hash_password(password)
+        password_hash=password_hash
     )
     db.session.add(new_user)
+    usage_stats.add_users(db.session.connection(), 1)
     db.session.commit()
 
     return jsonify({'message': 'Registration successful!'}), 201
@@ -250,8 +401,11 @@ def api_login():
     password = data.get('password')
 
     user = User.query.filter_by(email=email).first()
-    if not user or not verify_password(user.password_hash, password):
-        return jsonify({'error': 'Invalid credentials'}), 401
+    try:
+        if not user or not verify_password(user.password_hash, password):
+            return jsonify({'error': 'Invalid credentials'}), 401
+    except HashingBusy:
+        return hashing_busy()
 
     token = create_token(user.id, user.is_admin)
 
@@ -272,136 +426,472 @@ def api_login():
 # ----------------------------
 # SERVE GENERATED IMAGES
 # ----------------------------
+def thumbnail_response(source_path, digest=None):
+    """
+    ?w=<px>: the resized WEBP with a strong ETag (304 on If-None-Match).
+    Returns None to serve the original (no ?w=, no Pillow, not an image).
+    """
+    width = request.args.get("w", type=int)
+    if not width or width <= 0 or not source_path or not os.path.isfile(source_path):
+        return None
+
+    derivative = thumbnails.get(source_path, snap_width(width), digest)
+    if derivative is None:
+        return None
+    path, etag = derivative
+
+    # Content-addressed source: this URL can never serve different bytes
+    response = send_file(path, mimetype="image/webp", etag=etag, conditional=True,
+                         max_age=31536000 if digest else 86400)
+    response.cache_control.public = True
+    if digest:
+        response.cache_control.immutable = True
+    return response
+
+
 @app.route("/generated/<path:filename>")
 def serve_generated(filename):
-    return send_from_directory(GENERATED_FOLDER, filename)
+    # Upload digest keys live in the sharded upload store; anything else
+    # (mock outputs, uploads saved before the store existed) is flat
+    if upload_store.is_key(filename):
+        thumb = thumbnail_response(upload_store.path(filename), digest=filename)
+        if thumb is not None:
+            return thumb
+        return file_delivery.send("uploads", upload_store.relpath(filename),
+                                  etag=filename, immutable=True)
+
+    thumb = thumbnail_response(safe_join(GENERATED_FOLDER, filename))
+    if thumb is not None:
+        return thumb
+    return file_delivery.send("generated", filename)
 ## I have formatted this specifically for your StabilityMatrix setup
 COMFY_OUTPUT_PATH = "D:/StabilityMatrix-win-x64/Data/Packages/ComfyUI/output"
+file_delivery.add_root("comfy", COMFY_OUTPUT_PATH)
 
 @app.route('/comfy_output/<filename>')
 def serve_comfy_image(filename):
     # This replaces the need for test.jpg by serving directly from ComfyUI
-    return send_from_directory(COMFY_OUTPUT_PATH, filename)
+    local_path = safe_join(COMFY_OUTPUT_PATH, filename)
+    if local_path and os.path.isfile(local_path):
+        thumb = thumbnail_response(local_path)
+        if thumb is not None:
+            return thumb
+        return file_delivery.send("comfy", filename)
+
+    # Served from the prompt-to-image result cache
+    cached_path = result_cache.path(filename)
+    if cached_path:
+        # Result cache names are content keys, like upload digests
+        thumb = thumbnail_response(cached_path, digest=filename)
+        if thumb is not None:
+            return thumb
+        return file_delivery.send("results", filename, etag=filename, immutable=True)
+
+    # Rendered on another GPU host → fetch it through ComfyUI's /view once,
+    # then serve the local copy like a local output (?w=, ETag, Range)
+    if filename.endswith(".png"):
+        remote_path = comfy_fetch_flight.do(filename, fetch_remote_output, filename)
+        if not remote_path:
+            return jsonify({"error": "Image not found"}), 404
+        thumb = thumbnail_response(remote_path)
+        if thumb is not None:
+            return thumb
+        return file_delivery.send("comfy_remote", filename)
+
+    # SaveImage only writes PNGs; anything else is passed through as is
+    fetched = comfy_pool.fetch_output(filename)
+    if not fetched:
+        return jsonify({"error": "Image not found"}), 404
+    content, content_type = fetched
+    return Response(content, mimetype=content_type)
+
+
+def fetch_remote_output(filename):
+    """Local path of another host's output, downloaded on first use (or None)."""
+    if safe_join(comfy_remote_cache.directory, filename) is None:
+        return None
+    # path(), not get(): get() touches the file for LRU, and the file's
+    # mtime is part of the ETag file_delivery sends
+    path = comfy_remote_cache.path(filename)
+    if path:
+        return path
+
+    fetched = comfy_pool.fetch_output(filename)
+    if not fetched:
+        return None
+    comfy_remote_cache.put(filename[:-len(".png")], fetched[0])
+    return comfy_remote_cache.path(filename)
+
+COMFY_TIMEOUT_SECONDS = int(os.getenv("COMFY_TIMEOUT_SECONDS", "120"))
+# ?wait= cap. A Flask long-poll holds a server thread for its whole wait, so
+# under WSGI it stays short and clients re-poll; asgi.py waits without a
+# thread and allows JOB_LONG_POLL_MAX
+JOB_WSGI_POLL_MAX = float(os.getenv("JOB_WSGI_POLL_MAX", "2"))
+JOB_LONG_POLL_MAX = 30
+
+STYLE_MODIFIERS = {
+    "clean": ", minimal design, clean background, high quality",
+    "cinematic": ", dramatic lighting, cinematic atmosphere, masterpiece",
+    "anime": ", anime style, vibrant colors, cel shaded",
+    "photoreal": ", photorealistic, highly detailed, raw photo",
+    "illustration": ", digital art, artistic illustration, detailed textures"
+}
 
-@app.route("/api/prompt-to-image", methods=["POST"])
-def prompt_to_image():
-    data = request.json
-    prompt = data.get("prompt", "")
-    style = data.get("style", "clean")
+NEGATIVE_PROMPT = (
+    "aggressive, roaring, open mouth, extra head, duplicate face, "
+    "two faces, mutated, deformed, bad anatomy, distorted, "
+    "horror, scary, creepy, worst quality, low quality"
+)
+
+job_manager = JobManager()
+comfy_pool = ComfyPool()
+# Identical generations in flight at the same time share one ComfyUI render
+comfy_flight = SingleFlight("comfyui")
+# ...and all of them see the render's progress, keyed like the flight
+render_progress = ProgressFanout()
+result_cache = ResultCache(
+    os.getenv("RESULT_CACHE_DIR", os.path.join(BASE_DIR, "cache", "results")),
+    RESULT_CACHE_MAX_MB * 1024 * 1024,
+    enabled=RESULT_CACHE_ENABLED
+)
+file_delivery.add_root("results", result_cache.directory)
+# Outputs fetched from other GPU hosts' /view, keyed by ComfyUI filename and
+# evicted oldest-fetched first (always on: without it every history/admin
+# grid view pulled full-size PNGs from the GPU hosts)
+comfy_remote_cache = ResultCache(
+    os.getenv("COMFY_REMOTE_CACHE_DIR", os.path.join(BASE_DIR, "cache", "comfy_remote")),
+    int(os.getenv("COMFY_REMOTE_CACHE_MB", "1024")) * 1024 * 1024
+)
+file_delivery.add_root("comfy_remote", comfy_remote_cache.directory)
+comfy_fetch_flight = SingleFlight("comfy-fetch")
 
-    STYLE_MODIFIERS = {
-        "clean": ", minimal design, clean background, high quality",
-        "cinematic": ", dramatic lighting, cinematic atmosphere, masterpiece",
-        "anime": ", anime style, vibrant colors, cel shaded",
-        "photoreal": ", photorealistic, highly detailed, raw photo",
-        "illustration": ", digital art, artistic illustration, detailed textures"
-    }
 
+def engineer_prompt(prompt, style):
     suffix = STYLE_MODIFIERS.get(style, "")
 
     # ---- Smart Prompt Structuring ----
     base_prompt = prompt.strip().lower()
 
     if len(base_prompt.split()) <= 2:
-        engineered_prompt = (
+        return (
             f"a single {base_prompt}, calm expression, mouth closed, "
             f"centered composition, symmetrical face, natural lighting, "
             f"realistic wildlife photography, ultra detailed"
         )
-    else:
-        engineered_prompt = (
-            f"{prompt}{suffix}, realistic, detailed, centered composition"
-        )
+    return f"{prompt}{suffix}, realistic, detailed, centered composition"
 
-    try:
-        workflow = load_workflow("text_to_image")
 
-        if not workflow:
-            return jsonify({"error": "Workflow configuration file missing"}), 500
+def generation_params(engineered_prompt, seed):
+    """Workflow slot values for a prompt-to-image request."""
+    return {
+        "prompt": engineered_prompt,
+        # ✅ Strong negative prompt (IMPORTANT FIX)
+        "negative": NEGATIVE_PROMPT,
+        # ✅ Stable Sampler Settings
+        "seed": seed,
+        "steps": 32,
+        "cfg": 6.5,
+        "sampler": "dpmpp_2m_sde",
+        "scheduler": "karras",
+        # Optional resolution control
+        "width": 512,
+        "height": 512
+    }
 
-        # ✅ Inject positive prompt
-        workflow["6"]["inputs"]["text"] = engineered_prompt
 
-        # ✅ Strong negative prompt (IMPORTANT FIX)
-        workflow["7"]["inputs"]["text"] = (
-            "aggressive, roaring, open mouth, extra head, duplicate face, "
-            "two faces, mutated, deformed, bad anatomy, distorted, "
-            "horror, scary, creepy, worst quality, low quality"
+def read_comfy_output(filename):
+    """Bytes of a ComfyUI output image (local folder or its GPU host)."""
+    local_path = os.path.join(COMFY_OUTPUT_PATH, filename)
+    if os.path.isfile(local_path):
+        with open(local_path, "rb") as f:
+            return f.read()
+    fetched = comfy_pool.fetch_output(filename)
+    return fetched[0] if fetched else None
+
+
+def history_output_filename(entry, output_node):
+    """The output node's filename in a /history entry, or None."""
+    if not entry:
+        return None
+
+    outputs = entry.get("outputs", {})
+    images = outputs.get(output_node, {}).get("images", [])
+    return images[0].get("filename") if images else None
+
+
+def poll_comfy_history(backend, prompt_id, output_node):
+    """One /history lookup; returns the output node's filename or None."""
+    return history_output_filename(comfy_pool.history(backend, prompt_id), output_node)
+
+
+# /history lookups after the websocket said "finished" without an image
+# (ComfyUI can send that just before the history entry is written)
+COMFY_CONFIRM_ATTEMPTS = 3
+COMFY_CONFIRM_DELAY = 0.5
+
+
+def wait_for_comfy_output(backend, prompt_id, waiter, output_node):
+    """
+    Blocks the job until ComfyUI reports the output image.
+    Woken by the websocket listener. Every wake-up without an image also
+    checks /history (every 5 s, or every second while the socket is down):
+    events sent while the listener was reconnecting are lost, and a prompt
+    reported finished without an image is confirmed there before failing.
+    """
+    deadline = time.time() + COMFY_TIMEOUT_SECONDS
+
+    events = backend.listener
+    misses = 0
+
+    while time.time() < deadline:
+        if waiter.wait(5 if events.connected else 1):
+            if waiter.error:
+                raise JobError(f"ComfyUI error: {waiter.error}")
+            if waiter.images:
+                return waiter.images[0].get("filename")
+
+        output_filename = poll_comfy_history(backend, prompt_id, output_node)
+        if output_filename:
+            return output_filename
+
+        if waiter.done:
+            misses += 1
+            if misses >= COMFY_CONFIRM_ATTEMPTS:
+                raise JobError("No output image produced")
+            time.sleep(COMFY_CONFIRM_DELAY)
+
+    raise JobError("Generation timed out", 504)
+
+
+def run_prompt_to_image(job, *, prompt, style, engineered_prompt, params,
+                        flight_key, cache_key, base_url):
+    """Background job: queue the workflow on ComfyUI and wait for node 9."""
+    render_progress.join(flight_key, job)
+    try:
+        output_filename = comfy_flight.do(
+            flight_key, render_text_to_image, flight_key, params, cache_key
         )
+    finally:
+        render_progress.leave(flight_key, job)
 
-        # ✅ Stable Sampler Settings
-        workflow["3"]["inputs"]["seed"] = random.randint(1, 10**15)
-        workflow["3"]["inputs"]["steps"] = 32
-        workflow["3"]["inputs"]["cfg"] = 6.5
-        workflow["3"]["inputs"]["sampler_name"] = "dpmpp_2m_sde"
-        workflow["3"]["inputs"]["scheduler"] = "karras"
+    # Job runs outside the request, so it needs its own app context for the DB
+    with app.app_context():
+        save_history(
+            tool_name="prompt_to_image",
+            input_text=prompt,
+            output_img=output_filename,
+            user_id=job.user_id
+        )
 
-        # Optional resolution control
-        workflow["5"]["inputs"]["width"] = 512
-        workflow["5"]["inputs"]["height"] = 512
+    return rendered_image_result(engineered_prompt, style, base_url, output_filename)
+
+
+def rendered_image_result(engineered_prompt, style, base_url, output_filename):
+    return {
+        "prompt": engineered_prompt,
+        "style": style,
+        "cached": False,
+        "image_url": f"{base_url}/comfy_output/{output_filename}"
+    }
+
+
+def render_text_to_image(flight_key, params, cache_key):
+    """
+    Render params on ComfyUI; returns the output filename. Progress goes to
+    every job that joined render_progress under flight_key.
+    """
+    try:
+        template = workflow_registry.get("text_to_image")
+        workflow = template.instantiate(**params)
+    except WorkflowError as e:
+        log.error("Workflow load error: %s", e)
+        raise JobError("Workflow configuration file missing")
 
-        response = requests.post(
-            "http://127.0.0.1:8188/prompt",
-            json={"prompt": workflow}
+    try:
+        backend, prompt_id = comfy_pool.submit(workflow)
+    except ComfyRejected as e:
+        log.error("ComfyUI rejected workflow: %s", e)
+        raise JobError("ComfyUI rejected workflow")
+    except ComfyUnavailable as e:
+        log.error("ComfyUI unavailable: %s", e)
+        raise JobError("ComfyUI processing error", 503)
+
+    waiter = backend.listener.register(prompt_id, template.output_node)
+    waiter.on_progress(lambda percent: render_progress.update(flight_key, percent))
+    render_progress.update(flight_key, waiter.progress)
+
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        output_filename = wait_for_comfy_output(
+            backend, prompt_id, waiter, template.output_node
         )
+        outcome = "ok"
+    finally:
+        metrics.COMFY_WAIT_LATENCY.observe(time.perf_counter() - started, outcome)
+        backend.listener.unregister(prompt_id)
+        comfy_pool.release(backend)
 
-        if response.status_code != 200:
-            return jsonify({"error": "ComfyUI rejected workflow"}), 500
+    comfy_pool.remember_output(output_filename, backend)
 
-        response_data = response.json()
-        prompt_id = response_data.get("prompt_id")
+    if cache_key:
+        try:
+            content = read_comfy_output(output_filename)
+            if content:
+                result_cache.put(cache_key, content)
+        except OSError as e:
+            log.warning("Result cache store failed: %s", e)
 
-        if not prompt_id:
-            return jsonify({"error": "Invalid response from ComfyUI"}), 500
+    return output_filename
 
-        output_filename = ""
 
-        for _ in range(30):
-            history_res = requests.get(
-                f"http://127.0.0.1:8188/history/{prompt_id}"
-            )
+def plan_prompt_to_image(data):
+    """
+    Everything prompt-to-image decides before rendering (shared with the
+    ASGI handler). Returns (plan, None) or (None, (error body, status)).
+    """
+    prompt = data["prompt"]
+    style = data.get("style", "clean")
+
+    seed = data.get("seed")
+    seed_pinned = seed is not None
+    if seed_pinned and (isinstance(seed, bool) or not isinstance(seed, int)):
+        return None, ({"success": False, "error": "Seed must be an integer"}, 400)
+
+    engineered_prompt = engineer_prompt(prompt, style)
+    params = generation_params(
+        engineered_prompt,
+        seed if seed_pinned else random.randint(1, 10**15)
+    )
+
+    try:
+        resolved = workflow_registry.get("text_to_image").resolve(**params)
+    except WorkflowError as e:
+        log.error("Workflow load error: %s", e)
+        return None, ({"error": "Workflow configuration file missing"}, 500)
+
+    flight_key = result_key("text_to_image", resolved, seed_pinned)
+    cache_key = None
+    cached_filename = None
+    if result_cache.enabled:
+        cache_key = flight_key
+        cached_filename = None if data.get("fresh") else result_cache.get(cache_key)
+
+    return {
+        "prompt": prompt,
+        "style": style,
+        "engineered_prompt": engineered_prompt,
+        "params": params,
+        "flight_key": flight_key,
+        "cache_key": cache_key,
+        "cached_filename": cached_filename,
+    }, None
 
-            if history_res.status_code != 200:
-                time.sleep(1)
-                continue
 
-            history_json = history_res.json()
+def cached_image_response(plan, base_url):
+    return {
+        "success": True,
+        "status": "done",
+        "cached": True,
+        "prompt": plan["engineered_prompt"],
+        "style": plan["style"],
+        "image_url": f"{base_url}/comfy_output/{plan['cached_filename']}"
+    }
+
 
-            if prompt_id in history_json:
-                outputs = history_json[prompt_id].get("outputs", {})
+def job_submitted_response(job, plan):
+    return {
+        "success": True,
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/jobs/{job.id}",
+        "result_url": f"/api/jobs/{job.id}/result",
+        "prompt": plan["engineered_prompt"],
+        "style": plan["style"]
+    }
 
-                if "9" in outputs:
-                    images = outputs["9"].get("images", [])
-                    if images:
-                        output_filename = images[0].get("filename")
-                        break
 
-            time.sleep(1)
+@tools.route("/api/prompt-to-image", name="prompt_to_image",
+             json_fields={"prompt": "Prompt"})
+def prompt_to_image(current_user):
+    """
+    Submits a ComfyUI generation and returns a job id right away (202).
+    Poll GET /api/jobs/<job_id> (optionally with ?wait=<seconds>) for status.
 
-        if not output_filename:
-            return jsonify({"error": "Generation timed out"}), 504
+    Optional body fields:
+    - seed:  pin the sampler seed (also makes it part of the cache key)
+    - fresh: true to skip the result cache and force a new render
+    A result cache hit returns 200 with the image straight away.
+    """
+    plan, error = plan_prompt_to_image(request.get_json())
+    if error:
+        return jsonify(error[0]), error[1]
 
-    except Exception as e:
-        print(f"!!! ERROR DETECTED: {e}")
-        return jsonify({"error": "ComfyUI processing error"}), 500
+    base_url = request.host_url.rstrip('/')
+    if plan["cached_filename"]:
+        save_history(
+            tool_name="prompt_to_image",
+            input_text=plan["prompt"],
+            output_img=plan["cached_filename"],
+            user_id=current_user.id
+        )
+        return jsonify(cached_image_response(plan, base_url))
+
+    job = job_manager.submit(
+        current_user.id,
+        "prompt_to_image",
+        run_prompt_to_image,
+        prompt=plan["prompt"],
+        style=plan["style"],
+        engineered_prompt=plan["engineered_prompt"],
+        params=plan["params"],
+        flight_key=plan["flight_key"],
+        cache_key=plan["cache_key"],
+        base_url=base_url
+    )
+
+    return jsonify(job_submitted_response(job, plan)), 202
 
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job_status(job_id):
+    """
+    Cheap job status. ?wait=<seconds> long-polls until the job finishes
+    (capped at JOB_WSGI_POLL_MAX seconds here, JOB_LONG_POLL_MAX under asgi).
+    """
     current_user, error = get_current_user()
     if error:
         return error
 
-    save_history(
-        tool_name="prompt_to_image",
-        input_text=prompt,
-        output_img=output_filename,
-        user_id=current_user.id
-    )
+    job = job_manager.get(job_id, user_id=current_user.id)
+    if not job:
+        return jsonify({"success": False, "error": "Job not found"}), 404
 
-    return jsonify({
-        "success": True,
-        "prompt": engineered_prompt,
-        "style": style,
-        "image_url": f"http://127.0.0.1:5000/comfy_output/{output_filename}"
-    })
+    wait = request.args.get("wait", type=float) or 0
+    if wait > 0 and not job.finished:
+        job.wait(min(wait, JOB_WSGI_POLL_MAX))
+
+    return jsonify(job.to_dict())
+
+
+@app.route("/api/jobs/<job_id>/result", methods=["GET"])
+def get_job_result(job_id):
+    """Final result: 200 when done, 202 while pending, error code on failure."""
+    current_user, error = get_current_user()
+    if error:
+        return error
+
+    job = job_manager.get(job_id, user_id=current_user.id)
+    if not job:
+        return jsonify({"success": False, "error": "Job not found"}), 404
+
+    if not job.finished:
+        return jsonify(job.to_dict()), 202
+
+    if job.status == FAILED:
+        return jsonify(job.to_dict()), job.status_code
+
+    return jsonify(job.to_dict())
 # ======================================================
 # EXISTING: PROMPT → IMAGE (KEEP AS IS)
 # ======================================================
@@ -447,8 +937,9 @@ def prompt_to_image():
 # ======================================================
 # ✅ NEW: IMAGE → STYLE (FOR YOUR FRONTEND FILE)
 # ======================================================
-@app.route("/api/image-to-style", methods=["POST"])
-def image_to_style():
+@tools.route("/api/image-to-style", name="image_to_style",
+             files={"image": "Image file"})
+def image_to_style(current_user):
     """
     TEMPORARY MOCK API
     - Accepts uploaded image
@@ -464,9 +955,6 @@ def image_to_style():
     prompt = request.form.get("prompt", "")
     style = request.form.get("style", "cinematic")
 
-    if not image_file:
-        return jsonify({"error": "Image file is required"}), 400
-
     # 3️⃣ TEMP: Ignore uploaded image (for now)
     # Later: you will process it with AI
 
@@ -477,16 +965,8 @@ def image_to_style():
             "error": "test.jpg not found",
             "details": "Place test.jpg inside backend/generated folder"
         }), 404
-    filename = image_file.filename
-    image_file.save(os.path.join(GENERATED_FOLDER, filename))
-
-     # Step 1: Check if user is logged in (validate token)
-    current_user, error = get_current_user()
-    if error:
-        return error  # Returns 401 if token is missing/invalid
+    filename = upload_store.save(image_file)
 
-    
-    
     save_history(
     tool_name="image_to_style",
     input_img=filename,   # ✅ real file
@@ -507,8 +987,9 @@ def image_to_style():
 # ======================================================
 # ✅ NEW: SPECS TRY-ON (MOCK)
 # ======================================================
-@app.route("/api/specs-tryon", methods=["POST"])
-def specs_tryon():
+@tools.route("/api/specs-tryon", name="specs_tryon",
+             files={"face": "Face image", "specs": "Specs image"})
+def specs_tryon(current_user):
     """
     MOCK SPECS TRY-ON API
     - Requires face image
@@ -521,13 +1002,6 @@ def specs_tryon():
     specs_image = request.files.get("specs")
     prompt = request.form.get("prompt", "")
 
-    # 🔴 VALIDATION
-    if not face_image or not specs_image:
-        return jsonify({
-            "success": False,
-            "error": "Face image and Specs image are required"
-        }), 400
-
     test_image_path = os.path.join(GENERATED_FOLDER, "test.jpg")
 
     if not os.path.exists(test_image_path):
@@ -536,18 +1010,8 @@ def specs_tryon():
             "error": "test.jpg not found in generated folder"
         }), 404
     
-    face_image = request.files.get("face")
-    specs_image = request.files.get("specs")
-    face_name = face_image.filename
-    specs_name = specs_image.filename
-    
-    face_image.save(os.path.join(GENERATED_FOLDER, face_name))
-    specs_image.save(os.path.join(GENERATED_FOLDER, specs_name))
-    
-    # Step 1: Check if user is logged in (validate token)
-    current_user, error = get_current_user()
-    if error:
-        return error  # Returns 401 if token is missing/invalid
+    face_name = upload_store.save(face_image)
+    specs_name = upload_store.save(specs_image)
 
     save_history(
     tool_name="specs_tryon",
@@ -568,8 +1032,9 @@ def specs_tryon():
 # ======================================================
 # ✅ NEW: HAIRCUT PREVIEW (MOCK)
 # ======================================================
-@app.route("/api/haircut-preview", methods=["POST"])
-def haircut_preview():
+@tools.route("/api/haircut-preview", name="haircut_preview",
+             files={"you": "Your photo", "sample": "Haircut sample"})
+def haircut_preview(current_user):
     """
     MOCK HAIRCUT PREVIEW API
     - Requires user photo
@@ -585,14 +1050,7 @@ def haircut_preview():
     # 2️⃣ Optional prompt
     prompt = request.form.get("prompt", "")
 
-    # 3️⃣ Validation
-    if not user_image or not sample_image:
-        return jsonify({
-            "success": False,
-            "error": "Both user image and haircut sample are required"
-        }), 400
-
-    # 4️⃣ TEMP MOCK OUTPUT
+    # 3️⃣ TEMP MOCK OUTPUT
     test_image_path = os.path.join(GENERATED_FOLDER, "test.jpg")
 
     if not os.path.exists(test_image_path):
@@ -602,15 +1060,8 @@ def haircut_preview():
         }), 404
     
     
-    user_name = user_image.filename
-    sample_name = sample_image.filename
-    user_image.save(os.path.join(GENERATED_FOLDER, user_name))
-    sample_image.save(os.path.join(GENERATED_FOLDER, sample_name))
-    
-      # Step 1: Check if user is logged in (validate token)
-    current_user, error = get_current_user()
-    if error:
-        return error  # Returns 401 if token is missing/invalid
+    user_name = upload_store.save(user_image)
+    sample_name = upload_store.save(sample_image)
 
     save_history(
     tool_name="haircut_preview",
@@ -633,8 +1084,9 @@ def haircut_preview():
 # ======================================================
 # ✅ NEW: INSTA STORY TEMPLATE (MOCK)
 # ======================================================
-@app.route("/api/insta-story-template", methods=["POST"])
-def insta_story_template():
+@tools.route("/api/insta-story-template", name="insta_story",
+             json_fields={"overlay_text": "Overlay text"})
+def insta_story_template(current_user):
     """
     MOCK Insta Story Generator
     - Accepts overlay text
@@ -642,17 +1094,10 @@ def insta_story_template():
     - Returns test.jpg
     """
 
-    data = request.json
-    overlay_text = data.get("overlay_text", "")
-    print(overlay_text)
+    data = request.get_json()
+    overlay_text = data["overlay_text"]
     template = data.get("template", "minimal")
-    print(template)
-    if not overlay_text:
-        return jsonify({
-            "success": False,
-            "error": "Overlay text is required"
-        }), 400
-    
+
     test_image_path = os.path.join(GENERATED_FOLDER, "test.jpg")
 
     if not os.path.exists(test_image_path):
@@ -660,12 +1105,6 @@ def insta_story_template():
             "success": False,
             "error": "test.jpg not found in generated folder"
         }), 404
-    
-      # Step 1: Check if user is logged in (validate token)
-    current_user, error = get_current_user()
-    if error:
-        return error  # Returns 401 if token is missing/invalid
-
 
     save_history(
     tool_name="insta_story",
@@ -687,19 +1126,8 @@ def insta_story_template():
 # ======================================================
 # ✅ NEW: PROMPT ENHANCER (AI)
 # ======================================================
-@app.route("/api/enhance-prompt", methods=["POST"])
-def enhance_prompt():
-    try:
-        data = request.get_json()
-        simple_prompt = data.get("prompt", "").strip()
-
-        if not simple_prompt:
-            return jsonify({
-                "success": False,
-                "error": "Prompt cannot be empty"
-            }), 400
-
-        instruction = f"""
+def enhance_instruction(simple_prompt):
+    return f"""
 You are an expert prompt engineer for AI image generation models.
 
 Enhance the following simple prompt into a vivid, professional, high-quality image generation prompt.
@@ -718,13 +1146,21 @@ Respond with ONLY the enhanced prompt.
 Limit to 1–2 sentences.
 """
 
-        response = prompt_model.generate_content(instruction)
-        enhanced_prompt = response.text.strip()
 
-        # Step 1: Check if user is logged in (validate token)
-        current_user, error = get_current_user()
-        if error:
-            return error  # Returns 401 if token is missing/invalid
+@tools.route("/api/enhance-prompt", name="prompt_enhancer",
+             json_fields={"prompt": "Prompt"})
+def enhance_prompt(current_user):
+    try:
+        data = request.get_json()
+        simple_prompt = data["prompt"].strip()
+        instruction = enhance_instruction(simple_prompt)
+
+        if wants_stream():
+            return sse_response(
+                stream_enhanced_prompt(simple_prompt, instruction, current_user.id)
+            )
+
+        enhanced_prompt = gemini.generate("prompt_enhancer", instruction)
 
         save_history(
             tool_name="prompt_enhancer",
@@ -739,47 +1175,63 @@ Limit to 1–2 sentences.
             "enhanced_prompt": enhanced_prompt
         })
 
+    except GeminiUnavailable as e:
+        log.warning("Prompt enhancer unavailable: %s", e)
+        return jsonify({
+            "success": False,
+            "error": "Prompt enhancer is temporarily unavailable, please retry"
+        }), 503
+
     except Exception as e:
-        print("[ERROR] Prompt Enhancer:", str(e))
+        log.exception("Prompt enhancer failed")
         return jsonify({
             "success": False,
             "error": str(e)
         }), 500
      
-    # ======================================================
-# ✅ NEW: INSTA POST GENERATOR (MOCK)
-# ======================================================
-@app.route("/api/insta-post-generator", methods=["POST"])
-def insta_post_generator():
-
-    # 🔐 AUTH MUST BE FIRST
-    current_user, error = get_current_user()
-    if error:
-        return error
-
-    image = request.files.get("image")
-    prompt = request.form.get("prompt", "").strip()
 
-    has_text = bool(prompt)
-    has_image = image is not None
 
-    test_image_path = os.path.join(GENERATED_FOLDER, "test.jpg")
-    if not os.path.exists(test_image_path):
-        return jsonify({
+def stream_enhanced_prompt(simple_prompt, instruction, user_id):
+    """SSE: one "token" event per Gemini chunk, then "done" (or "error")."""
+    parts = []
+    try:
+        for chunk in gemini.stream("prompt_enhancer", instruction):
+            parts.append(chunk)
+            yield sse_event("token", {"text": chunk})
+    except GeminiUnavailable as e:
+        log.warning("Prompt enhancer unavailable (stream): %s", e)
+        yield sse_event("error", {
             "success": False,
-            "error": "test.jpg not found in generated folder"
-        }), 404
+            "error": "Prompt enhancer is temporarily unavailable, please retry"
+        })
+        return
 
-    # SAVE INPUT IMAGE
-    filename = None
-    if image:
-        filename = image.filename
-        image.save(os.path.join(GENERATED_FOLDER, filename))
+    enhanced_prompt = "".join(parts).strip()
+    try:
+        save_history(
+            tool_name="prompt_enhancer",
+            input_text=simple_prompt,
+            output_text=enhanced_prompt,
+            user_id=user_id
+        )
+    except Exception:
+        # The 200 and the tokens are already sent: report it in-stream
+        log.exception("Prompt enhancer failed to save history (stream)")
+        db.session.rollback()
+        yield sse_event("error", {"success": False, "error": "Could not save the result"})
+        return
+    yield sse_event("done", {
+        "success": True,
+        "original_prompt": simple_prompt,
+        "enhanced_prompt": enhanced_prompt
+    })
 
-    caption = ""
-    hashtags = ""
-    tips = "💡 Engage with your audience by asking a question."
 
+# ======================================================
+# ✅ NEW: INSTA POST GENERATOR (MOCK)
+# ======================================================
+def insta_post_defaults(has_image, has_text):
+    """Caption, hashtags and tips used when Gemini adds nothing."""
     # ============================
     # DEFAULT LOGIC (UNCHANGED)
     # ============================
@@ -798,12 +1250,14 @@ def insta_post_generator():
         )
         hashtags = "#GanpatiBappa #Faith #InnerPeace"
         tips = "📍 Location-based hashtags help reach more people"
+    return caption, hashtags, tips
+
 
+def insta_post_instruction(prompt):
     # ============================
     # GEMINI GENERATION (NEW)
     # ============================
-    try:
-        instruction = f"""
+    return f"""
 You are an Instagram content expert.
 
 Generate:
@@ -817,21 +1271,19 @@ Based on this input:
 Give short and clean output.
 """
 
-        response = prompt_model.generate_content(instruction)
-        ai_text = response.text.strip()
 
-        # Try parsing Gemini output (simple split)
-        if ai_text:
-            parts = ai_text.split("\n")
+def finish_insta_post(ai_text, defaults, *, filename, prompt, user_id, image_url):
+    """Merge Gemini's answer over the defaults, save history, build the reply."""
+    caption, hashtags, tips = defaults
 
-            if len(parts) >= 3:
-                caption = parts[0]
-                hashtags = parts[1]
-                tips = parts[2]
+    # Try parsing Gemini output (simple split)
+    if ai_text:
+        parts = ai_text.split("\n")
 
-    except Exception as gemini_error:
-        print("⚠ Gemini failed, using default content")
-        # ❌ DO NOTHING → your default stays
+        if len(parts) >= 3:
+            caption = parts[0]
+            hashtags = parts[1]
+            tips = parts[2]
 
     # ============================
     # SAVE HISTORY
@@ -853,39 +1305,90 @@ Tips:
         input_text=prompt,
         output_text=combined_output,
         output_img="test.jpg",
-        user_id=current_user.id
+        user_id=user_id
     )
 
-    return jsonify({
+    return {
         "success": True,
-        "image_url": get_full_url("test.jpg"),
+        "image_url": image_url,
         "caption": caption,
         "hashtags": hashtags,
         "tips": tips
-    })
-# ======================================================
-# ✅ Safety Gear Try ON
-# ======================================================
+    }
 
 
-@app.route("/api/safety-gear", methods=["POST"])
-def safety_gear():
-    try:
-        image_file = request.files.get("image")
-        prompt = request.form.get("prompt", "").strip()
+@tools.route("/api/insta-post-generator", name="insta_post",
+             optional_files=("image",))
+def insta_post_generator(current_user):
+    image = request.files.get("image")
+    prompt = request.form.get("prompt", "").strip()
 
-        if not image_file:
-            return jsonify({"success": False, "error": "Image file is required"}), 400
+    has_text = bool(prompt)
+    has_image = image is not None
 
-        if not prompt:
-            return jsonify({"success": False, "error": "Prompt is required"}), 400
+    test_image_path = os.path.join(GENERATED_FOLDER, "test.jpg")
+    if not os.path.exists(test_image_path):
+        return jsonify({
+            "success": False,
+            "error": "test.jpg not found in generated folder"
+        }), 404
 
-        test_image_path = os.path.join(GENERATED_FOLDER, "test.jpg")
+    # SAVE INPUT IMAGE
+    filename = None
+    if image:
+        filename = upload_store.save(image)
+
+    defaults = insta_post_defaults(has_image, has_text)
+    instruction = insta_post_instruction(prompt)
+
+    def finish(ai_text):
+        return finish_insta_post(
+            ai_text, defaults,
+            filename=filename,
+            prompt=prompt,
+            user_id=current_user.id,
+            image_url=get_full_url("test.jpg")
+        )
 
-        if not os.path.exists(test_image_path):
-            return jsonify({"success": False, "error": "test.jpg not found"}), 404
+    if wants_stream():
+        def events():
+            chunks = []
+            try:
+                # "" → keep the default caption / hashtags / tips
+                for chunk in gemini.stream("insta_post", instruction, fallback=""):
+                    chunks.append(chunk)
+                    yield sse_event("token", {"text": chunk})
+            except GeminiUnavailable:
+                log.warning("Gemini failed mid-stream, using default content")
+                chunks = []
+            try:
+                result = finish("".join(chunks).strip())
+            except Exception:
+                log.exception("Insta post failed to save history (stream)")
+                db.session.rollback()
+                yield sse_event("error", {"success": False, "error": "Could not save the result"})
+                return
+            yield sse_event("done", result)
+
+        return sse_response(events())
+
+    # "" → keep the default caption / hashtags / tips
+    ai_text = gemini.generate("insta_post", instruction, fallback="")
+
+    return jsonify(finish(ai_text))
+# ======================================================
+# ✅ Safety Gear Try ON
+# ======================================================
+
+
+SAFETY_GEAR_FALLBACK = (
+    "For safety, use a certified helmet, gloves, and protective clothing. "
+    "Ensure visibility with reflective gear and follow basic safety precautions."
+)
 
-        instruction = f"""
+
+def safety_gear_instruction(prompt):
+    return f"""
 You are a helpful assistant.
 Suggest commonly used safety gear for the activity below.
 
@@ -893,29 +1396,30 @@ Activity: {prompt}
 
 Give 2–3 short lines.
 """
-        filename = image_file.filename
-        image_file.save(os.path.join(GENERATED_FOLDER, filename))
-            
 
-        try:
-            response = prompt_model.generate_content(instruction)
-            advice_text = response.text.strip()
-
-        except Exception as gemini_error:
-            print("⚠ Gemini quota exceeded, using fallback")
-            advice_text = (
-                "For safety, use a certified helmet, gloves, and protective clothing. "
-                "Ensure visibility with reflective gear and follow basic safety precautions."
-            )
 
+@tools.route("/api/safety-gear", name="safety_gear",
+             files={"image": "Image file"}, form_fields={"prompt": "Prompt"})
+def safety_gear(current_user):
+    try:
+        image_file = request.files.get("image")
+        prompt = request.form.get("prompt", "").strip()
+
+        test_image_path = os.path.join(GENERATED_FOLDER, "test.jpg")
+
+        if not os.path.exists(test_image_path):
+            return jsonify({"success": False, "error": "test.jpg not found"}), 404
+
+        instruction = safety_gear_instruction(prompt)
+        filename = upload_store.save(image_file)
             
-         # Step 1: Check if user is logged in (validate token)
-        current_user, error = get_current_user()
-        if error:
-            return error  # Returns 401 if token is missing/invalid
 
+        advice_text = gemini.generate(
+            "safety_gear",
+            instruction,
+            fallback=SAFETY_GEAR_FALLBACK
+        )
 
-           
         save_history(
     tool_name="safety_gear",
     input_text=prompt,
@@ -934,8 +1438,8 @@ Give 2–3 short lines.
 "image_url": get_full_url("test.jpg")
         })
 
-    except Exception as e:
-        print("❌ Safety Gear Error:", str(e))
+    except Exception:
+        log.exception("Safety gear failed")
         return jsonify({
             "success": False,
             "error": "Internal server error"
@@ -948,17 +1452,12 @@ Give 2–3 short lines.
 # ✅ Story Image Generator
 # ======================================================
 
-@app.route("/api/story-image-generater", methods=["POST"])
-def story_image_generater():
+@tools.route("/api/story-image-generater", name="story_image",
+             json_fields={"prompt": "Prompt"})
+def story_image_generater(current_user):
     try:
-        data = request.get_json() or {}
-        prompt = data.get("prompt", "").strip()
-
-        if not prompt:
-            return jsonify({
-                "success": False,
-                "error": "Prompt is required"
-            }), 400
+        data = request.get_json()
+        prompt = data["prompt"].strip()
 
         image_path = os.path.join(GENERATED_FOLDER, "test.jpg")
 
@@ -967,13 +1466,6 @@ def story_image_generater():
                 "success": False,
                 "error": "test.jpg not found"
             }), 404
-        
-
-              
-         # Step 1: Check if user is logged in (validate token)
-        current_user, error = get_current_user()
-        if error:
-            return error  # Returns 401 if token is missing/invalid
 
         save_history(
     tool_name="story_image",
@@ -991,7 +1483,7 @@ def story_image_generater():
         })
 
     except Exception as e:
-        print("Story Image Generator Error:", e)
+        log.exception("Story image generator failed")
         return jsonify({
             "success": False,
             "error": str(e)
@@ -1008,17 +1500,30 @@ def story_image_generater():
 
 
 
-@app.route("/api/posture-analyze", methods=["POST"])
-def posture_analyze():
+POSTURE_INSTRUCTION = """
+You are a posture correction expert.
+
+Analyze the posture and give 3 short improvement tips.
+Keep it beginner-friendly.
+"""
+POSTURE_FALLBACK = (
+    "• Keep your spine straight and shoulders relaxed\n"
+    "• Adjust screen height to eye level\n"
+    "• Avoid bending your neck forward for long periods"
+)
+POSTURE_SCORES = {
+    "spine": 80,
+    "neck": 45,
+    "shoulder": 70
+}
+
+
+@tools.route("/api/posture-analyze", name="posture_analyzer",
+             files={"image": "Image"})
+def posture_analyze(current_user):
     try:
         image_file = request.files.get("image")
 
-        if not image_file:
-            return jsonify({
-                "success": False,
-                "error": "Image is required"
-            }), 400
-
         # ---------------------------------
         # TEMP: Always return test.jpg
         # ---------------------------------
@@ -1033,41 +1538,16 @@ def posture_analyze():
         # ---------------------------------
         # SAVE INPUT IMAGE
         # ---------------------------------
-        filename = image_file.filename
-        image_file.save(os.path.join(GENERATED_FOLDER, filename))
-
-        # ---------------------------------
-        # AI INSTRUCTION
-        # ---------------------------------
-        instruction = """
-You are a posture correction expert.
-
-Analyze the posture and give 3 short improvement tips.
-Keep it beginner-friendly.
-"""
+        filename = upload_store.save(image_file)
 
         # ---------------------------------
         # GEMINI WITH FALLBACK
         # ---------------------------------
-        try:
-            response = prompt_model.generate_content(instruction)
-            suggestions = response.text.strip()
-
-        except Exception as e:
-            print("⚠ Gemini quota exceeded:", e)
-            suggestions = (
-                "• Keep your spine straight and shoulders relaxed\n"
-                "• Adjust screen height to eye level\n"
-                "• Avoid bending your neck forward for long periods"
-            )
-
-
-                 
-         # Step 1: Check if user is logged in (validate token)
-        current_user, error = get_current_user()
-        if error:
-            return error  # Returns 401 if token is missing/invalid
-
+        suggestions = gemini.generate(
+            "posture_analyzer",
+            POSTURE_INSTRUCTION,
+            fallback=POSTURE_FALLBACK
+        )
         # ---------------------------------
         # ALWAYS SAVE HISTORY ✅
         # ---------------------------------
@@ -1087,15 +1567,11 @@ Keep it beginner-friendly.
             "success": True,
 "corrected_image_url": get_full_url("test.jpg"),
             "suggestions": suggestions,
-            "scores": {
-                "spine": 80,
-                "neck": 45,
-                "shoulder": 70
-            }
+            "scores": POSTURE_SCORES
         })
 
-    except Exception as e:
-        print("❌ Posture Analyze Error:", e)
+    except Exception:
+        log.exception("Posture analyze failed")
         return jsonify({
             "success": False,
             "error": "Internal server error"
@@ -1106,22 +1582,38 @@ Keep it beginner-friendly.
 
 def init_db():
     with app.app_context():   # ✅ REQUIRED
-        from models import User, History
-        db.create_all()
-        print("✅ Database tables created")
+        run_migrations(db.engine)
+        log.info("Database tables created")
+
+
+# Optional write-behind: rows are queued and bulk-inserted by a background
+# thread (see history_writer.py); started below once migrations have run.
+history_writer = HistoryWriter(
+    app, db, History.__table__,
+    os.getenv("HISTORY_SPILL_DIR", os.path.join(BACKEND_DIR, "cache", "history_spill"))
+) if HISTORY_WRITE_BEHIND else None
+if history_writer is not None:
+    # Usage counters are bumped in the same transaction as each batch
+    history_writer.after_flush(usage_stats.record_usage)
 
 
 def save_history(*,tool_name, user_id,input_text=None, input_img=None,
                  output_text=None, output_img=None):
-    history = History(
-        tool_name=tool_name,
-        input_text=input_text,
-        input_img=input_img,
-        output_text=output_text,
-        output_img=output_img,
-        user_id=user_id
-    )
-    db.session.add(history)
+    row = {
+        "tool_name": tool_name,
+        "input_text": input_text,
+        "input_img": input_img,
+        "output_text": output_text,
+        "output_img": output_img,
+        "user_id": user_id,
+        "created_at": datetime.utcnow(),
+    }
+    if history_writer is not None and history_writer.enqueue(row):
+        return
+
+    # Write-behind disabled or its queue is full: commit synchronously
+    db.session.add(History(**row))
+    usage_stats.record_usage(db.session.connection(), [row])
     db.session.commit()
 
 @app.route('/api/admin/users', methods=['GET'])
@@ -1160,8 +1652,12 @@ def delete_user(user_id):
     # Step 3: Find and delete user
     user = User.query.get_or_404(user_id)
     History.query.filter_by(user_id=user_id).delete()  # Delete user's todos first
+    usage_stats.delete_user_usage(db.session.connection(), user_id)
+    usage_stats.add_users(db.session.connection(), -1)
     db.session.delete(user)
     db.session.commit()
+    # Cached logins of the deleted user must stop working right away
+    invalidate_user(user_id)
 
     return jsonify({'message': f'User {user.username} deleted'})
 
@@ -1175,51 +1671,193 @@ def get_stats():
     if error:
         return error
 
-    total_users = User.query.count()
-    total_history = History.query.count()
+    # Served from the usage_rollup counters, never from a history scan
+    conn = db.session.connection()
+    stats = usage_stats.totals(conn)
+    tools = usage_stats.per_tool(conn)
+
+    return jsonify({
+        'total_users': usage_stats.user_count(conn),
+        **stats,
+        'pending_history': stats['total_history'] - stats['completed_history'],
+        'top_tool': tools[0]['tool_name'] if tools else None
+    })
 
-    # If you don't have a "completed" field, remove this logic
-    completed_history = 0
+def stats_days_arg(default=None):
+    days = request.args.get('days', type=int) or default
+    return min(max(days, 1), 366) if days else None
 
+@app.route('/api/admin/stats/tools', methods=['GET'])
+def get_tool_stats():
+    current_user, error = get_admin_user()
+    if error:
+        return error
+
+    days = stats_days_arg()
     return jsonify({
-        'total_users': total_users,
-        'total_history': total_history,
-        'completed_history': completed_history,
-        'pending_history': total_history - completed_history
+        'days': days,
+        'tools': usage_stats.per_tool(db.session.connection(), days)
     })
 
-@app.route('/api/admin/history', methods=['GET'])
-def get_all_history():
+@app.route('/api/admin/stats/daily-active', methods=['GET'])
+def get_daily_active_stats():
     current_user, error = get_admin_user()
     if error:
         return error
 
-    histories = History.query.order_by(History.created_at.asc()).all()
-    result = []
-    for item in histories:
-        user = User.query.get(item.user_id)
-        
-        
-        input_imgs = []
-        output_imgs = []
+    days = stats_days_arg(default=30)
+    return jsonify({
+        'days': days,
+        'daily': usage_stats.daily_active(db.session.connection(), days)
+    })
+
+@app.route('/api/admin/stats/top-users', methods=['GET'])
+def get_top_user_stats():
+    current_user, error = get_admin_user()
+    if error:
+        return error
 
-        if item.input_img:
-            input_imgs = [img.strip() for img in item.input_img.split(',') if img.strip()]
-        if item.output_img:
-            output_imgs = [f"/{img.strip()}" for img in item.output_img.split(',') if img.strip()]
+    days = stats_days_arg()
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    top = usage_stats.top_users(db.session.connection(), days, limit)
 
-        result.append({
-            "id": item.id,
-            "tool_name": item.tool_name,
-            "input_text": item.input_text,
-            "input_imgs": input_imgs,   
-            "output_text": item.output_text,
-            "output_imgs": output_imgs,  
-            "created_at": item.created_at.strftime("%m-%d-%Y %H:%M:%S"),
-            "username": user.username if user else "Unknown"
-        })
+    names = dict(
+        db.session.query(User.id, User.username)
+        .filter(User.id.in_([t['user_id'] for t in top]))
+    ) if top else {}
+    for t in top:
+        t['username'] = names.get(t['user_id'])
+
+    return jsonify({'days': days, 'users': top})
+
+@app.route('/api/admin/comfy-backends', methods=['GET'])
+def get_comfy_backends():
+    current_user, error = get_admin_user()
+    if error:
+        return error
+
+    return jsonify({'backends': comfy_pool.status()})
 
-    return jsonify({'history': result})
+@app.route('/api/admin/cache-stats', methods=['GET'])
+def get_cache_stats():
+    current_user, error = get_admin_user()
+    if error:
+        return error
+
+    return jsonify({
+        'result_cache': result_cache.stats(),
+        'comfy_remote_cache': comfy_remote_cache.stats(),
+        'llm_cache': llm_cache.stats(),
+        'single_flight': [gemini.flight.stats(), comfy_flight.stats()],
+        'history_writer': history_writer.stats() if history_writer else {'enabled': False},
+        'auth_principals': principal_cache.stats(),
+        'logging': logging_stats(),
+        'password_hasher': password_hasher.stats(),
+        'upload_store': upload_store.stats(),
+        'thumbnails': thumbnails.stats(),
+        'assets': assets.stats(),
+        'file_delivery': file_delivery.stats()
+    })
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    # Scraped by Prometheus, not a user: optional shared token, no JWT
+    if metrics.METRICS_TOKEN and \
+            request.headers.get('Authorization') != f"Bearer {metrics.METRICS_TOKEN}":
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/admin/gemini', methods=['GET'])
+def get_gemini_status():
+    current_user, error = get_admin_user()
+    if error:
+        return error
+
+    return jsonify(gemini.stats())
+
+ADMIN_HISTORY_PAGE_SIZE = 100
+ADMIN_HISTORY_PAGE_MAX = 5000
+
+
+@app.route('/api/admin/history', methods=['GET'])
+def get_all_history():
+    """
+    All users' history, newest first, as one joined + keyset-paginated query.
+
+    Query params: limit (default 100, max 5000), cursor, user_id, tool_name,
+    from, to. Rows are serialized while they are read from the cursor
+    (yield_per), so memory stays flat whatever the page size.
+    """
+    current_user, error = get_admin_user()
+    if error:
+        return error
+
+    try:
+        _, cursor, tool_name, date_from, date_to = history_page_args()
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD or ISO format'}), 400
+
+    limit = request.args.get('limit', ADMIN_HISTORY_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, ADMIN_HISTORY_PAGE_MAX))
+    user_id = request.args.get('user_id', type=int)
+
+    query = db.session.query(
+        History.id, History.tool_name, History.input_text, History.input_img,
+        History.output_text, History.output_img, History.created_at,
+        User.username
+    ).outerjoin(User, User.id == History.user_id)
+
+    if cursor:
+        query = query.filter(History.id < cursor)
+    if user_id:
+        query = query.filter(History.user_id == user_id)
+    if tool_name:
+        query = query.filter(History.tool_name == tool_name)
+    if date_from:
+        query = query.filter(History.created_at >= date_from)
+    if date_to:
+        query = query.filter(History.created_at < date_to)
+
+    # One extra row tells us whether there is a next page
+    rows = query.order_by(History.id.desc()).limit(limit + 1).yield_per(500)
+
+    def generate():
+        yield '{"history": ['
+        last_id = None
+        count = 0
+        has_more = False
+        for item in rows:
+            if count == limit:
+                has_more = True
+                break
+
+            input_imgs = []
+            output_imgs = []
+
+            if item.input_img:
+                input_imgs = [img.strip() for img in item.input_img.split(',') if img.strip()]
+            if item.output_img:
+                output_imgs = [f"/{img.strip()}" for img in item.output_img.split(',') if img.strip()]
+
+            row = json.dumps({
+                "id": item.id,
+                "tool_name": item.tool_name,
+                "input_text": item.input_text,
+                "input_imgs": input_imgs,
+                "output_text": item.output_text,
+                "output_imgs": output_imgs,
+                "created_at": item.created_at.strftime("%m-%d-%Y %H:%M:%S") if item.created_at else None,
+                "username": item.username or "Unknown"
+            })
+            yield row if count == 0 else ',' + row
+            last_id = item.id
+            count += 1
+
+        next_cursor = json.dumps(str(last_id) if has_more else None)
+        yield f'], "next_cursor": {next_cursor}, "limit": {limit}}}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
 
 
 
@@ -1237,12 +1875,21 @@ db.init_app(app)
 
 # MOVE THIS OUTSIDE THE __main__ BLOCK
 with app.app_context():
-    db.create_all()
-    print("✅ Database tables verified/created")
+    # Versioned schema migrations (creates tables on a fresh database)
+    run_migrations(db.engine)
+    log.info("Database tables verified/created")
+    metrics.instrument_engine(db.engine)
+
+if history_writer is not None:
+    # Replays rows left in spill files by crashed workers, then starts flushing
+    history_writer.start()
 if __name__ == "__main__":
+    debug = os.getenv("FLASK_DEBUG", "True") == "True"
+    # Development server: pick up Frontend/ edits without a restart
+    assets.watch = assets.watch or debug
     app.run(
         # Changing this to "0.0.0.0" opens the door for outside connections
         host="0.0.0.0", 
         port=5000, 
-        debug=os.getenv("FLASK_DEBUG", "True") == "True"
+        debug=debug
     )
\ No newline at end of file
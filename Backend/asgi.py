@@ -0,0 +1,589 @@
+# =============================================================================
+# ASGI SERVING MODE (async tool endpoints, Flask for everything else)
+# =============================================================================
+# Run from Backend/ with:
+#   uvicorn asgi:app --host 0.0.0.0 --port 5000
+#
+# The routes below are coroutines with the same URLs and JSON as in app.py;
+# every other request goes to the Flask app unchanged (WSGI, thread pool):
+#   POST /api/prompt-to-image         the render is an asyncio task: httpx to
+#                                     ComfyUI, then awaits the websocket waiter
+#   GET  /api/jobs/<id>[/result]      ?wait= long-polls without a thread
+#   POST /api/enhance-prompt, /api/insta-post-generator, /api/safety-gear,
+#        /api/posture-analyze         Gemini through generate_content_async
+# Database, upload and cache-file work runs in Starlette's thread pool. Only
+# network waits are async, and they hold no thread, so one process can keep
+# thousands of generations waiting on the GPU. SSE requests (?stream=1) and
+# the mock tools, which only touch disk and the DB, are served by Flask.
+#
+# Needs starlette, httpx and python-multipart (plus a2wsgi, if installed,
+# for the Flask mount); `python app.py` and WSGI servers don't.
+
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:  # pragma: no cover - optional dependency
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+import app as backend
+import metrics
+from auth import bearer_token, load_principal, principal_cache
+from comfy_client import AsyncComfyClient, ComfyRejected, ComfyUnavailable
+from gemini_client import GeminiUnavailable
+from jobs import JobError, ProgressFanout
+from singleflight import AsyncSingleFlight
+from workflow_registry import WorkflowError
+
+log = logging.getLogger(__name__)
+
+
+flask_app = backend.app
+wsgi = WSGIMiddleware(flask_app)
+comfy = AsyncComfyClient(backend.comfy_pool)
+comfy_flight = AsyncSingleFlight("comfyui-async")
+render_progress = ProgressFanout()
+TEST_IMAGE = os.path.join(backend.GENERATED_FOLDER, "test.jpg")
+
+
+# ----------------------------
+# PLUMBING
+# ----------------------------
+def _in_app_context(fn, args, kwargs):
+    with flask_app.app_context():
+        return fn(*args, **kwargs)
+
+
+async def db_call(fn, *args, **kwargs):
+    """Run fn (database work) in the thread pool inside a Flask app context."""
+    return await run_in_threadpool(_in_app_context, fn, args, kwargs)
+
+
+def fail(message, status=400):
+    return JSONResponse({"success": False, "error": message}, status_code=status)
+
+
+def replay(body, receive):
+    """ASGI receive() that yields an already read body, then the real one."""
+    sent = False
+
+    async def replayed():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return replayed
+
+
+async def read_body(request, max_bytes):
+    """Request body, or None as soon as it grows past max_bytes."""
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > max_bytes:
+            return None
+    return bytes(body)
+
+
+class ForwardToFlask:
+    """ASGI response handing the request (body already read) to Flask."""
+
+    def __init__(self, body):
+        self.body = body
+
+    async def __call__(self, scope, receive, send):
+        await wsgi(scope, replay(self.body, receive), send)
+
+
+async def authenticate(request):
+    """get_current_user() for ASGI: the DB lookup on a cache miss is threaded."""
+    token, error = bearer_token(request.headers.get("Authorization"))
+    if error:
+        return None, JSONResponse({"error": error}, status_code=401)
+
+    principal = principal_cache.get(token)
+    if principal is None:
+        principal, error = await db_call(load_principal, token)
+        if error:
+            return None, JSONResponse({"error": error}, status_code=401)
+    return principal, None
+
+
+# ----------------------------
+# TOOL PIPELINE (same ToolSpec as the Flask route)
+# ----------------------------
+class ToolCall:
+    """What a tool coroutine gets: the caller plus the parsed, valid input."""
+
+    def __init__(self, request, body, user, data, form, files):
+        self.request = request
+        self.body = body
+        self.user = user
+        self.data = data
+        self.form = form
+        self.files = files
+
+    @property
+    def base_url(self):
+        return str(self.request.base_url).rstrip("/")
+
+    def full_url(self, filename):
+        return f"{self.base_url}/generated/{filename}"
+
+    def wants_stream(self):
+        """Same rule as app.wants_stream()."""
+        if self.request.query_params.get("stream") in ("1", "true"):
+            return True
+        if self.form.get("stream") in ("1", "true"):
+            return True
+        return bool(isinstance(self.data, dict) and self.data.get("stream") is True)
+
+    def forward(self):
+        return ForwardToFlask(self.body)
+
+
+def _is_json(content_type):
+    mimetype = content_type.split(";", 1)[0].strip().lower()
+    return mimetype == "application/json" or \
+        (mimetype.startswith("application/") and mimetype.endswith("+json"))
+
+
+routes = []
+
+
+def tool(name):
+    """Async route for the tool `name` registered in app.py (same URL/spec)."""
+    spec = backend.tools.specs[name]
+
+    def decorator(handler):
+        async def endpoint(request):
+            # 1. Size, 2. auth - both before the body is read
+            error = spec.too_large(int(request.headers.get("content-length") or 0))
+            if error:
+                return fail(error, 413)
+
+            user, error = await authenticate(request)
+            if error:
+                return error
+
+            body = await read_body(request, spec.max_bytes)
+            if body is None:
+                return fail(spec.too_large(spec.max_bytes + 1), 413)
+            request = Request(request.scope, replay(body, request.receive))
+
+            # 3. Validation
+            data, form, files = None, {}, {}
+            content_type = request.headers.get("content-type", "")
+            form_data = None
+            if _is_json(content_type):
+                try:
+                    data = json.loads(body)
+                except ValueError:
+                    data = None
+            elif content_type.startswith(("multipart/form-data",
+                                          "application/x-www-form-urlencoded")):
+                form_data = await request.form()
+                for key, value in form_data.multi_items():
+                    # First value wins, like werkzeug's MultiDict.get
+                    target = files if isinstance(value, UploadFile) else form
+                    target.setdefault(key, value)
+
+            try:
+                uploads = {
+                    field: (upload.filename, upload.content_type)
+                    for field, upload in files.items()
+                }
+                error = spec.validate(data, form, uploads)
+                if error:
+                    return fail(error)
+
+                log.debug("tool %s called by user %s (async)", name, user.id)
+                return await handler(ToolCall(request, body, user, data, form, files))
+            finally:
+                if form_data is not None:
+                    await form_data.close()
+
+        routes.append(Route(spec.rule, metrics.timed(spec.rule, endpoint),
+                            methods=["POST"]))
+        return handler
+
+    return decorator
+
+
+async def save_upload(upload):
+    """upload_store.save() for a Starlette UploadFile (in the thread pool)."""
+    return await run_in_threadpool(
+        backend.upload_store.save_stream, upload.file, upload.filename,
+        upload.content_type
+    )
+
+
+# ----------------------------
+# PROMPT → IMAGE (ComfyUI)
+# ----------------------------
+@tool("prompt_to_image")
+async def prompt_to_image(call):
+    # Workflow resolve and the result-cache lookup touch the disk
+    plan, error = await run_in_threadpool(backend.plan_prompt_to_image, call.data)
+    if error:
+        return JSONResponse(error[0], status_code=error[1])
+
+    if plan["cached_filename"]:
+        await db_call(
+            backend.save_history,
+            tool_name="prompt_to_image",
+            input_text=plan["prompt"],
+            output_img=plan["cached_filename"],
+            user_id=call.user.id
+        )
+        return JSONResponse(backend.cached_image_response(plan, call.base_url))
+
+    job = backend.job_manager.submit_async(
+        call.user.id,
+        "prompt_to_image",
+        run_prompt_to_image,
+        prompt=plan["prompt"],
+        style=plan["style"],
+        engineered_prompt=plan["engineered_prompt"],
+        params=plan["params"],
+        flight_key=plan["flight_key"],
+        cache_key=plan["cache_key"],
+        base_url=call.base_url
+    )
+    return JSONResponse(backend.job_submitted_response(job, plan), status_code=202)
+
+
+async def run_prompt_to_image(job, *, prompt, style, engineered_prompt, params,
+                              flight_key, cache_key, base_url):
+    """Async job: app.run_prompt_to_image without a thread per render."""
+    render_progress.join(flight_key, job)
+    try:
+        output_filename = await comfy_flight.do(
+            flight_key, render_text_to_image, flight_key, params, cache_key
+        )
+    finally:
+        render_progress.leave(flight_key, job)
+
+    await db_call(
+        backend.save_history,
+        tool_name="prompt_to_image",
+        input_text=prompt,
+        output_img=output_filename,
+        user_id=job.user_id
+    )
+    return backend.rendered_image_result(engineered_prompt, style, base_url,
+                                         output_filename)
+
+
+async def render_text_to_image(flight_key, params, cache_key):
+    """app.render_text_to_image over AsyncComfyClient."""
+    try:
+        template = backend.workflow_registry.get("text_to_image")
+        workflow = template.instantiate(**params)
+    except WorkflowError as e:
+        log.error("Workflow load error: %s", e)
+        raise JobError("Workflow configuration file missing")
+
+    try:
+        host, prompt_id = await comfy.submit(workflow)
+    except ComfyRejected as e:
+        log.error("ComfyUI rejected workflow: %s", e)
+        raise JobError("ComfyUI rejected workflow")
+    except ComfyUnavailable as e:
+        log.error("ComfyUI unavailable: %s", e)
+        raise JobError("ComfyUI processing error", 503)
+
+    waiter = host.listener.register(prompt_id, template.output_node)
+    waiter.on_progress(lambda percent: render_progress.update(flight_key, percent))
+    render_progress.update(flight_key, waiter.progress)
+
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        output_filename = await wait_for_comfy_output(
+            host, prompt_id, waiter, template.output_node
+        )
+        outcome = "ok"
+    finally:
+        metrics.COMFY_WAIT_LATENCY.observe(time.perf_counter() - started, outcome)
+        host.listener.unregister(prompt_id)
+        backend.comfy_pool.release(host)
+
+    backend.comfy_pool.remember_output(output_filename, host)
+
+    if cache_key:
+        try:
+            content = await read_comfy_output(output_filename)
+            if content:
+                await run_in_threadpool(backend.result_cache.put, cache_key, content)
+        except OSError as e:
+            log.warning("Result cache store failed: %s", e)
+
+    return output_filename
+
+
+async def wait_for_comfy_output(host, prompt_id, waiter, output_node):
+    """Awaits the websocket waiter; same /history checks as app.py's."""
+    deadline = time.time() + backend.COMFY_TIMEOUT_SECONDS
+    events = host.listener
+    misses = 0
+
+    while time.time() < deadline:
+        if await waiter.wait_async(5 if events.connected else 1):
+            if waiter.error:
+                raise JobError(f"ComfyUI error: {waiter.error}")
+            if waiter.images:
+                return waiter.images[0].get("filename")
+
+        entry = await comfy.history(host, prompt_id)
+        output_filename = backend.history_output_filename(entry, output_node)
+        if output_filename:
+            return output_filename
+
+        if waiter.done:
+            misses += 1
+            if misses >= backend.COMFY_CONFIRM_ATTEMPTS:
+                raise JobError("No output image produced")
+            await asyncio.sleep(backend.COMFY_CONFIRM_DELAY)
+
+    raise JobError("Generation timed out", 504)
+
+
+def _read_local_output(filename):
+    local_path = os.path.join(backend.COMFY_OUTPUT_PATH, filename)
+    if not os.path.isfile(local_path):
+        return None
+    with open(local_path, "rb") as f:
+        return f.read()
+
+
+async def read_comfy_output(filename):
+    content = await run_in_threadpool(_read_local_output, filename)
+    if content is not None:
+        return content
+    fetched = await comfy.fetch_output(filename)
+    return fetched[0] if fetched else None
+
+
+# ----------------------------
+# JOB STATUS (long-poll)
+# ----------------------------
+async def _job_for(request):
+    user, error = await authenticate(request)
+    if error:
+        return None, error
+    job = backend.job_manager.get(request.path_params["job_id"], user_id=user.id)
+    if not job:
+        return None, fail("Job not found", 404)
+    return job, None
+
+
+async def get_job_status(request):
+    job, error = await _job_for(request)
+    if error:
+        return error
+
+    try:
+        wait = float(request.query_params.get("wait") or 0)
+    except ValueError:
+        wait = 0
+    if wait > 0 and not job.finished:
+        await job.wait_async(min(wait, backend.JOB_LONG_POLL_MAX))
+
+    return JSONResponse(job.to_dict())
+
+
+async def get_job_result(request):
+    job, error = await _job_for(request)
+    if error:
+        return error
+
+    if not job.finished:
+        return JSONResponse(job.to_dict(), status_code=202)
+    if job.status == backend.FAILED:
+        return JSONResponse(job.to_dict(), status_code=job.status_code)
+    return JSONResponse(job.to_dict())
+
+
+routes.append(Route("/api/jobs/{job_id}",
+                    metrics.timed("/api/jobs/<job_id>", get_job_status),
+                    methods=["GET"]))
+routes.append(Route("/api/jobs/{job_id}/result",
+                    metrics.timed("/api/jobs/<job_id>/result", get_job_result),
+                    methods=["GET"]))
+
+
+# ----------------------------
+# GEMINI TOOLS
+# ----------------------------
+@tool("prompt_enhancer")
+async def enhance_prompt(call):
+    if call.wants_stream():
+        return call.forward()
+
+    try:
+        simple_prompt = call.data["prompt"].strip()
+        enhanced_prompt = await backend.gemini.agenerate(
+            "prompt_enhancer", backend.enhance_instruction(simple_prompt)
+        )
+
+        await db_call(
+            backend.save_history,
+            tool_name="prompt_enhancer",
+            input_text=simple_prompt,
+            output_text=enhanced_prompt,
+            user_id=call.user.id
+        )
+
+        return JSONResponse({
+            "success": True,
+            "original_prompt": simple_prompt,
+            "enhanced_prompt": enhanced_prompt
+        })
+
+    except GeminiUnavailable as e:
+        log.warning("Prompt enhancer unavailable: %s", e)
+        return fail("Prompt enhancer is temporarily unavailable, please retry", 503)
+
+    except Exception as e:
+        log.exception("Prompt enhancer failed")
+        return fail(str(e), 500)
+
+
+@tool("insta_post")
+async def insta_post_generator(call):
+    if call.wants_stream():
+        return call.forward()
+
+    image = call.files.get("image")
+    prompt = call.form.get("prompt", "").strip()
+
+    if not os.path.exists(TEST_IMAGE):
+        return fail("test.jpg not found in generated folder", 404)
+
+    filename = await save_upload(image) if image else None
+    defaults = backend.insta_post_defaults(image is not None, bool(prompt))
+
+    # "" → keep the default caption / hashtags / tips
+    ai_text = await backend.gemini.agenerate(
+        "insta_post", backend.insta_post_instruction(prompt), fallback=""
+    )
+
+    result = await db_call(
+        backend.finish_insta_post, ai_text, defaults,
+        filename=filename,
+        prompt=prompt,
+        user_id=call.user.id,
+        image_url=call.full_url("test.jpg")
+    )
+    return JSONResponse(result)
+
+
+@tool("safety_gear")
+async def safety_gear(call):
+    try:
+        prompt = call.form.get("prompt", "").strip()
+
+        if not os.path.exists(TEST_IMAGE):
+            return fail("test.jpg not found", 404)
+
+        filename = await save_upload(call.files["image"])
+        advice_text = await backend.gemini.agenerate(
+            "safety_gear",
+            backend.safety_gear_instruction(prompt),
+            fallback=backend.SAFETY_GEAR_FALLBACK
+        )
+
+        await db_call(
+            backend.save_history,
+            tool_name="safety_gear",
+            input_text=prompt,
+            input_img=filename,
+            output_text=advice_text,
+            output_img="test.jpg",
+            user_id=call.user.id
+        )
+
+        return JSONResponse({
+            "success": True,
+            "advice": advice_text,
+            "image_url": call.full_url("test.jpg")
+        })
+
+    except Exception:
+        log.exception("Safety gear failed")
+        return fail("Internal server error", 500)
+
+
+@tool("posture_analyzer")
+async def posture_analyze(call):
+    try:
+        if not os.path.exists(TEST_IMAGE):
+            return fail("test.jpg not found", 404)
+
+        filename = await save_upload(call.files["image"])
+        suggestions = await backend.gemini.agenerate(
+            "posture_analyzer",
+            backend.POSTURE_INSTRUCTION,
+            fallback=backend.POSTURE_FALLBACK
+        )
+
+        await db_call(
+            backend.save_history,
+            tool_name="posture_analyzer",
+            input_img=filename,
+            output_text=suggestions,
+            output_img="test.jpg",
+            user_id=call.user.id
+        )
+
+        return JSONResponse({
+            "success": True,
+            "corrected_image_url": call.full_url("test.jpg"),
+            "suggestions": suggestions,
+            "scores": backend.POSTURE_SCORES
+        })
+
+    except Exception:
+        log.exception("Posture analyze failed")
+        return fail("Internal server error", 500)
+
+
+# ----------------------------
+# APP
+# ----------------------------
+@asynccontextmanager
+async def lifespan(_app):
+    yield
+    await comfy.aclose()
+
+
+app = Starlette(
+    routes=routes + [Mount("/", app=wsgi)],
+    # Same policy as CORS(app) in app.py, applied to the async routes too
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"],
+                           allow_methods=["*"], allow_headers=["*"])],
+    lifespan=lifespan,
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=5000)
@@ -0,0 +1,182 @@
+# =============================================================================
+# STATIC ASSET MANIFEST (Frontend/)
+# =============================================================================
+# Built once at start-up instead of probing the filesystem per request:
+#   - every file is read into memory with its SHA-256 (-> strong ETag)
+#   - text assets get gzip (and brotli, if the optional `brotli` package is
+#     installed) variants, compressed once at max level
+#   - non-HTML assets also get a fingerprinted name (styles.3f2a9c1b.css)
+#     served with Cache-Control: immutable; HTML pages are rewritten to
+#     reference those names and are revalidated with ETag/304 instead
+# Lookups are one dict access. ASSETS_WATCH=True (off by default; turned on
+# by `python app.py` in debug mode) rebuilds the manifest when a file in
+# Frontend/ changes, for development.
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import time
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+
+ASSETS_WATCH = os.getenv("ASSETS_WATCH", "False") == "True"
+COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml")
+MIN_COMPRESS_BYTES = 256
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+REF_RE = re.compile(r'(\b(?:href|src)=")([^"?#:]+)(")')
+
+
+class Asset:
+    def __init__(self, name, body, mimetype):
+        self.name = name
+        self.mimetype = mimetype
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.variants = {"identity": body}
+        self.fingerprinted = None
+
+        if mimetype.startswith(COMPRESSIBLE) and len(body) >= MIN_COMPRESS_BYTES:
+            gz = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(gz) < len(body):
+                self.variants["gzip"] = gz
+            if brotli is not None:
+                br = brotli.compress(body, quality=11)
+                if len(br) < len(body):
+                    self.variants["br"] = br
+
+    def etag(self, encoding):
+        suffix = "" if encoding == "identity" else f"-{encoding}"
+        return f"{self.digest[:32]}{suffix}"
+
+
+class AssetManifest:
+    def __init__(self, directory):
+        self.directory = directory
+        self.assets = {}       # request path -> (Asset, cache-control)
+        self._folded = {}      # lower-cased path -> request path
+        self._stamp = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.watch = ASSETS_WATCH
+        self.build()
+
+    # ------------------------------------------------------------------
+    # Build
+    # ------------------------------------------------------------------
+    def _scan(self):
+        files = {}
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                full = os.path.join(root, name)
+                rel = os.path.relpath(full, self.directory).replace(os.sep, "/")
+                files[rel] = full
+        return files
+
+    def _dir_stamp(self, files):
+        return tuple(sorted(
+            (rel, os.stat(full).st_mtime_ns) for rel, full in files.items()
+        ))
+
+    def build(self):
+        files = self._scan()
+        loaded = {}
+        for rel, full in files.items():
+            with open(full, "rb") as f:
+                body = f.read()
+            mimetype = mimetypes.guess_type(rel)[0] or "application/octet-stream"
+            loaded[rel] = (body, mimetype)
+
+        assets = {}
+        # Static assets first, so pages can point at their fingerprinted names
+        for rel, (body, mimetype) in loaded.items():
+            if mimetype == "text/html":
+                continue
+            asset = Asset(rel, body, mimetype)
+            stem, dot, ext = rel.rpartition(".")
+            asset.fingerprinted = f"{stem}.{asset.digest[:8]}.{ext}" if dot else \
+                f"{rel}.{asset.digest[:8]}"
+            assets[rel] = (asset, REVALIDATE)
+            assets[asset.fingerprinted] = (asset, IMMUTABLE)
+
+        def fingerprint(match):
+            entry = assets.get(match.group(2).lstrip("/"))
+            if entry is None or entry[0].fingerprinted is None:
+                return match.group(0)
+            prefix = "/" if match.group(2).startswith("/") else ""
+            return f"{match.group(1)}{prefix}{entry[0].fingerprinted}{match.group(3)}"
+
+        for rel, (body, mimetype) in loaded.items():
+            if mimetype != "text/html":
+                continue
+            html = REF_RE.sub(fingerprint, body.decode("utf-8"))
+            assets[rel] = (Asset(rel, html.encode("utf-8"), mimetype), REVALIDATE)
+
+        with self._lock:
+            self.assets = assets
+            self._folded = {path.lower(): path for path in assets}
+            self._stamp = self._dir_stamp(files)
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked < 1.0:
+            return
+        self._checked = now
+        if self._dir_stamp(self._scan()) != self._stamp:
+            self.build()
+
+    # ------------------------------------------------------------------
+    # Serve
+    # ------------------------------------------------------------------
+    def lookup(self, path):
+        if self.watch:
+            self._maybe_reload()
+        entry = self.assets.get(path)
+        if entry is None:
+            # Links like tool-insta-Story-Template.html on case-sensitive disks
+            folded = self._folded.get(path.lower())
+            entry = self.assets.get(folded) if folded else None
+        return entry
+
+    def response(self, path):
+        """Response for a Frontend path, or None if there is no such asset."""
+        entry = self.lookup(path)
+        if entry is None:
+            return None
+        asset, cache_control = entry
+
+        encoding = "identity"
+        accepted = request.accept_encodings
+        for candidate in ("br", "gzip"):
+            if candidate in asset.variants and accepted[candidate]:
+                encoding = candidate
+                break
+
+        etag = asset.etag(encoding)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(asset.variants[encoding], mimetype=asset.mimetype)
+            if encoding != "identity":
+                response.headers["Content-Encoding"] = encoding
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = cache_control
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+    def stats(self):
+        assets = {id(a): a for a, _ in self.assets.values()}.values()
+        return {
+            "files": len(assets),
+            "bytes": sum(len(a.variants["identity"]) for a in assets),
+            "gzip_bytes": sum(len(a.variants.get("gzip", a.variants["identity"])) for a in assets),
+            "brotli": brotli is not None,
+        }
@@ -2,26 +2,39 @@
 # Part 6: Authentication Helpers (with @token_required decorator)
 # =============================================================================
 
+import os
+import threading
+import time
+from collections import OrderedDict
+
 import jwt
 from datetime import datetime, timedelta
 # Note: We don't need 'wraps' anymore since we're not using decorators
 from flask import request, jsonify
 from models import User
-from werkzeug.security import generate_password_hash, check_password_hash
+from password_hasher import PasswordHasher
 SECRET_KEY = "your-secret-key-change-in-production"
 TOKEN_EXPIRATION_HOURS = 24
+# Seconds a validated token -> user lookup is reused (0 disables the cache)
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "30"))
+AUTH_CACHE_MAX = int(os.getenv("AUTH_CACHE_MAX", "10000"))
 
 
 # =============================================================================
 # PASSWORD FUNCTIONS
 # =============================================================================
 
+# Hashing runs in a bounded worker pool (see password_hasher.py); both
+# functions raise HashingBusy when too many hashes are already queued.
+password_hasher = PasswordHasher()
+
+
 def hash_password(password):
-    return generate_password_hash(password)
+    return password_hasher.hash(password)
 
 
 def verify_password(password_hash, password):
-    return check_password_hash(password_hash, password)
+    return password_hasher.verify(password_hash, password)
 
 
 # =============================================================================
@@ -45,6 +58,78 @@ def decode_token(token):
         return None
 
 
+# =============================================================================
+# PRINCIPAL CACHE
+# =============================================================================
+# get_current_user() used to hit the database on every request. Validated
+# tokens now map to a small Principal (not an ORM object, so it is safe to
+# share between requests/threads) for AUTH_CACHE_TTL seconds, or until the
+# token expires. delete_user / admin changes call invalidate_user(). The cache
+# is per process: in other workers a change shows up within the TTL.
+
+class Principal:
+    __slots__ = ("id", "username", "email", "is_admin")
+
+    def __init__(self, id, username, email, is_admin):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.is_admin = bool(is_admin)
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.email, user.is_admin)
+
+
+class PrincipalCache:
+    def __init__(self, ttl=AUTH_CACHE_TTL, max_items=AUTH_CACHE_MAX):
+        self.ttl = ttl
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()   # token -> (expires_at, principal)
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._items.get(token)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._items[token]
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def put(self, token, principal, token_exp):
+        if self.ttl <= 0:
+            return
+        expires_at = min(time.time() + self.ttl, token_exp)
+        with self._lock:
+            self._items[token] = (expires_at, principal)
+            self._items.move_to_end(token)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for token in [t for t, (_, p) in self._items.items() if p.id == user_id]:
+                del self._items[token]
+
+    def stats(self):
+        with self._lock:
+            return {"items": len(self._items), "hits": self.hits,
+                    "misses": self.misses, "ttl": self.ttl}
+
+
+principal_cache = PrincipalCache()
+
+
+def invalidate_user(user_id):
+    """Forget cached logins of a user (call after deleting/demoting them)."""
+    principal_cache.invalidate_user(user_id)
+
+
 # =============================================================================
 # GET CURRENT USER (Helper Function)
 # =============================================================================
@@ -55,59 +140,68 @@ def decode_token(token):
 #   - (user, None) if token is valid
 #   - (None, error_response) if token is invalid
 
-def get_current_user():
-    """
-    Validates JWT token and returns current user.
-
-    How it works:
-    1. Checks for Authorization header
-    2. Extracts and validates the JWT token
-    3. Fetches user from database
-    4. Returns (user, None) or (None, error_response)
-    """
-
-    # ✅ CHANGE 1: Use request.headers.get() (safer than direct indexing)
-    auth_header = request.headers.get('Authorization')
+def bearer_token(auth_header):
+    """(token, None) from an Authorization header, or (None, error message)."""
+    # ✅ CHANGE 1: the header value is passed in (Flask or ASGI request)
     if not auth_header:
-        return None, (jsonify({'error': 'Token is missing'}), 401)
-
-    print("========================================")
-    print("Authorization header found.")
-    print(request.headers)
-    print(auth_header)
-    print("\n\n")
+        return None, 'Token is missing'
 
     # Step 2: Extract token from "Bearer <token>"
     if not auth_header.startswith('Bearer '):
-        return None, (jsonify({'error': 'Invalid token format'}), 401)
-
-    print("Split with (' ')")
-    print(auth_header.split(' '))
-    print("\n\n")
+        return None, 'Invalid token format'
 
     # ✅ CHANGE 2: safer split (prevents index error)
     parts = auth_header.split(' ')
     if len(parts) != 2:
-        return None, (jsonify({'error': 'Invalid token format'}), 401)
+        return None, 'Invalid token format'
 
-    token = parts[1]
+    return parts[1], None
 
+
+def load_principal(token):
+    """
+    Validate the JWT and load its user (database, needs an app context);
+    caches the result. Returns (principal, None) or (None, error message).
+    """
     # Step 3: Decode and validate token
     data = decode_token(token)
-
-    print("Decoded token data:")
-    print(data)
-
     if not data:
-        return None, (jsonify({'error': 'Token is invalid or expired'}), 401)
+        return None, 'Token is invalid or expired'
 
     # Step 4: Get user from database
     current_user = User.query.get(data['user_id'])
     if not current_user:
-        return None, (jsonify({'error': 'User not found'}), 401)
+        return None, 'User not found'
+
+    principal = Principal.from_user(current_user)
+    principal_cache.put(token, principal, data['exp'])
+    return principal, None
+
+
+def get_current_user():
+    """
+    Validates JWT token and returns current user.
+
+    How it works:
+    1. Checks for Authorization header
+    2. Extracts the token; a recently validated one comes from the cache
+    3. Otherwise validates the JWT and fetches the user from the database
+    4. Returns (principal, None) or (None, error_response)
+    """
+    token, error = bearer_token(request.headers.get('Authorization'))
+    if error:
+        return None, (jsonify({'error': error}), 401)
+
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal, None
+
+    principal, error = load_principal(token)
+    if error:
+        return None, (jsonify({'error': error}), 401)
 
     # ✅ SUCCESS: Always return EXACTLY 2 values
-    return current_user, None
+    return principal, None
 
 # =============================================================================
 # GET ADMIN USER (Helper Function)
@@ -0,0 +1 @@
+# Micro/load benchmarks. Run from Backend/, e.g. python -m bench.auth_overhead
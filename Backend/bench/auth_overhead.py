@@ -0,0 +1,73 @@
+# =============================================================================
+# AUTH OVERHEAD MICROBENCHMARK
+# =============================================================================
+# Per-request cost of get_current_user() with the principal cache off
+# (JWT decode + User lookup every call, the old behaviour minus the debug
+# prints) and on. Uses a throwaway in-memory SQLite database.
+#
+# Usage:
+#   python -m bench.auth_overhead --requests 5000
+
+import argparse
+import statistics
+import time
+
+from flask import Flask
+
+import auth
+from models import db, User
+
+
+def build_app():
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        user = User(username="bench", email="bench@example.com",
+                    password_hash="x", is_admin=False)
+        db.session.add(user)
+        db.session.commit()
+        token = auth.create_token(user.id)
+    return app, token
+
+
+def measure(app, token, requests, ttl):
+    auth.principal_cache = auth.PrincipalCache(ttl=ttl)
+    headers = {"Authorization": f"Bearer {token}"}
+    timings = []
+    for _ in range(requests):
+        with app.test_request_context("/api/history", headers=headers):
+            start = time.perf_counter()
+            user, error = auth.get_current_user()
+            timings.append(time.perf_counter() - start)
+            assert error is None and user.username == "bench"
+            db.session.remove()
+    timings.sort()
+    return {
+        "mean_us": statistics.mean(timings) * 1e6,
+        "p50_us": timings[len(timings) // 2] * 1e6,
+        "p99_us": timings[int(len(timings) * 0.99)] * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    app, token = build_app()
+    results = {
+        "uncached": measure(app, token, args.requests, ttl=0),
+        "cached": measure(app, token, args.requests, ttl=auth.AUTH_CACHE_TTL or 30),
+    }
+    for name, r in results.items():
+        print(f"{name:9} mean {r['mean_us']:8.1f} us   p50 {r['p50_us']:8.1f} us"
+              f"   p99 {r['p99_us']:8.1f} us")
+    speedup = results["uncached"]["mean_us"] / results["cached"]["mean_us"]
+    print(f"cache speedup: {speedup:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
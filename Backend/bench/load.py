@@ -0,0 +1,548 @@
+# =============================================================================
+# END-TO-END LOAD BENCHMARK
+# =============================================================================
+# Starts fake ComfyUI (fakes/comfy.py) and fake Gemini (fakes/gemini.py)
+# servers in this process, the real app in a subprocess (threaded werkzeug
+# or uvicorn + asgi.py, throwaway database, upload and cache directories)
+# wired to them, then runs --clients concurrent clients for --seconds. Each
+# client picks a weighted scenario from MIX, which between them cover every
+# /api/* endpoint (prompt-to-image end to end through the job endpoints,
+# uploads, SSE streaming, admin reports, register/login/delete).
+#
+# Reports per endpoint: requests, errors (5xx, 429, connection failures),
+# status codes, throughput and mean/p50/p95/p99/max latency, as JSON on
+# stdout (or --output) plus a table on stderr.
+#
+# Regressions: --save-baseline FILE stores the run; --baseline FILE compares
+# against it and exits 1 when an endpoint's p95 or throughput is worse than
+# --tolerance (default 25%) or its error rate grew by more than 1 point.
+# Only compare runs of the same --profile, --mode and --clients on the same
+# machine; there is no checked-in baseline, record one on your own hardware.
+#
+# --profile picks fake latencies/errors (see PROFILES); --comfy-* and
+# --gemini-* override single values. App settings (GEMINI_RPM,
+# RESULT_CACHE_ENABLED, JOB_WORKERS, ...) come from the environment as usual.
+#
+# Usage (from Backend/):
+#   python -m bench.load --mode wsgi --clients 32 --seconds 30 --save-baseline /tmp/base.json
+#   python -m bench.load --mode asgi --clients 32 --seconds 30 --baseline /tmp/base.json
+
+import argparse
+import json
+import os
+import platform
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from fakes import comfy as fake_comfy
+from fakes import gemini as fake_gemini
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADMIN = {"username": "bench-admin", "email": "admin@bench.local", "password": "bench admin pw"}
+USER = {"username": "bench-user", "email": "user@bench.local", "password": "bench user pw"}
+
+PROFILES = {
+    # Fakes answer almost instantly: measures the app's own overhead
+    "fast": {
+        "comfy": {"steps": 4, "step_delay": 0.01, "error_rate": 0.0, "workers": 8},
+        "gemini": {"latency": 0.02, "jitter": 0.01, "error_rate": 0.0},
+    },
+    # Roughly production shaped: a few GPUs, second-scale Gemini calls
+    "realistic": {
+        "comfy": {"steps": 20, "step_delay": 0.05, "error_rate": 0.0, "workers": 2},
+        "gemini": {"latency": 0.8, "jitter": 0.4, "error_rate": 0.0},
+    },
+    # Realistic latencies plus failing renders and Gemini 5xx
+    "flaky": {
+        "comfy": {"steps": 20, "step_delay": 0.05, "error_rate": 0.1, "workers": 2},
+        "gemini": {"latency": 0.8, "jitter": 0.4, "error_rate": 0.1},
+    },
+}
+
+WORDS = ("sunset", "mountain", "city", "neon", "forest", "portrait", "cat",
+         "ocean", "desert", "robot", "garden", "winter", "street", "castle")
+STYLES = ("clean", "anime", "cinematic", "watercolor")
+
+
+# -----------------------------------------------------------------------------
+# Server side (runs in the subprocess)
+# -----------------------------------------------------------------------------
+def serve(port, mode):
+    import app as appmod
+    from models import db, User
+
+    with appmod.app.app_context():
+        for account, is_admin in ((ADMIN, True), (USER, False)):
+            if not User.query.filter_by(email=account["email"]).first():
+                db.session.add(User(
+                    username=account["username"], email=account["email"],
+                    password_hash=appmod.hash_password(account["password"]),
+                    is_admin=is_admin,
+                ))
+                appmod.usage_stats.add_users(db.session.connection(), 1)
+        db.session.commit()
+
+    if mode == "asgi":
+        import uvicorn
+
+        import asgi
+        uvicorn.run(asgi.app, host="127.0.0.1", port=port, log_level="warning")
+    else:
+        from werkzeug.serving import make_server
+        make_server("127.0.0.1", port, appmod.app, threaded=True).serve_forever()
+
+
+# -----------------------------------------------------------------------------
+# Client side
+# -----------------------------------------------------------------------------
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+class Recorder:
+    """Latency samples per endpoint; samples started before `start` are dropped."""
+
+    def __init__(self):
+        self.start = None
+        self.samples = {}   # endpoint -> [(seconds, status)]
+        self.lock = threading.Lock()
+
+    def add(self, endpoint, began, elapsed, status):
+        if self.start is None or began < self.start:
+            return
+        with self.lock:
+            self.samples.setdefault(endpoint, []).append((elapsed, status))
+
+    def summary(self, duration):
+        endpoints = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            latencies = [s for s, _ in samples]
+            codes = {}
+            for _, status in samples:
+                codes[str(status)] = codes.get(str(status), 0) + 1
+            errors = sum(1 for _, status in samples if is_error(status))
+            endpoints[endpoint] = {
+                "requests": len(samples),
+                "errors": errors,
+                "error_rate": round(errors / len(samples), 4),
+                "status_codes": codes,
+                "rps": round(len(samples) / duration, 3),
+                "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+                "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+                "max_ms": round(max(latencies) * 1000, 2),
+            }
+        return endpoints
+
+
+def is_error(status):
+    # 0 = connection failure / timeout
+    return status == 0 or status == 429 or status >= 500
+
+
+class Client:
+    def __init__(self, base, recorder, tokens, rng):
+        self.base = base
+        self.recorder = recorder
+        self.tokens = tokens
+        self.rng = rng
+        self.session = requests.Session()
+
+    def call(self, endpoint, method, path, token="user", stream=False, **kwargs):
+        """One timed request, recorded under `endpoint`. Returns the response or None."""
+        if token:
+            kwargs.setdefault("headers", {})["Authorization"] = f"Bearer {self.tokens[token]}"
+        began = time.perf_counter()
+        try:
+            r = self.session.request(method, self.base + path, timeout=120,
+                                     stream=stream, **kwargs)
+            if stream:
+                for _ in r.iter_content(chunk_size=None):
+                    pass
+            status = r.status_code
+        except requests.RequestException:
+            r, status = None, 0
+        self.recorder.add(endpoint, began, time.perf_counter() - began, status)
+        return r
+
+    # ------------------------------ inputs ---------------------------------
+    def words(self, n=4):
+        return " ".join(self.rng.choice(WORDS) for _ in range(n))
+
+    def image(self, field):
+        # A few distinct images, so the upload store sees new files and dedup hits
+        rgb = tuple(self.rng.choice((0, 128, 255)) for _ in range(3))
+        return (field, (f"{field}.png", fake_comfy.tiny_png(rgb=rgb), "image/png"))
+
+
+def json_body(r):
+    try:
+        return r.json()
+    except (AttributeError, ValueError):
+        return {}
+
+
+# ------------------------------- scenarios -----------------------------------
+def prompt_to_image(c):
+    began = time.perf_counter()
+    # A small vocabulary: repeated prompts exercise single-flight and the cache
+    r = c.call("POST /api/prompt-to-image", "POST", "/api/prompt-to-image",
+               json={"prompt": c.words(2), "style": c.rng.choice(STYLES)})
+    if r is None or r.status_code != 202:
+        status = r.status_code if r is not None else 0
+        c.recorder.add("prompt_to_image (end to end)", began,
+                       time.perf_counter() - began, status)
+        return
+
+    job_id = json_body(r).get("job_id")
+    status = 0
+    # Polls like the frontend: short waits (the WSGI app caps them anyway)
+    deadline = time.monotonic() + 200
+    while time.monotonic() < deadline:
+        r = c.call("GET /api/jobs/<id>", "GET", f"/api/jobs/{job_id}?wait=2")
+        if r is None or r.status_code != 200:
+            break
+        if json_body(r).get("status") in ("done", "failed"):
+            break
+    r = c.call("GET /api/jobs/<id>/result", "GET", f"/api/jobs/{job_id}/result")
+    if r is not None:
+        status = r.status_code
+    c.recorder.add("prompt_to_image (end to end)", began,
+                   time.perf_counter() - began, status)
+
+
+def history(c):
+    c.call("GET /api/history", "GET", "/api/history?limit=20")
+
+
+def enhance_prompt(c):
+    c.call("POST /api/enhance-prompt", "POST", "/api/enhance-prompt",
+           json={"prompt": c.words()})
+
+
+def enhance_prompt_stream(c):
+    c.call("POST /api/enhance-prompt (stream)", "POST", "/api/enhance-prompt?stream=1",
+           json={"prompt": c.words()}, stream=True)
+
+
+def insta_post(c):
+    files = [c.image("image")] if c.rng.random() < 0.5 else None
+    c.call("POST /api/insta-post-generator", "POST", "/api/insta-post-generator",
+           data={"prompt": c.words()}, files=files)
+
+
+def insta_story(c):
+    c.call("POST /api/insta-story-template", "POST", "/api/insta-story-template",
+           json={"overlay_text": c.words(3)})
+
+
+def story_image(c):
+    c.call("POST /api/story-image-generater", "POST", "/api/story-image-generater",
+           json={"prompt": c.words()})
+
+
+def image_to_style(c):
+    c.call("POST /api/image-to-style", "POST", "/api/image-to-style",
+           files=[c.image("image")])
+
+
+def specs_tryon(c):
+    c.call("POST /api/specs-tryon", "POST", "/api/specs-tryon",
+           files=[c.image("face"), c.image("specs")])
+
+
+def haircut_preview(c):
+    c.call("POST /api/haircut-preview", "POST", "/api/haircut-preview",
+           files=[c.image("you"), c.image("sample")])
+
+
+def safety_gear(c):
+    c.call("POST /api/safety-gear", "POST", "/api/safety-gear",
+           data={"prompt": c.words(2)}, files=[c.image("image")])
+
+
+def posture_analyze(c):
+    c.call("POST /api/posture-analyze", "POST", "/api/posture-analyze",
+           files=[c.image("image")])
+
+
+def login(c):
+    c.call("POST /api/login", "POST", "/api/login", token=None,
+           json={"email": USER["email"], "password": USER["password"]})
+
+
+def account_lifecycle(c):
+    # register -> login -> admin deletes the account again
+    name = f"load-{c.rng.getrandbits(48):x}"
+    account = {"username": name, "email": f"{name}@bench.local", "password": "pw " + name}
+    r = c.call("POST /api/register", "POST", "/api/register", token=None, json=account)
+    if r is None or r.status_code != 201:
+        return
+    r = c.call("POST /api/login", "POST", "/api/login", token=None,
+               json={"email": account["email"], "password": account["password"]})
+    user_id = json_body(r).get("user", {}).get("id")
+    if user_id:
+        c.call("DELETE /api/admin/users/<id>", "DELETE", f"/api/admin/users/{user_id}",
+               token="admin")
+
+
+ADMIN_REPORTS = (
+    "/api/admin/users",
+    "/api/admin/stats",
+    "/api/admin/stats/tools",
+    "/api/admin/stats/daily-active",
+    "/api/admin/stats/top-users",
+    "/api/admin/comfy-backends",
+    "/api/admin/cache-stats",
+    "/api/admin/gemini",
+    "/api/admin/history?limit=50",
+)
+
+
+def admin_report(c):
+    path = c.rng.choice(ADMIN_REPORTS)
+    c.call("GET " + path.split("?")[0], "GET", path, token="admin")
+
+
+# (scenario, weight)
+MIX = (
+    (history, 12),
+    (prompt_to_image, 10),
+    (enhance_prompt, 6),
+    (enhance_prompt_stream, 2),
+    (insta_post, 4),
+    (insta_story, 4),
+    (story_image, 3),
+    (image_to_style, 4),
+    (specs_tryon, 3),
+    (haircut_preview, 3),
+    (safety_gear, 3),
+    (posture_analyze, 3),
+    (admin_report, 9),
+    (login, 1),
+    (account_lifecycle, 1),
+)
+
+
+def client_loop(client, stop):
+    scenarios = [s for s, _ in MIX]
+    weights = [w for _, w in MIX]
+    while not stop.is_set():
+        client.rng.choices(scenarios, weights)[0](client)
+
+
+# ------------------------------- baseline ------------------------------------
+def compare(result, baseline, tolerance):
+    """Regressions of `result` against `baseline`, as printable strings."""
+    regressions = []
+    for key in ("profile", "mode", "clients"):
+        if result["meta"].get(key) != baseline["meta"].get(key):
+            print(f"warning: baseline {key}={baseline['meta'].get(key)!r}, "
+                  f"this run {result['meta'].get(key)!r}", file=sys.stderr)
+
+    for endpoint, base in baseline["endpoints"].items():
+        now = result["endpoints"].get(endpoint)
+        if now is None:
+            regressions.append(f"{endpoint}: no requests in this run")
+            continue
+        if now["requests"] >= 20 and base["requests"] >= 20:
+            if now["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{endpoint}: p95 {base['p95_ms']:.1f}ms -> {now['p95_ms']:.1f}ms")
+            if now["rps"] < base["rps"] * (1 - tolerance):
+                regressions.append(f"{endpoint}: {base['rps']:.2f} -> {now['rps']:.2f} req/s")
+        if now["error_rate"] > base["error_rate"] + 0.01:
+            regressions.append(f"{endpoint}: error rate {base['error_rate']:.1%} -> "
+                               f"{now['error_rate']:.1%}")
+    return regressions
+
+
+def print_table(endpoints):
+    print(f"{'endpoint':42} {'reqs':>6} {'err':>5} {'req/s':>7} {'p50':>8} "
+          f"{'p95':>8} {'p99':>8}", file=sys.stderr)
+    for endpoint, s in endpoints.items():
+        print(f"{endpoint:42} {s['requests']:6d} {s['errors']:5d} {s['rps']:7.2f} "
+              f"{s['p50_ms']:6.0f}ms {s['p95_ms']:6.0f}ms {s['p99_ms']:6.0f}ms",
+              file=sys.stderr)
+
+
+# --------------------------------- run ---------------------------------------
+def start_fakes(args):
+    profile = PROFILES[args.profile]
+    comfy_kwargs = dict(profile["comfy"])
+    gemini_kwargs = dict(profile["gemini"])
+    for name in ("steps", "step_delay", "error_rate", "workers"):
+        value = getattr(args, f"comfy_{name}")
+        if value is not None:
+            comfy_kwargs[name] = value
+    for name in ("latency", "jitter", "error_rate"):
+        value = getattr(args, f"gemini_{name}")
+        if value is not None:
+            gemini_kwargs[name] = value
+
+    comfy, _ = fake_comfy.serve(port=0, **comfy_kwargs)
+    gemini, _ = fake_gemini.serve(port=0, **gemini_kwargs)
+    return comfy, gemini, {"comfy": comfy_kwargs, "gemini": gemini_kwargs}
+
+
+def start_app(args, comfy_url, gemini_url):
+    workdir = tempfile.mkdtemp(prefix="bench-load-")
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        UPLOAD_DIR=os.path.join(workdir, "uploads"),
+        THUMBNAIL_DIR=os.path.join(workdir, "thumbnails"),
+        LLM_CACHE_PATH=os.path.join(workdir, "llm_cache.sqlite"),
+        RESULT_CACHE_DIR=os.path.join(workdir, "results"),
+        COMFY_BACKENDS=comfy_url,
+        GEMINI_API_ENDPOINT=gemini_url,
+        NANOBANANA_KEY=os.getenv("NANOBANANA_KEY", "bench"),
+        LOG_LEVEL="WARNING",
+        LOG_LEVELS="werkzeug=WARNING,httpx=WARNING",
+    )
+    # Don't let the real quota limiter turn the Gemini tools into fallbacks
+    env.setdefault("GEMINI_RPM", "100000")
+    env.setdefault("GEMINI_BURST", "1000")
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "bench.load", "--serve", str(args.port),
+         "--mode", args.mode],
+        cwd=BACKEND_DIR, env=env,
+        start_new_session=True,   # so hash pool workers are stopped too
+    )
+    return server
+
+
+def login_tokens(base):
+    tokens = {}
+    for _ in range(150):
+        try:
+            for name, account in (("admin", ADMIN), ("user", USER)):
+                if name not in tokens:
+                    r = requests.post(f"{base}/api/login", timeout=30, json={
+                        "email": account["email"], "password": account["password"]})
+                    tokens[name] = r.json()["token"]
+            return tokens
+        except (requests.ConnectionError, KeyError, ValueError):
+            time.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+def run(args):
+    comfy, gemini, fakes = start_fakes(args)
+    comfy_url = "http://127.0.0.1:%d" % comfy.server_address[1]
+    gemini_url = "http://127.0.0.1:%d" % gemini.server_address[1]
+    server = start_app(args, comfy_url, gemini_url)
+    base = f"http://127.0.0.1:{args.port}"
+
+    try:
+        tokens = login_tokens(base)
+        recorder = Recorder()
+        stop = threading.Event()
+        clients = [Client(base, recorder, tokens, random.Random(args.seed + i))
+                   for i in range(args.clients)]
+        threads = [threading.Thread(target=client_loop, args=(c, stop), daemon=True)
+                   for c in clients]
+        for t in threads:
+            t.start()
+
+        time.sleep(args.warmup)
+        recorder.start = time.perf_counter()
+        time.sleep(args.seconds)
+        stop.set()
+        # Only requests started inside the window count; let them finish
+        for t in threads:
+            t.join(timeout=150)
+        duration = args.seconds
+    finally:
+        os.killpg(server.pid, signal.SIGTERM)
+        server.wait()
+        comfy.shutdown()
+        gemini.shutdown()
+
+    endpoints = recorder.summary(duration)
+    total = sum(s["requests"] for s in endpoints.values())
+    return {
+        "meta": {
+            "profile": args.profile,
+            "mode": args.mode,
+            "clients": args.clients,
+            "seconds": args.seconds,
+            "warmup": args.warmup,
+            "seed": args.seed,
+            "fakes": fakes,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "totals": {
+            "requests": total,
+            "errors": sum(s["errors"] for s in endpoints.values()),
+            "rps": round(total / duration, 3),
+        },
+        "endpoints": endpoints,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load benchmark")
+    parser.add_argument("--mode", choices=("wsgi", "asgi"), default="wsgi")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="realistic")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=3, help="seconds not measured")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--port", type=int, default=5098)
+    parser.add_argument("--output", help="write the JSON result here instead of stdout")
+    parser.add_argument("--baseline", help="compare against this earlier result")
+    parser.add_argument("--save-baseline", metavar="FILE", help="also store the result here")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--comfy-steps", type=int)
+    parser.add_argument("--comfy-step-delay", type=float)
+    parser.add_argument("--comfy-error-rate", type=float)
+    parser.add_argument("--comfy-workers", type=int)
+    parser.add_argument("--gemini-latency", type=float)
+    parser.add_argument("--gemini-jitter", type=float)
+    parser.add_argument("--gemini-error-rate", type=float)
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.mode)
+        return
+
+    result = run(args)
+    print_table(result["endpoints"])
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            f.write(text + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance)
+        for line in regressions:
+            print("REGRESSION " + line, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print("no regressions against " + args.baseline, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
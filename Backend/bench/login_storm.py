@@ -0,0 +1,158 @@
+# =============================================================================
+# LOGIN STORM BENCHMARK
+# =============================================================================
+# Starts the real app (threaded werkzeug server, throwaway SQLite database)
+# in a subprocess once per PASSWORD_HASH_POOL mode, then measures latency of
+# an unrelated cheap endpoint (GET /api/history) on its own and while
+# --storm threads hammer /api/login. Reports login throughput and the p50/p99
+# of the unrelated endpoint for each mode.
+#
+# Usage (from Backend/):
+#   python -m bench.login_storm --modes inline,process --storm 16 --seconds 10
+
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EMAIL = "storm@example.com"
+PASSWORD = "correct horse battery staple"
+
+
+# -----------------------------------------------------------------------------
+# Server side (runs in the subprocess)
+# -----------------------------------------------------------------------------
+def serve(port):
+    from werkzeug.serving import make_server
+
+    import app as appmod
+    from models import db, User
+
+    with appmod.app.app_context():
+        if not User.query.filter_by(email=EMAIL).first():
+            db.session.add(User(username="storm", email=EMAIL,
+                                password_hash=appmod.hash_password(PASSWORD)))
+            appmod.usage_stats.add_users(db.session.connection(), 1)
+            db.session.commit()
+
+    make_server("127.0.0.1", port, appmod.app, threaded=True).serve_forever()
+
+
+# -----------------------------------------------------------------------------
+# Client side
+# -----------------------------------------------------------------------------
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def probe(base, headers, stop, out):
+    session = requests.Session()
+    while not stop.is_set():
+        start = time.perf_counter()
+        session.get(f"{base}/api/history?limit=5", headers=headers, timeout=30)
+        out.append(time.perf_counter() - start)
+        time.sleep(0.02)
+
+
+def stormer(base, stop, counts):
+    session = requests.Session()
+    while not stop.is_set():
+        r = session.post(f"{base}/api/login", timeout=60,
+                         json={"email": EMAIL, "password": PASSWORD})
+        counts[r.status_code] = counts.get(r.status_code, 0) + 1
+
+
+def run_mode(mode, args):
+    port = args.port
+    db_path = os.path.join(tempfile.mkdtemp(prefix="login-storm-"), "bench.db")
+    env = dict(
+        os.environ,
+        PASSWORD_HASH_POOL=mode,
+        DATABASE_URL=f"sqlite:///{db_path}",
+        NANOBANANA_KEY=os.getenv("NANOBANANA_KEY", "bench"),
+        LOG_LEVEL="WARNING",
+        LOG_LEVELS="werkzeug=WARNING",
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "bench.login_storm", "--serve", str(port)],
+        cwd=BACKEND_DIR, env=env,
+        start_new_session=True,   # so hash pool workers are stopped too
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        token = None
+        for _ in range(100):
+            try:
+                r = requests.post(f"{base}/api/login",
+                                  json={"email": EMAIL, "password": PASSWORD}, timeout=30)
+                token = r.json()["token"]
+                break
+            except (requests.ConnectionError, KeyError, ValueError):
+                time.sleep(0.2)
+        if token is None:
+            raise RuntimeError("server did not start")
+        headers = {"Authorization": f"Bearer {token}"}
+
+        def phase(storm_threads):
+            stop = threading.Event()
+            latencies, counts = [], {}
+            threads = [threading.Thread(target=probe, args=(base, headers, stop, latencies))]
+            threads += [threading.Thread(target=stormer, args=(base, stop, counts))
+                        for _ in range(storm_threads)]
+            for t in threads:
+                t.start()
+            time.sleep(args.seconds)
+            stop.set()
+            for t in threads:
+                t.join()
+            return latencies, counts
+
+        idle, _ = phase(0)
+        busy, counts = phase(args.storm)
+        return {
+            "mode": mode,
+            "idle_p50_ms": percentile(idle, 0.5) * 1000,
+            "idle_p99_ms": percentile(idle, 0.99) * 1000,
+            "storm_p50_ms": percentile(busy, 0.5) * 1000,
+            "storm_p99_ms": percentile(busy, 0.99) * 1000,
+            "logins_per_s": counts.get(200, 0) / args.seconds,
+            "login_503s": counts.get(503, 0),
+        }
+    finally:
+        os.killpg(server.pid, signal.SIGTERM)
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Login storm benchmark")
+    parser.add_argument("--modes", default="inline,process")
+    parser.add_argument("--storm", type=int, default=16, help="concurrent login clients")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return
+
+    print(f"{'mode':8} {'idle p50':>9} {'idle p99':>9} {'storm p50':>10} "
+          f"{'storm p99':>10} {'logins/s':>9} {'503s':>6}")
+    for mode in args.modes.split(","):
+        r = run_mode(mode.strip(), args)
+        print(f"{r['mode']:8} {r['idle_p50_ms']:8.1f}ms {r['idle_p99_ms']:8.1f}ms "
+              f"{r['storm_p50_ms']:9.1f}ms {r['storm_p99_ms']:9.1f}ms "
+              f"{r['logins_per_s']:9.1f} {r['login_503s']:6d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+# =============================================================================
+# COMFYUI CLIENT POOL (multiple GPU hosts)
+# =============================================================================
+# Every ComfyUI call goes through one pooled requests.Session (keep-alive,
+# timeouts, retries on idempotent GETs). Backends come from COMFY_BACKENDS
+# (comma separated base URLs). A background thread reads each backend's
+# /queue to track health and queue depth; submit() picks the least loaded
+# healthy backend, preferring hosts that already have the workflow's
+# checkpoint loaded, and fails over to the next one when it can't connect or
+# answers 5xx. A /prompt that was sent but got no answer (read timeout) is
+# not resubmitted: it may already be queued there.
+#
+# AsyncComfyClient makes the same calls with httpx for the ASGI app. It
+# shares the pool's backends, so health, load and checkpoint affinity are the
+# same whichever serving mode submitted a prompt.
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.retry import Retry
+
+import metrics
+from comfy_events import ComfyEventListener
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - optional dependency (ASGI mode)
+    httpx = None
+
+log = logging.getLogger(__name__)
+
+
+COMFY_BACKENDS = [
+    url.strip().rstrip("/")
+    for url in os.getenv("COMFY_BACKENDS", "http://127.0.0.1:8188").split(",")
+    if url.strip()
+]
+COMFY_CONNECT_TIMEOUT = float(os.getenv("COMFY_CONNECT_TIMEOUT", "3"))
+COMFY_READ_TIMEOUT = float(os.getenv("COMFY_READ_TIMEOUT", "30"))
+COMFY_HEALTH_INTERVAL = float(os.getenv("COMFY_HEALTH_INTERVAL", "5"))
+# How many extra queued prompts we accept to land on a host that already has
+# the checkpoint in VRAM (swapping checkpoints costs several seconds).
+COMFY_AFFINITY_SLACK = int(os.getenv("COMFY_AFFINITY_SLACK", "2"))
+
+OUTPUT_OWNER_LIMIT = 10000
+
+
+class ComfyUnavailable(Exception):
+    """No healthy ComfyUI backend accepted the request."""
+
+
+class ComfyRejected(Exception):
+    """A backend answered but refused the workflow (bad graph, etc.)."""
+
+
+def submit_outcome(status_code):
+    """comfy_submit_duration_seconds outcome label for a /prompt status."""
+    if status_code == 200:
+        return "ok"
+    return "error" if status_code >= 500 else "rejected"
+
+
+def never_sent(error):
+    """
+    True when a requests error means the request never reached the server
+    (connect timeout, connection refused, DNS failure). Other
+    ConnectionErrors, e.g. "Connection aborted" (RemoteDisconnected), can
+    happen after the body went out.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    # requests wraps urllib3's MaxRetryError, whose .reason is the cause
+    reason = getattr(reason, "reason", reason)
+    return isinstance(reason, NewConnectionError)
+
+
+def workflow_checkpoint(workflow):
+    for node in workflow.values():
+        if node.get("class_type") == "CheckpointLoaderSimple":
+            return node.get("inputs", {}).get("ckpt_name")
+    return None
+
+
+class ComfyBackend:
+    def __init__(self, url):
+        self.url = url
+        self.listener = ComfyEventListener(url)
+        self.healthy = True
+        self.queue_depth = 0
+        self.inflight = 0
+        self.loaded_checkpoint = None
+        self.last_error = None
+
+    @property
+    def load(self):
+        return self.queue_depth + self.inflight
+
+    def to_dict(self):
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "queue_depth": self.queue_depth,
+            "inflight": self.inflight,
+            "loaded_checkpoint": self.loaded_checkpoint,
+            "events_connected": self.listener.connected,
+            "last_error": self.last_error,
+        }
+
+
+class ComfyPool:
+    def __init__(self, urls=None):
+        self.backends = [ComfyBackend(url) for url in (urls or COMFY_BACKENDS)]
+        self.timeout = (COMFY_CONNECT_TIMEOUT, COMFY_READ_TIMEOUT)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=len(self.backends),
+            pool_maxsize=32,
+            max_retries=Retry(
+                total=2, backoff_factor=0.2,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset(["GET"]),
+            ),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._lock = threading.Lock()
+        self._output_owner = OrderedDict()
+        self._health_thread = None
+
+    # ------------------------------------------------------------------
+    # Lifecycle / health
+    # ------------------------------------------------------------------
+    def start(self):
+        """Start the health checker and event listeners (idempotent)."""
+        with self._lock:
+            if self._health_thread and self._health_thread.is_alive():
+                return
+            self._health_thread = threading.Thread(
+                target=self._health_loop, name="comfy-health", daemon=True
+            )
+            self._health_thread.start()
+        for backend in self.backends:
+            backend.listener.start()
+
+    def _health_loop(self):
+        while True:
+            for backend in self.backends:
+                self.check(backend)
+            time.sleep(COMFY_HEALTH_INTERVAL)
+
+    def check(self, backend):
+        try:
+            res = self.session.get(f"{backend.url}/queue", timeout=self.timeout)
+            res.raise_for_status()
+            queue = res.json()
+            backend.queue_depth = (
+                len(queue.get("queue_running", []))
+                + len(queue.get("queue_pending", []))
+            )
+            backend.healthy = True
+            backend.last_error = None
+        except (requests.RequestException, ValueError) as e:
+            self._mark_down(backend, e)
+
+    def _mark_down(self, backend, error):
+        if backend.healthy:
+            log.warning("ComfyUI backend down: %s (%s)", backend.url, error)
+        backend.healthy = False
+        backend.last_error = str(error)
+
+    # ------------------------------------------------------------------
+    # Backend selection
+    # ------------------------------------------------------------------
+    def candidates(self, checkpoint=None):
+        """Healthy backends in preference order (affinity, then load)."""
+        healthy = [b for b in self.backends if b.healthy]
+        if not healthy:
+            # Everything looks down: try them all rather than failing fast,
+            # the health data may simply be stale.
+            healthy = list(self.backends)
+
+        healthy.sort(key=lambda b: b.load)
+        if not checkpoint:
+            return healthy
+
+        floor = healthy[0].load + COMFY_AFFINITY_SLACK
+        warm = [
+            b for b in healthy
+            if b.loaded_checkpoint == checkpoint and b.load <= floor
+        ]
+        return warm + [b for b in healthy if b not in warm]
+
+    # ------------------------------------------------------------------
+    # API calls
+    # ------------------------------------------------------------------
+    def submit(self, workflow):
+        """Queue workflow on the best backend. Returns (backend, prompt_id)."""
+        self.start()
+        checkpoint = workflow_checkpoint(workflow)
+
+        for backend in self.candidates(checkpoint):
+            started = time.perf_counter()
+            try:
+                res = self.session.post(
+                    f"{backend.url}/prompt",
+                    json={"prompt": workflow,
+                          "client_id": backend.listener.client_id},
+                    timeout=self.timeout,
+                )
+            except requests.RequestException as e:
+                metrics.COMFY_SUBMIT_LATENCY.observe(
+                    time.perf_counter() - started, backend.url, "error")
+                if never_sent(e):
+                    self._mark_down(backend, e)
+                    continue
+                # Sent, but no answer (ReadTimeout, connection dropped...):
+                # it may be queued there, so resubmitting could render twice
+                raise self._lost(backend, e) from e
+            metrics.COMFY_SUBMIT_LATENCY.observe(
+                time.perf_counter() - started, backend.url, submit_outcome(res.status_code))
+
+            prompt_id = self._accepted(backend, checkpoint, res)
+            if prompt_id:
+                return backend, prompt_id
+
+        raise ComfyUnavailable("No ComfyUI backend available")
+
+    def _lost(self, backend, error):
+        backend.last_error = str(error)
+        log.warning("ComfyUI %s gave no answer to /prompt: %s", backend.url, error)
+        return ComfyUnavailable("ComfyUI did not answer the request")
+
+    def _accepted(self, backend, checkpoint, res):
+        """
+        prompt_id from a /prompt response (requests or httpx), or None when
+        the backend failed and the next one should be tried.
+        """
+        if res.status_code >= 500:
+            self._mark_down(backend, f"HTTP {res.status_code}")
+            return None
+        if res.status_code != 200:
+            raise ComfyRejected(res.text[:500])
+
+        prompt_id = res.json().get("prompt_id")
+        if not prompt_id:
+            raise ComfyRejected("Invalid response from ComfyUI")
+
+        with self._lock:
+            backend.inflight += 1
+            backend.loaded_checkpoint = checkpoint
+        return prompt_id
+
+    def release(self, backend):
+        with self._lock:
+            backend.inflight = max(0, backend.inflight - 1)
+
+    def history(self, backend, prompt_id):
+        """One /history lookup; returns the history entry or None."""
+        try:
+            res = self.session.get(
+                f"{backend.url}/history/{prompt_id}", timeout=self.timeout
+            )
+        except requests.RequestException:
+            return None
+        if res.status_code != 200:
+            return None
+        return res.json().get(prompt_id)
+
+    def remember_output(self, filename, backend):
+        with self._lock:
+            self._output_owner[filename] = backend
+            self._output_owner.move_to_end(filename)
+            while len(self._output_owner) > OUTPUT_OWNER_LIMIT:
+                self._output_owner.popitem(last=False)
+
+    def output_backends(self, filename):
+        """The backend that rendered filename, else every candidate."""
+        with self._lock:
+            owner = self._output_owner.get(filename)
+        return [owner] if owner else self.candidates()
+
+    def fetch_output(self, filename):
+        """
+        Download an output image from the backend that rendered it (or any
+        healthy backend). Returns (content, content_type) or None.
+        """
+        for backend in self.output_backends(filename):
+            try:
+                res = self.session.get(
+                    f"{backend.url}/view",
+                    params={"filename": filename, "type": "output"},
+                    timeout=self.timeout,
+                )
+            except requests.RequestException:
+                continue
+            if res.status_code == 200:
+                return res.content, res.headers.get("Content-Type", "image/png")
+        return None
+
+    def status(self):
+        return [backend.to_dict() for backend in self.backends]
+
+
+class AsyncComfyClient:
+    """Coroutine versions of ComfyPool.submit / history / fetch_output."""
+
+    def __init__(self, pool):
+        if httpx is None:
+            raise RuntimeError("AsyncComfyClient needs the httpx package")
+        self.pool = pool
+        self._client = None
+
+    @property
+    def client(self):
+        # Created on first use so it binds to the serving event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(COMFY_READ_TIMEOUT, connect=COMFY_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=256, max_keepalive_connections=32),
+                transport=httpx.AsyncHTTPTransport(retries=2),
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def submit(self, workflow):
+        """Queue workflow on the best backend. Returns (backend, prompt_id)."""
+        pool = self.pool
+        pool.start()
+        checkpoint = workflow_checkpoint(workflow)
+
+        for backend in pool.candidates(checkpoint):
+            started = time.perf_counter()
+            try:
+                res = await self.client.post(
+                    f"{backend.url}/prompt",
+                    json={"prompt": workflow,
+                          "client_id": backend.listener.client_id},
+                )
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                metrics.COMFY_SUBMIT_LATENCY.observe(
+                    time.perf_counter() - started, backend.url, "error")
+                pool._mark_down(backend, e)
+                continue
+            except httpx.HTTPError as e:
+                # Sent but unanswered (ReadTimeout, RemoteProtocolError...):
+                # don't resubmit (see ComfyPool.submit)
+                metrics.COMFY_SUBMIT_LATENCY.observe(
+                    time.perf_counter() - started, backend.url, "error")
+                raise pool._lost(backend, e) from e
+            metrics.COMFY_SUBMIT_LATENCY.observe(
+                time.perf_counter() - started, backend.url, submit_outcome(res.status_code))
+
+            prompt_id = pool._accepted(backend, checkpoint, res)
+            if prompt_id:
+                return backend, prompt_id
+
+        raise ComfyUnavailable("No ComfyUI backend available")
+
+    async def history(self, backend, prompt_id):
+        """One /history lookup; returns the history entry or None."""
+        try:
+            res = await self.client.get(f"{backend.url}/history/{prompt_id}")
+        except httpx.HTTPError:
+            return None
+        if res.status_code != 200:
+            return None
+        return res.json().get(prompt_id)
+
+    async def fetch_output(self, filename):
+        """Output image bytes from its backend: (content, content_type) or None."""
+        for backend in self.pool.output_backends(filename):
+            try:
+                res = await self.client.get(
+                    f"{backend.url}/view",
+                    params={"filename": filename, "type": "output"},
+                )
+            except httpx.HTTPError:
+                continue
+            if res.status_code == 200:
+                return res.content, res.headers.get("Content-Type", "image/png")
+        return None
@@ -0,0 +1,223 @@
+# =============================================================================
+# COMFYUI EXECUTION EVENTS (websocket listener)
+# =============================================================================
+# One shared websocket connection per ComfyUI host replaces per-job polling of
+# /history/<prompt_id>. ComfyUI pushes "progress", "executing", "executed" and
+# "execution_error" messages for every prompt queued with our client_id; the
+# listener routes them to a PromptWaiter that the job thread blocks on.
+#
+# Needs the optional `websocket-client` package. Without it (or while the
+# socket is down) `connected` is False and callers fall back to polling.
+# Events sent while the socket reconnects are lost, so callers still check
+# /history now and then; a waiter finished without images means "ask
+# /history", not "failed".
+# The ASGI app awaits PromptWaiter.wait_async() instead of parking a thread.
+
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+
+try:
+    import websocket  # websocket-client
+except ImportError:  # pragma: no cover - optional dependency
+    websocket = None
+
+log = logging.getLogger(__name__)
+
+
+OUTPUT_NODE = "9"
+EARLY_EVENT_TTL_SECONDS = 300
+
+
+class PromptWaiter:
+    """Completion handle for one ComfyUI prompt."""
+
+    def __init__(self, prompt_id, output_node=OUTPUT_NODE):
+        self.prompt_id = prompt_id
+        self.output_node = output_node
+        self.progress = 0
+        self.images = []
+        self.error = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._progress_callbacks = []
+        self._done_callbacks = []
+        self._async_done = None
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    async def wait_async(self, timeout=None):
+        """wait() for coroutines; call from one event loop only."""
+        if self._async_done is None:
+            loop = asyncio.get_running_loop()
+            self._async_done = loop.create_future()
+            # finish() runs on the listener thread: hop back onto the loop
+            self.add_done_callback(
+                lambda _: loop.call_soon_threadsafe(self._set_async_done)
+            )
+        try:
+            await asyncio.wait_for(asyncio.shield(self._async_done), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def _set_async_done(self):
+        if not self._async_done.done():
+            self._async_done.set_result(True)
+
+    def on_progress(self, fn):
+        """fn(percent) is called from the listener thread on every step."""
+        self._progress_callbacks.append(fn)
+
+    def add_done_callback(self, fn):
+        """fn(waiter) is called once the prompt finishes (or immediately)."""
+        with self._lock:
+            if not self.done:
+                self._done_callbacks.append(fn)
+                return
+        fn(self)
+
+    def set_progress(self, value, maximum):
+        if not maximum:
+            return
+        self.progress = int(value * 100 / maximum)
+        for fn in self._progress_callbacks:
+            fn(self.progress)
+
+    def finish(self, images=None, error=None):
+        with self._lock:
+            if self.done:
+                return
+            if images:
+                self.images = images
+            self.error = error
+            if not error:
+                self.progress = 100
+            self._done.set()
+            callbacks, self._done_callbacks = self._done_callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+
+class ComfyEventListener:
+    """Background websocket reader for one ComfyUI host."""
+
+    def __init__(self, base_url, client_id=None):
+        self.base_url = base_url.rstrip("/")
+        self.client_id = client_id or uuid.uuid4().hex
+        self.connected = False
+        self._waiters = {}
+        self._early = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def ws_url(self):
+        scheme, rest = self.base_url.split("://", 1)
+        ws_scheme = "wss" if scheme == "https" else "ws"
+        return f"{ws_scheme}://{rest}/ws?clientId={self.client_id}"
+
+    def start(self):
+        """Start the reader thread once (no-op without websocket-client)."""
+        if websocket is None:
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="comfy-events", daemon=True
+            )
+            self._thread.start()
+
+    def register(self, prompt_id, output_node=OUTPUT_NODE):
+        """Return the waiter for prompt_id, replaying events that beat us."""
+        waiter = PromptWaiter(prompt_id, output_node)
+        with self._lock:
+            self._waiters[prompt_id] = waiter
+            early = self._early.pop(prompt_id, None)
+        if early:
+            for message in early[1]:
+                self._dispatch(message)
+        return waiter
+
+    def unregister(self, prompt_id):
+        with self._lock:
+            self._waiters.pop(prompt_id, None)
+
+    # ------------------------------------------------------------------
+    # Reader loop
+    # ------------------------------------------------------------------
+    def _run(self):
+        backoff = 1
+        while True:
+            try:
+                ws = websocket.create_connection(self.ws_url, timeout=10)
+                ws.settimeout(None)
+                self.connected = True
+                backoff = 1
+                while True:
+                    raw = ws.recv()
+                    if isinstance(raw, bytes):
+                        continue  # binary frames are latent previews
+                    self._dispatch(json.loads(raw))
+            except Exception as e:
+                if self.connected:
+                    log.warning("ComfyUI websocket lost (%s): %s", self.base_url, e)
+                self.connected = False
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def _dispatch(self, message):
+        data = message.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        if not prompt_id:
+            return
+
+        with self._lock:
+            waiter = self._waiters.get(prompt_id)
+            if waiter is None:
+                self._remember_early(prompt_id, message)
+                return
+
+        msg_type = message.get("type")
+        if msg_type == "progress":
+            waiter.set_progress(data.get("value", 0), data.get("max", 0))
+        elif msg_type == "executed":
+            if str(data.get("node")) == waiter.output_node:
+                waiter.images = (data.get("output") or {}).get("images", [])
+        elif msg_type == "executing":
+            # node None means the whole prompt has finished
+            if data.get("node") is None:
+                self._complete(waiter)
+        elif msg_type == "execution_success":
+            self._complete(waiter)
+        elif msg_type in ("execution_error", "execution_interrupted"):
+            waiter.finish(error=data.get("exception_message") or msg_type)
+            self.unregister(prompt_id)
+
+    def _complete(self, waiter):
+        # Without images (e.g. the "executed" event was missed) the waiter
+        # still finishes cleanly; the job confirms with /history first
+        waiter.finish(images=waiter.images)
+        self.unregister(waiter.prompt_id)
+
+    def _remember_early(self, prompt_id, message):
+        # Called with self._lock held. Events can arrive before the job has
+        # read the prompt_id from the /prompt response and registered.
+        now = time.time()
+        entry = self._early.setdefault(prompt_id, (now, []))
+        entry[1].append(message)
+        stale = [
+            pid for pid, (ts, _) in self._early.items()
+            if now - ts > EARLY_EVENT_TTL_SECONDS
+        ]
+        for pid in stale:
+            del self._early[pid]
@@ -0,0 +1 @@
+# Local stand-ins for upstream services (ComfyUI, Gemini) used in development.
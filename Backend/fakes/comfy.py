@@ -0,0 +1,301 @@
+# =============================================================================
+# FAKE COMFYUI SERVER (local development / tests / benchmarks)
+# =============================================================================
+# Speaks just enough of the ComfyUI API for the backend:
+#   POST /prompt            -> {"prompt_id": ...}, then "renders" in a thread
+#   GET  /history/<id>      -> {id: {"outputs": {"9": {"images": [...]}}}}
+#   GET  /queue             -> {"queue_running": [...], "queue_pending": [...]}
+#   GET  /view?filename=... -> a small PNG for any rendered output
+#   GET  /ws?clientId=...   -> websocket with progress/executing/executed events
+#
+# Usage:
+#   python -m fakes.comfy --port 8188 --steps 32 --step-delay 0.05
+# Only uses the standard library.
+
+import argparse
+import base64
+import hashlib
+import json
+import random
+import struct
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OUTPUT_NODE = "9"
+
+
+def tiny_png(width=8, height=8, rgb=(200, 120, 40)):
+    """A valid solid-colour PNG, built without Pillow."""
+    def chunk(kind, data):
+        return (struct.pack("!I", len(data)) + kind + data +
+                struct.pack("!I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+    row = b"\0" + bytes(rgb) * width
+    return (b"\x89PNG\r\n\x1a\n" +
+            chunk(b"IHDR", struct.pack("!IIBBBBB", width, height, 8, 2, 0, 0, 0)) +
+            chunk(b"IDAT", zlib.compress(row * height)) +
+            chunk(b"IEND", b""))
+
+
+class FakeServer(ThreadingHTTPServer):
+    # The default listen backlog (5) refuses connections under benchmark load
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class FakeComfyState:
+    def __init__(self, steps=32, step_delay=0.05, error_rate=0.0, workers=1):
+        self.steps = steps
+        self.step_delay = step_delay
+        self.error_rate = error_rate
+        self.history = {}
+        self.running = []
+        self.pending = []
+        self.clients = {}  # client_id -> (wfile, lock)
+        self.counter = 0
+        self.lock = threading.Lock()
+        self._slots = threading.Semaphore(workers)
+
+    # ----------------------------- websocket -------------------------------
+    def send(self, client_id, message):
+        # Like ComfyUI: only the submitting client's socket gets the events;
+        # if it isn't connected (reconnecting) they are lost
+        with self.lock:
+            target = self.clients.get(client_id)
+        if target is None:
+            return
+        wfile, lock = target
+        payload = json.dumps(message).encode("utf-8")
+        try:
+            with lock:
+                wfile.write(_ws_frame(payload))
+                wfile.flush()
+        except OSError:
+            pass
+
+    # ------------------------------ renderer -------------------------------
+    def queue_prompt(self, workflow, client_id):
+        prompt_id = str(uuid.uuid4())
+        with self.lock:
+            self.pending.append(prompt_id)
+        threading.Thread(
+            target=self._render, args=(prompt_id, workflow, client_id),
+            daemon=True
+        ).start()
+        return prompt_id
+
+    def _render(self, prompt_id, workflow, client_id):
+        with self._slots:
+            with self.lock:
+                self.pending.remove(prompt_id)
+                self.running.append(prompt_id)
+            try:
+                self._execute(prompt_id, workflow, client_id)
+            finally:
+                with self.lock:
+                    self.running.remove(prompt_id)
+
+    def _execute(self, prompt_id, workflow, client_id):
+        self.send(client_id, {"type": "execution_start",
+                              "data": {"prompt_id": prompt_id}})
+        sampler = next(
+            (node_id for node_id, node in workflow.items()
+             if node.get("class_type") == "KSampler"), "3"
+        )
+        self.send(client_id, {"type": "executing",
+                              "data": {"node": sampler, "prompt_id": prompt_id}})
+
+        steps = int(workflow.get(sampler, {}).get("inputs", {}).get("steps")
+                    or self.steps)
+        for step in range(1, steps + 1):
+            time.sleep(self.step_delay)
+            self.send(client_id, {"type": "progress", "data": {
+                "value": step, "max": steps,
+                "prompt_id": prompt_id, "node": sampler,
+            }})
+
+        if random.random() < self.error_rate:
+            self.send(client_id, {"type": "execution_error", "data": {
+                "prompt_id": prompt_id, "node_id": sampler,
+                "exception_message": "Fake sampler failure",
+            }})
+            return
+
+        with self.lock:
+            self.counter += 1
+            filename = f"ComfyUI_{self.counter:05d}_.png"
+        images = [{"filename": filename, "subfolder": "", "type": "output"}]
+
+        with self.lock:
+            self.history[prompt_id] = {
+                "prompt": [0, prompt_id, workflow, {}, [OUTPUT_NODE]],
+                "outputs": {OUTPUT_NODE: {"images": images}},
+                "status": {"status_str": "success", "completed": True},
+            }
+        self.send(client_id, {"type": "executed", "data": {
+            "node": OUTPUT_NODE, "output": {"images": images},
+            "prompt_id": prompt_id,
+        }})
+        self.send(client_id, {"type": "executing",
+                              "data": {"node": None, "prompt_id": prompt_id}})
+
+
+def _ws_frame(payload, opcode=0x1):
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def _ws_read_frame(rfile):
+    """Returns (opcode, payload) of one client frame, or (None, b"") on EOF."""
+    head = rfile.read(2)
+    if len(head) < 2:
+        return None, b""
+    opcode = head[0] & 0x0F
+    masked = head[1] & 0x80
+    length = head[1] & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", rfile.read(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", rfile.read(8))[0]
+    mask = rfile.read(4) if masked else b"\0\0\0\0"
+    data = rfile.read(length)
+    return opcode, bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+
+
+def make_handler(state):
+    class FakeComfyHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, payload, status=200):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/prompt":
+                return self._json({"error": "not found"}, 404)
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            workflow = body.get("prompt")
+            if not isinstance(workflow, dict) or not workflow:
+                return self._json({"error": "invalid prompt"}, 400)
+            prompt_id = state.queue_prompt(workflow, body.get("client_id"))
+            self._json({"prompt_id": prompt_id, "number": state.counter,
+                        "node_errors": {}})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/ws":
+                client_id = parse_qs(url.query).get("clientId", [""])[0]
+                return self._websocket(client_id or uuid.uuid4().hex)
+            if url.path == "/queue":
+                with state.lock:
+                    return self._json({
+                        "queue_running": [[0, pid] for pid in state.running],
+                        "queue_pending": [[0, pid] for pid in state.pending],
+                    })
+            if url.path.startswith("/history/"):
+                prompt_id = url.path[len("/history/"):]
+                with state.lock:
+                    entry = state.history.get(prompt_id)
+                return self._json({prompt_id: entry} if entry else {})
+            if url.path == "/view":
+                filename = parse_qs(url.query).get("filename", [""])[0]
+                with state.lock:
+                    known = any(
+                        img["filename"] == filename
+                        for entry in state.history.values()
+                        for img in entry["outputs"][OUTPUT_NODE]["images"]
+                    )
+                if not known:
+                    return self._json({"error": "not found"}, 404)
+                body = tiny_png()
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            if url.path == "/system_stats":
+                return self._json({"system": {"os": "fake"}, "devices": []})
+            self._json({"error": "not found"}, 404)
+
+        def _websocket(self, client_id):
+            key = self.headers.get("Sec-WebSocket-Key", "")
+            accept = base64.b64encode(
+                hashlib.sha1((key + WS_GUID).encode()).digest()
+            ).decode()
+            self.send_response(101)
+            self.send_header("Upgrade", "websocket")
+            self.send_header("Connection", "Upgrade")
+            self.send_header("Sec-WebSocket-Accept", accept)
+            self.end_headers()
+            self.wfile.flush()
+
+            lock = threading.Lock()
+            with state.lock:
+                state.clients[client_id] = (self.wfile, lock)
+            state.send(client_id, {"type": "status", "data": {
+                "status": {"exec_info": {"queue_remaining": 0}},
+                "sid": client_id,
+            }})
+            try:
+                while True:
+                    opcode, _ = _ws_read_frame(self.rfile)
+                    if opcode is None or opcode == 0x8:
+                        break
+            except OSError:
+                pass
+            finally:
+                with state.lock:
+                    state.clients.pop(client_id, None)
+                self.close_connection = True
+
+    return FakeComfyHandler
+
+
+def serve(host="127.0.0.1", port=8188, **state_kwargs):
+    """Start the fake server in a daemon thread. Returns (server, state)."""
+    state = FakeComfyState(**state_kwargs)
+    server = FakeServer((host, port), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake ComfyUI server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--steps", type=int, default=32)
+    parser.add_argument("--step-delay", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    server = FakeServer(
+        (args.host, args.port),
+        make_handler(FakeComfyState(
+            steps=args.steps, step_delay=args.step_delay,
+            error_rate=args.error_rate, workers=args.workers,
+        )),
+    )
+    print(f"Fake ComfyUI listening on http://{args.host}:{args.port}")
+    server.serve_forever()
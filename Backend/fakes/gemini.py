@@ -0,0 +1,170 @@
+# =============================================================================
+# FAKE GEMINI SERVER (local development / benchmarks)
+# =============================================================================
+# Speaks the REST surface google.generativeai uses with transport="rest":
+#   POST /v1beta/models/<model>:generateContent        -> one candidate
+#   POST /v1beta/models/<model>:streamGenerateContent  -> JSON array of chunks
+# Point the backend at it with GEMINI_API_ENDPOINT=http://127.0.0.1:8189.
+#
+# Latency is latency +/- jitter seconds per call (streams spread it over the
+# chunks); error_rate of calls answer error_status instead (500 by default,
+# 429 to look like quota exhaustion).
+#
+# Usage:
+#   python -m fakes.gemini --port 8189 --latency 0.8 --jitter 0.3 --error-rate 0.02
+# Only uses the standard library.
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+from fakes.comfy import FakeServer
+
+
+class FakeGeminiState:
+    def __init__(self, latency=0.5, jitter=0.2, error_rate=0.0,
+                 error_status=500, chunks=4):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.chunks = chunks
+        self.calls = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def delay(self):
+        return max(0.0, random.uniform(self.latency - self.jitter,
+                                       self.latency + self.jitter))
+
+    def should_fail(self):
+        failed = random.random() < self.error_rate
+        with self.lock:
+            self.calls += 1
+            self.errors += failed
+        return failed
+
+
+def answer_text(prompt):
+    """Three short lines, so every tool's parser sees a plausible answer."""
+    topic = " ".join(prompt.split()[-6:])[:80] or "your request"
+    return (f"Fake answer about {topic}\n"
+            "#fake #benchmark #gemini\n"
+            "Post in the evening and keep it short.")
+
+
+def _candidate(text, finish=True):
+    chunk = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+    if finish:
+        chunk["finishReason"] = "STOP"
+    return {"candidates": [chunk]}
+
+
+def _prompt_of(body):
+    return " ".join(
+        part.get("text", "")
+        for content in body.get("contents", [])
+        for part in content.get("parts", [])
+    )
+
+
+def make_handler(state):
+    class FakeGeminiHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, payload, status=200):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            _, _, method = path.rpartition(":")
+            if not path.startswith("/v1beta/models/") or \
+                    method not in ("generateContent", "streamGenerateContent"):
+                return self._json({"error": {"code": 404, "message": "not found"}}, 404)
+
+            delay = state.delay()
+            if state.should_fail():
+                time.sleep(delay)
+                return self._json({"error": {
+                    "code": state.error_status,
+                    "message": "Fake Gemini failure",
+                    "status": "RESOURCE_EXHAUSTED" if state.error_status == 429
+                    else "INTERNAL",
+                }}, state.error_status)
+
+            text = answer_text(_prompt_of(body))
+            if method == "generateContent":
+                time.sleep(delay)
+                return self._json(_candidate(text))
+            self._stream(text, delay)
+
+        def _stream(self, text, delay):
+            # Chunked JSON array, one candidate per chunk
+            words = text.split(" ")
+            n = max(1, min(state.chunks, len(words)))
+            step = -(-len(words) // n)
+            pieces = [" ".join(words[i:i + step]) + " " for i in range(0, len(words), step)]
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i, piece in enumerate(pieces):
+                time.sleep(delay / len(pieces))
+                data = json.dumps(_candidate(piece, finish=i == len(pieces) - 1))
+                data = ("[" if i == 0 else ",") + data
+                if i == len(pieces) - 1:
+                    data += "]"
+                self._chunk(data.encode("utf-8"))
+            self._chunk(b"")
+
+        def _chunk(self, data):
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+    return FakeGeminiHandler
+
+
+def serve(host="127.0.0.1", port=8189, **state_kwargs):
+    """Start the fake server in a daemon thread. Returns (server, state)."""
+    state = FakeGeminiState(**state_kwargs)
+    server = FakeServer((host, port), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Gemini server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8189)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--chunks", type=int, default=4)
+    args = parser.parse_args()
+
+    server = FakeServer(
+        (args.host, args.port),
+        make_handler(FakeGeminiState(
+            latency=args.latency, jitter=args.jitter,
+            error_rate=args.error_rate, error_status=args.error_status,
+            chunks=args.chunks,
+        )),
+    )
+    print(f"Fake Gemini listening on http://{args.host}:{args.port}")
+    server.serve_forever()
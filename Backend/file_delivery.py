@@ -0,0 +1,139 @@
+# =============================================================================
+# FILE DELIVERY (generated images, uploads, ComfyUI outputs)
+# =============================================================================
+# FILE_DELIVERY selects how image bytes leave the server:
+#   standalone  (default) the app sends the file itself. Full responses go
+#               through the server's wsgi.file_wrapper (gunicorn: os.sendfile,
+#               no copy through Python); byte ranges are read in chunks, or
+#               also sendfile'd on gunicorn (it honours Content-Length).
+#   x-accel     nginx: answer with X-Accel-Redirect: FILE_DELIVERY_PREFIX/
+#               <root>/<path> and let nginx stream the file. Example:
+#                   location /_files/generated/ {
+#                       internal;
+#                       alias /srv/app/Backend/generated/;
+#                   }
+#               (one location per root registered with add_root())
+#   x-sendfile  Apache mod_xsendfile / lighttpd: X-Sendfile: <absolute path>
+#
+# In every mode the app answers conditional GETs itself (ETag and
+# Last-Modified -> 304) before doing anything else. Range requests (206/416,
+# If-Range) are handled here in standalone mode and by the proxy otherwise.
+
+import mimetypes
+import os
+from datetime import datetime, timezone
+
+from flask import Response, abort, request
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
+
+
+FILE_DELIVERY = os.getenv("FILE_DELIVERY", "standalone").lower()
+FILE_DELIVERY_PREFIX = os.getenv("FILE_DELIVERY_PREFIX", "/_files").rstrip("/")
+CHUNK_SIZE = 256 * 1024
+
+
+def _read_range(f, length):
+    try:
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+class FileDelivery:
+    def __init__(self, mode=FILE_DELIVERY, prefix=FILE_DELIVERY_PREFIX):
+        if mode not in ("standalone", "x-accel", "x-sendfile"):
+            raise ValueError(f"Unknown FILE_DELIVERY mode: {mode}")
+        self.mode = mode
+        self.prefix = prefix
+        self.roots = {}
+        self.counts = {"sent": 0, "partial": 0, "not_modified": 0, "offloaded": 0}
+
+    def add_root(self, name, directory):
+        """Register a directory files may be sent from (and its proxy name)."""
+        self.roots[name] = os.path.abspath(directory)
+
+    def send(self, root, filename, etag=None, immutable=False):
+        """
+        Response for `filename` inside registered root `root` (404 if it
+        doesn't exist). `etag` defaults to size+mtime; content-addressed files
+        pass their digest and immutable=True.
+        """
+        path = safe_join(self.roots[root], filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+
+        st = os.stat(path)
+        etag = etag or f"{st.st_size:x}-{st.st_mtime_ns:x}"
+        modified = datetime.fromtimestamp(int(st.st_mtime), timezone.utc)
+        mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+        response = Response(mimetype=mimetype)
+        response.set_etag(etag)
+        response.last_modified = modified
+        response.accept_ranges = "bytes"
+        response.headers["X-Content-Type-Options"] = "nosniff"
+        if immutable:
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        else:
+            response.headers["Cache-Control"] = "no-cache"
+
+        if not is_resource_modified(request.environ, etag=etag, last_modified=modified):
+            response.status_code = 304
+            self.counts["not_modified"] += 1
+            return response
+
+        if self.mode != "standalone":
+            self.counts["offloaded"] += 1
+        if self.mode == "x-accel":
+            rel = os.path.relpath(path, self.roots[root]).replace(os.sep, "/")
+            response.headers["X-Accel-Redirect"] = f"{self.prefix}/{root}/{rel}"
+            return response
+        if self.mode == "x-sendfile":
+            response.headers["X-Sendfile"] = path
+            return response
+
+        return self._standalone(response, path, st.st_size, etag, modified)
+
+    def _standalone(self, response, path, size, etag, modified):
+        start, length = 0, size
+        byte_range = request.range
+        # If-Range: only honour the range when the client's copy is current
+        if_range = request.if_range
+        if (if_range.etag is not None and if_range.etag != etag) or \
+                (if_range.date is not None and if_range.date < modified):
+            byte_range = None
+
+        if byte_range is not None and len(byte_range.ranges) == 1:
+            bounds = byte_range.range_for_length(size)
+            if bounds is None:
+                response.status_code = 416
+                response.headers["Content-Range"] = f"bytes */{size}"
+                return response
+            start, end = bounds
+            length = end - start
+            response.status_code = 206
+            response.content_range = byte_range.to_content_range_header(size)
+            self.counts["partial"] += 1
+        else:
+            self.counts["sent"] += 1
+
+        f = open(path, "rb")
+        f.seek(start)
+        response.direct_passthrough = True
+        response.content_length = length
+        if length == size or request.environ.get("SERVER_SOFTWARE", "").startswith("gunicorn"):
+            # File wrapper from the server: sendfile from the current offset
+            response.response = wrap_file(request.environ, f, CHUNK_SIZE)
+        else:
+            response.response = _read_range(f, length)
+        return response
+
+    def stats(self):
+        return {"mode": self.mode, "roots": sorted(self.roots), **self.counts}
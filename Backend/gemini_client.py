@@ -0,0 +1,302 @@
+# =============================================================================
+# GEMINI CLIENT (shared wrapper around prompt_model.generate_content)
+# =============================================================================
+# All tools call Gemini through GeminiClient.generate(tool, instruction) so
+# cross-cutting behaviour lives in one place instead of being copy-pasted
+# into every route:
+#   - generate() for a full answer, stream() for token-by-token output
+#   - response cache + single-flight for identical instructions
+#   - token bucket matched to our quota (GEMINI_RPM / GEMINI_BURST)
+#   - at most GEMINI_MAX_CONCURRENCY calls in flight
+#   - per-call timeout (GEMINI_TIMEOUT seconds)
+#   - circuit breaker: after GEMINI_BREAKER_FAILURES failures in a row we
+#     stop calling for GEMINI_BREAKER_RESET seconds and answer with the
+#     tool's fallback immediately, so latency stays flat during outages.
+#     Only upstream failures count (transport errors, timeouts, 429, 5xx):
+#     a safety-blocked answer or a 400 is the request's fault, and must not
+#     let one user's prompts open the circuit for everybody.
+# agenerate() is the coroutine twin used by the ASGI app: same cache, limits
+# and breaker, but it awaits generate_content_async instead of blocking (or
+# runs generate_content in a thread when native_async is off: the REST
+# transport has no async client).
+
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import metrics
+from llm_cache import cache_key
+from resilience import CircuitBreaker, TokenBucket
+from singleflight import AsyncSingleFlight, SingleFlight
+
+try:
+    from google.api_core import exceptions as google_exceptions
+except ImportError:  # pragma: no cover - comes with google-generativeai
+    google_exceptions = None
+
+log = logging.getLogger(__name__)
+
+
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "60"))
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", "10"))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+GEMINI_QUEUE_TIMEOUT = float(os.getenv("GEMINI_QUEUE_TIMEOUT", "2"))
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "20"))
+GEMINI_BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", "5"))
+GEMINI_BREAKER_RESET = float(os.getenv("GEMINI_BREAKER_RESET", "30"))
+
+
+class GeminiUnavailable(Exception):
+    """Gemini could not be called (breaker open, over quota, failure)."""
+
+
+def upstream_failure(error):
+    """
+    True when `error` says Gemini itself is unhealthy. response.text raising
+    ValueError (blocked candidate: SAFETY, RECITATION, ...), blocked prompts
+    and other 4xx are about the request instead.
+    """
+    # OSError covers requests' ConnectionError/Timeout (REST transport)
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, OSError)):
+        return True
+    if google_exceptions is not None and \
+            isinstance(error, google_exceptions.GoogleAPICallError):
+        return error.code is None or error.code == 429 or error.code >= 500
+    return False
+
+
+class GeminiClient:
+    def __init__(self, model, cache, native_async=True):
+        self.model = model
+        self.cache = cache
+        self.native_async = native_async
+        # Identical instructions in flight at the same time share one call
+        self.flight = SingleFlight("gemini")
+        self.async_flight = AsyncSingleFlight("gemini-async")
+        self.limiter = TokenBucket(GEMINI_RPM / 60.0, GEMINI_BURST)
+        self.slots = threading.BoundedSemaphore(GEMINI_MAX_CONCURRENCY)
+        self.breaker = CircuitBreaker(GEMINI_BREAKER_FAILURES, GEMINI_BREAKER_RESET)
+        self.timeout = GEMINI_TIMEOUT
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    @property
+    def model_name(self):
+        return getattr(self.model, "model_name", "gemini")
+
+    def generate(self, tool, instruction, fallback=None):
+        """
+        Text answer for instruction (served from cache when possible).
+        If Gemini can't answer, returns `fallback`, or raises
+        GeminiUnavailable when the tool has no fallback.
+        """
+        key = cache_key(self.model_name, instruction)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        try:
+            return self.flight.do(key, self._call, key, tool, instruction)
+        except GeminiUnavailable as e:
+            return self._fallback(tool, fallback, e)
+
+    async def agenerate(self, tool, instruction, fallback=None):
+        """generate() for coroutines; the cache lookup runs in a thread."""
+        key = cache_key(self.model_name, instruction)
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            return cached
+
+        try:
+            return await self.async_flight.do(
+                key, self._call_async, key, tool, instruction
+            )
+        except GeminiUnavailable as e:
+            return self._fallback(tool, fallback, e)
+
+    def _fallback(self, tool, fallback, error):
+        if fallback is None:
+            raise error
+        log.warning("Gemini unavailable for %s, using fallback: %s", tool, error)
+        self._count("fallbacks")
+        metrics.GEMINI_FALLBACKS.inc(1, tool)
+        return fallback
+
+    def stream(self, tool, instruction, fallback=None):
+        """
+        Yields the answer as text chunks as Gemini produces them (cache hits
+        come back as a single chunk). Same fallback rules as generate();
+        streams are not coalesced by single-flight.
+        """
+        key = cache_key(self.model_name, instruction)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+        try:
+            self._acquire()
+        except GeminiUnavailable as e:
+            yield self._fallback(tool, fallback, e)
+            return
+
+        parts = []
+        started = time.perf_counter()
+        try:
+            self._count("calls")
+            response = self.model.generate_content(
+                instruction,
+                stream=True,
+                request_options={"timeout": self.timeout}
+            )
+            for chunk in response:
+                text = chunk.text
+                if text:
+                    parts.append(text)
+                    yield text
+        except GeneratorExit:
+            # Client went away mid-stream: neither a success nor Gemini's
+            # fault, so only the half-open trial (if this was it) is released
+            self.breaker.record_ignored()
+            raise
+        except Exception as e:
+            self._failed(tool, started, e)
+            if parts or fallback is None:
+                raise GeminiUnavailable(str(e)) from e
+            self._count("fallbacks")
+            metrics.GEMINI_FALLBACKS.inc(1, tool)
+            yield fallback
+            return
+        finally:
+            self.slots.release()
+
+        self.breaker.record_success()
+        metrics.GEMINI_LATENCY.observe(time.perf_counter() - started, tool, "ok")
+        self.cache.put(key, tool, "".join(parts).strip())
+
+    def _acquire(self):
+        """Pass breaker, rate limiter and concurrency limit, or raise."""
+        if self.breaker.is_open:
+            self._reject("circuit open")
+
+        if not self.limiter.acquire(GEMINI_QUEUE_TIMEOUT):
+            self._reject("rate limit reached")
+
+        if not self.slots.acquire(timeout=GEMINI_QUEUE_TIMEOUT):
+            self._reject("too many concurrent calls")
+
+        if not self.breaker.allow():
+            self.slots.release()
+            self._reject("circuit open")
+
+    async def _acquire_async(self):
+        if self.breaker.is_open:
+            self._reject("circuit open")
+
+        if not await self.limiter.acquire_async(GEMINI_QUEUE_TIMEOUT):
+            self._reject("rate limit reached")
+
+        # The slots are shared with the threaded path, so poll the semaphore
+        # rather than block the event loop on it
+        deadline = time.monotonic() + GEMINI_QUEUE_TIMEOUT
+        while not self.slots.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                self._reject("too many concurrent calls")
+            await asyncio.sleep(0.01)
+
+        if not self.breaker.allow():
+            self.slots.release()
+            self._reject("circuit open")
+
+    def _reject(self, reason):
+        self._count("rejected")
+        metrics.GEMINI_REJECTED.inc(1, reason)
+        raise GeminiUnavailable(reason)
+
+    def _call(self, key, tool, instruction):
+        self._acquire()
+
+        started = time.perf_counter()
+        try:
+            self._count("calls")
+            response = self.model.generate_content(
+                instruction,
+                request_options={"timeout": self.timeout}
+            )
+            text = response.text.strip()
+        except Exception as e:
+            self._failed(tool, started, e)
+            raise GeminiUnavailable(str(e)) from e
+        finally:
+            self.slots.release()
+
+        self.breaker.record_success()
+        metrics.GEMINI_LATENCY.observe(time.perf_counter() - started, tool, "ok")
+        self.cache.put(key, tool, text)
+        return text
+
+    async def _call_async(self, key, tool, instruction):
+        await self._acquire_async()
+
+        started = time.perf_counter()
+        try:
+            self._count("calls")
+            if self.native_async:
+                call = self.model.generate_content_async(
+                    instruction,
+                    request_options={"timeout": self.timeout}
+                )
+            else:
+                call = asyncio.to_thread(
+                    self.model.generate_content,
+                    instruction,
+                    request_options={"timeout": self.timeout}
+                )
+            # wait_for as well: the async transport can outlive its own timeout
+            response = await asyncio.wait_for(call, self.timeout)
+            text = response.text.strip()
+        except Exception as e:
+            self._failed(tool, started, e)
+            raise GeminiUnavailable(str(e)) from e
+        finally:
+            self.slots.release()
+
+        self.breaker.record_success()
+        metrics.GEMINI_LATENCY.observe(time.perf_counter() - started, tool, "ok")
+        await asyncio.to_thread(self.cache.put, key, tool, text)
+        return text
+
+    def _failed(self, tool, started, error):
+        """Book a failed call; the breaker only hears about upstream failures."""
+        self._count("failures")
+        if upstream_failure(error):
+            self.breaker.record_failure()
+            outcome = "error"
+        else:
+            log.info("Gemini refused the %s request: %s", tool, error)
+            self.breaker.record_ignored()
+            outcome = "blocked"
+        metrics.GEMINI_LATENCY.observe(time.perf_counter() - started, tool, outcome)
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "model": self.model_name,
+                "breaker_state": self.breaker.state,
+                "tokens_available": round(self.limiter.tokens, 2),
+                "calls": self.calls,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "fallbacks": self.fallbacks,
+                "single_flight": self.flight.stats(),
+                "async_single_flight": self.async_flight.stats(),
+            }
@@ -0,0 +1,277 @@
+# =============================================================================
+# WRITE-BEHIND HISTORY RECORDING
+# =============================================================================
+# Optional (HISTORY_WRITE_BEHIND=True). save_history() puts the row on a
+# bounded in-process queue instead of committing inside the request; a
+# background thread bulk-inserts rows in batches once HISTORY_BATCH_SIZE rows
+# are waiting or HISTORY_FLUSH_INTERVAL seconds have passed.
+#
+# Durability: every queued row is first appended (and flushed to the OS) to
+# this process's own spill file (JSON lines, spill-<pid>-<random>.jsonl in
+# the spill directory, HISTORY_SPILL_DIR) and a {"flushed": seq} marker is
+# appended after each committed batch. The file is truncated whenever the
+# queue drains. The background thread fsyncs the file once per batch /
+# HISTORY_FLUSH_INTERVAL (group commit), never the request thread: queued
+# rows survive a process crash, but a power loss can lose the rows of the
+# last interval.
+# Each process holds an exclusive lock on its spill file while it runs. On
+# start-up, spill files nobody holds (their process crashed) are locked,
+# their rows newer than the last marker are replayed, and only those files
+# are deleted, so several workers can share the directory. If the queue is
+# full save_history() falls back to a normal synchronous commit. Rows show
+# up in /api/history after the next flush.
+
+import atexit
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from sqlalchemy.exc import IntegrityError
+
+log = logging.getLogger(__name__)
+
+
+HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "False") == "True"
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "200"))
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "1.0"))
+HISTORY_QUEUE_SIZE = int(os.getenv("HISTORY_QUEUE_SIZE", "10000"))
+
+
+def _lock_nowait(f):
+    """Exclusive lock on open file f; False if another process holds it."""
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+class HistoryWriter:
+    def __init__(self, app, db, table, spill_dir,
+                 batch_size=HISTORY_BATCH_SIZE,
+                 flush_interval=HISTORY_FLUSH_INTERVAL,
+                 max_queue=HISTORY_QUEUE_SIZE):
+        self.app = app
+        self.db = db
+        self.table = table
+        self.spill_dir = spill_dir
+        # Per process: seq numbers and truncation are only meaningful locally
+        self.spill_path = os.path.join(
+            spill_dir, f"spill-{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl"
+        )
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.flushed_rows = 0
+        self.flushes = 0
+        self.overflows = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._spill_lock = threading.Lock()
+        self._spill = None
+        self._seq = 0
+        self._dirty = False
+        self._stop = threading.Event()
+        self._thread = None
+        self._after_flush = []
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+    def start(self):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self._spill = open(self.spill_path, "a", encoding="utf-8")
+        # Held for the life of the process: tells replaying workers we're alive
+        if not _lock_nowait(self._spill):
+            raise RuntimeError(f"Spill file {self.spill_path} is locked")
+        self._replay_orphans()
+        self._thread = threading.Thread(
+            target=self._run, name="history-writer", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def close(self):
+        """Flush everything still queued (called on interpreter shutdown)."""
+        if self._thread is None or self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join(timeout=30)
+
+    def after_flush(self, fn):
+        """fn(connection, rows) runs inside each batch's transaction."""
+        self._after_flush.append(fn)
+
+    # ------------------------------------------------------------------
+    # Producer side (request threads)
+    # ------------------------------------------------------------------
+    def enqueue(self, row):
+        """Queue a history row. Returns False when full (caller writes sync)."""
+        row = dict(row)
+        row.setdefault("created_at", datetime.utcnow())
+
+        with self._spill_lock:
+            if self._queue.full():
+                self.overflows += 1
+                return False
+            self._seq += 1
+            record = dict(row, created_at=row["created_at"].isoformat())
+            self._spill.write(json.dumps({"seq": self._seq, "row": record}) + "\n")
+            # flush() is enough to survive a crash; _sync() fsyncs in bulk
+            self._spill.flush()
+            self._dirty = True
+            self._queue.put_nowait((self._seq, row))
+        return True
+
+    # ------------------------------------------------------------------
+    # Consumer side (background thread)
+    # ------------------------------------------------------------------
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            self._sync()
+            if batch:
+                self._flush_with_retry(batch)
+        self._sync()
+
+    def _sync(self):
+        """fsync everything appended since the last call (one per batch)."""
+        with self._spill_lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            fd = self._spill.fileno()
+        # Outside the lock: enqueue() keeps appending while the disk syncs
+        os.fsync(fd)
+
+    def _next_batch(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0 or (self._stop.is_set() and self._queue.empty()):
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush_with_retry(self, batch):
+        backoff = 0.5
+        while True:
+            try:
+                self._flush([row for _, row in batch])
+                break
+            except IntegrityError:
+                # e.g. the user was deleted while their rows were queued:
+                # insert one by one and drop only the rows that can't go in
+                self._flush_rows_individually([row for _, row in batch])
+                break
+            except Exception as e:
+                # Rows stay in the spill file; keep retrying the same batch
+                log.error("History flush failed (%d rows): %s", len(batch), e)
+                if self._stop.is_set() and backoff > 8:
+                    return
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+        self._mark_flushed(batch[-1][0])
+
+    def _flush(self, rows):
+        with self.app.app_context():
+            with self.db.engine.begin() as conn:
+                conn.execute(self.table.insert(), rows)
+                for fn in self._after_flush:
+                    fn(conn, rows)
+        self.flushed_rows += len(rows)
+        self.flushes += 1
+
+    def _flush_rows_individually(self, rows):
+        for row in rows:
+            try:
+                self._flush([row])
+            except IntegrityError as e:
+                log.error("Dropped history row for user %s: %s", row.get("user_id"), e.orig)
+
+    def _mark_flushed(self, seq):
+        with self._spill_lock:
+            if self._queue.empty():
+                # Nothing pending: start a fresh spill file
+                self._spill.seek(0)
+                self._spill.truncate()
+            else:
+                self._spill.write(json.dumps({"flushed": seq}) + "\n")
+            self._spill.flush()
+            self._dirty = True
+
+    def _replay_orphans(self):
+        """Replay spill files left by crashed processes (never raises)."""
+        for path in sorted(glob.glob(os.path.join(self.spill_dir, "spill-*.jsonl"))):
+            if path == self.spill_path:
+                continue
+            try:
+                with open(path, "r+", encoding="utf-8") as f:
+                    # Locked: its process is alive, or another worker is on it
+                    if not _lock_nowait(f):
+                        continue
+                    if not os.path.exists(path):
+                        continue  # replayed and removed while we waited
+                    count = self._replay_file(f)
+                    if fcntl is not None:
+                        # Delete while still holding the lock, and only this file
+                        os.remove(path)
+                if fcntl is None:
+                    os.remove(path)  # Windows can't delete an open file
+                if count:
+                    log.info("Replayed %d history row(s) from %s", count, path)
+            except Exception:
+                # Keep the file: the next start-up tries again
+                log.exception("History spill replay failed for %s", path)
+
+    def _replay_file(self, f):
+        f.seek(0)
+        pending = {}
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # torn last line from a crash mid-write
+            if "flushed" in entry:
+                for seq in [s for s in pending if s <= entry["flushed"]]:
+                    del pending[seq]
+            elif "seq" in entry:
+                row = entry["row"]
+                row["created_at"] = datetime.fromisoformat(row["created_at"])
+                pending[entry["seq"]] = row
+
+        rows = [pending[seq] for seq in sorted(pending)]
+        if rows:
+            try:
+                self._flush(rows)
+            except IntegrityError:
+                # Same as a live batch: keep the rows that can still go in
+                self._flush_rows_individually(rows)
+        return len(rows)
+
+    def stats(self):
+        return {
+            "enabled": True,
+            "queued": self._queue.qsize(),
+            "flushed_rows": self.flushed_rows,
+            "flushes": self.flushes,
+            "overflows": self.overflows,
+        }
@@ -0,0 +1,260 @@
+# =============================================================================
+# BACKGROUND JOBS (prompt-to-image and other long running generations)
+# =============================================================================
+# Long running work (ComfyUI generations) used to run inside the Flask request
+# and hold a worker thread for the whole generation. JobManager runs that work
+# on a small executor instead: the request only submits the job and returns a
+# job id, the client then polls (or long-polls) a cheap status endpoint.
+# Under the ASGI app, submit_async() runs coroutine jobs as tasks on the event
+# loop instead, so a job waiting on the GPU doesn't hold a worker thread.
+#
+# Jobs live in the memory of the process that accepted them: a status poll
+# answered by another worker process gets 404. Run the backend as ONE
+# process (threads under a WSGI server, or a single uvicorn worker), or pin
+# clients to a worker with sticky sessions. WEB_CONCURRENCY > 1 (gunicorn's
+# default worker count) is warned about at startup.
+
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "3600"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobError(Exception):
+    """Raised by a job function to fail the job with a client facing message."""
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class Job:
+    def __init__(self, user_id, kind):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.kind = kind
+        self.status = QUEUED
+        self.progress = 0
+        self.result = None
+        self.error = None
+        self.status_code = 200
+        self.created_at = time.time()
+        self.finished_at = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._done_callbacks = []
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def wait(self, timeout=None):
+        """Block until the job finishes or timeout expires. Returns finished."""
+        return self._done.wait(timeout)
+
+    async def wait_async(self, timeout=None):
+        """wait() for coroutines (long-polling from the ASGI app)."""
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+
+        def wake(_job):
+            loop.call_soon_threadsafe(lambda: done.done() or done.set_result(True))
+
+        self.add_done_callback(wake)
+        try:
+            await asyncio.wait_for(done, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.remove_done_callback(wake)
+        return self.finished
+
+    def add_done_callback(self, fn):
+        """fn(job) is called once the job finishes (or immediately)."""
+        with self._lock:
+            if not self._done.is_set():
+                self._done_callbacks.append(fn)
+                return
+        fn(self)
+
+    def remove_done_callback(self, fn):
+        with self._lock:
+            if fn in self._done_callbacks:
+                self._done_callbacks.remove(fn)
+
+    def _finish(self):
+        self.finished_at = time.time()
+        with self._lock:
+            self._done.set()
+            callbacks, self._done_callbacks = self._done_callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+    def to_dict(self):
+        data = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+        }
+        if self.status == DONE:
+            data["success"] = True
+            data.update(self.result or {})
+        elif self.status == FAILED:
+            data["success"] = False
+            data["error"] = self.error
+        return data
+
+
+class ProgressFanout:
+    """
+    Progress of shared work (one coalesced render), copied to every job
+    waiting on it: single-flight only runs the leader's call, so followers
+    would otherwise sit at 0% until the result arrives.
+    """
+
+    def __init__(self):
+        self._entries = {}  # key -> [percent, set of jobs]
+        self._lock = threading.Lock()
+
+    def join(self, key, job):
+        with self._lock:
+            entry = self._entries.setdefault(key, [0, set()])
+            entry[1].add(job)
+            job.progress = entry[0]
+
+    def leave(self, key, job):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry[1].discard(job)
+            if not entry[1]:
+                del self._entries[key]
+
+    def update(self, key, percent):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry[0] = percent
+            jobs = list(entry[1])
+        for job in jobs:
+            job.progress = percent
+
+
+class JobManager:
+    def __init__(self, max_workers=JOB_WORKERS, ttl=JOB_TTL_SECONDS):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="job"
+        )
+        self._jobs = {}
+        self._tasks = set()
+        self._lock = threading.Lock()
+        self._ttl = ttl
+        if WEB_CONCURRENCY > 1:
+            log.warning("WEB_CONCURRENCY=%d: jobs are kept per process, so status "
+                        "polls that reach another worker will 404; run a single "
+                        "process or use sticky sessions", WEB_CONCURRENCY)
+
+    def _register(self, user_id, kind):
+        job = Job(user_id, kind)
+        with self._lock:
+            self._purge_expired()
+            self._jobs[job.id] = job
+        return job
+
+    def submit(self, user_id, kind, fn, *args, **kwargs):
+        """Queue fn(job, *args, **kwargs) and return the Job right away."""
+        job = self._register(user_id, kind)
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def submit_async(self, user_id, kind, fn, *args, **kwargs):
+        """
+        Like submit() for a coroutine function: await fn(job, ...) as a task
+        on the running event loop. Must be called from that loop.
+        """
+        job = self._register(user_id, kind)
+        task = asyncio.get_running_loop().create_task(
+            self._run_async(job, fn, args, kwargs)
+        )
+        # The loop only keeps weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def get(self, job_id, user_id=None):
+        """Return the job, or None if unknown / owned by another user."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or (user_id is not None and job.user_id != user_id):
+            return None
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = RUNNING
+        metrics.JOBS_IN_FLIGHT.add(1, job.kind)
+        try:
+            self._succeed(job, fn(job, *args, **kwargs))
+        except Exception as e:
+            self._fail(job, e)
+        finally:
+            metrics.JOBS_IN_FLIGHT.add(-1, job.kind)
+            job._finish()
+
+    async def _run_async(self, job, fn, args, kwargs):
+        job.status = RUNNING
+        metrics.JOBS_IN_FLIGHT.add(1, job.kind)
+        try:
+            self._succeed(job, await fn(job, *args, **kwargs))
+        except Exception as e:
+            self._fail(job, e)
+        finally:
+            metrics.JOBS_IN_FLIGHT.add(-1, job.kind)
+            job._finish()
+
+    @staticmethod
+    def _succeed(job, result):
+        job.result = result
+        job.progress = 100
+        job.status = DONE
+
+    @staticmethod
+    def _fail(job, error):
+        if isinstance(error, JobError):
+            job.error = error.message
+            job.status_code = error.status_code
+        else:
+            log.error("Job %s (%s) failed", job.id, job.kind, exc_info=error)
+            job.error = "Internal server error"
+            job.status_code = 500
+        job.status = FAILED
+
+    def _purge_expired(self):
+        # Called with self._lock held
+        cutoff = time.time() - self._ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
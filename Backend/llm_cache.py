@@ -0,0 +1,180 @@
+# =============================================================================
+# LLM RESPONSE CACHE (Gemini)
+# =============================================================================
+# Two tiers keyed by sha256(model name + normalized instruction):
+#   1. in-memory LRU (LLM_CACHE_MEMORY_ITEMS entries) - no I/O at all
+#   2. SQLite file (LLM_CACHE_PATH) - survives restarts, shared by workers
+# Each tool has its own TTL (LLM_CACHE_TTLS, seconds). Entries past their TTL
+# are treated as misses and overwritten on the next store; every
+# LLM_CACHE_PURGE_EVERY stores also deletes all expired rows, so the SQLite
+# file doesn't grow with answers nobody will read again.
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "True") == "True"
+LLM_CACHE_MEMORY_ITEMS = int(os.getenv("LLM_CACHE_MEMORY_ITEMS", "1024"))
+LLM_CACHE_DEFAULT_TTL = int(os.getenv("LLM_CACHE_DEFAULT_TTL", "86400"))
+LLM_CACHE_PURGE_EVERY = int(os.getenv("LLM_CACHE_PURGE_EVERY", "500"))
+
+LLM_CACHE_TTLS = {
+    "prompt_enhancer": 7 * 86400,
+    "insta_post": 86400,
+    "safety_gear": 7 * 86400,
+    # Constant instruction: the answer only changes when we change the prompt
+    "posture_analyzer": 30 * 86400,
+}
+
+
+def normalize_instruction(text):
+    """Collapse whitespace so re-indented prompts share a cache entry."""
+    return " ".join(text.split())
+
+
+def cache_key(model_name, instruction):
+    raw = f"{model_name}\0{normalize_instruction(instruction)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path, memory_items=LLM_CACHE_MEMORY_ITEMS,
+                 ttls=None, enabled=True):
+        self.path = path
+        self.memory_items = memory_items
+        self.ttls = dict(LLM_CACHE_TTLS, **(ttls or {}))
+        self.enabled = enabled
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.purged = 0
+        self._memory = OrderedDict()  # key -> (expires_at, text)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if enabled:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with self._conn() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS llm_cache ("
+                    " key TEXT PRIMARY KEY,"
+                    " tool TEXT NOT NULL,"
+                    " response TEXT NOT NULL,"
+                    " created_at REAL NOT NULL,"
+                    " expires_at REAL NOT NULL)"
+                )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS ix_llm_cache_expires_at"
+                    " ON llm_cache (expires_at)"
+                )
+
+    def _conn(self):
+        # sqlite3 connections can't be shared across threads; one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def ttl(self, tool):
+        return self.ttls.get(tool, LLM_CACHE_DEFAULT_TTL)
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and entry[0] > now:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return entry[1]
+
+        try:
+            row = self._conn().execute(
+                "SELECT response, expires_at FROM llm_cache WHERE key = ?",
+                (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            log.warning("LLM cache read failed: %s", e)
+            row = None
+
+        with self._lock:
+            if row and row[1] > now:
+                self.disk_hits += 1
+                self._remember(key, row[1], row[0])
+                return row[0]
+            self.misses += 1
+        return None
+
+    def put(self, key, tool, response):
+        if not self.enabled or not response:
+            return
+        now = time.time()
+        expires_at = now + self.ttl(tool)
+
+        with self._lock:
+            self._remember(key, expires_at, response)
+            self.stores += 1
+            purge = LLM_CACHE_PURGE_EVERY > 0 and self.stores % LLM_CACHE_PURGE_EVERY == 0
+
+        try:
+            with self._conn() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache"
+                    " (key, tool, response, created_at, expires_at)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (key, tool, response, now, expires_at)
+                )
+        except sqlite3.Error as e:
+            log.warning("LLM cache write failed: %s", e)
+
+        if purge:
+            try:
+                self.purge_expired()
+            except sqlite3.Error as e:
+                log.warning("LLM cache purge failed: %s", e)
+
+    def _remember(self, key, expires_at, response):
+        # Called with self._lock held
+        self._memory[key] = (expires_at, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def purge_expired(self):
+        """Drop expired rows from the SQLite tier. Returns rows deleted."""
+        if not self.enabled:
+            return 0
+        with self._conn() as conn:
+            cur = conn.execute(
+                "DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),)
+            )
+        with self._lock:
+            self.purged += cur.rowcount
+        return cur.rowcount
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "memory_entries": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "stores": self.stores,
+                "purged": self.purged,
+            }
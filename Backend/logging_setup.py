@@ -0,0 +1,135 @@
+# =============================================================================
+# LOGGING SETUP (non-blocking, structured)
+# =============================================================================
+# Request threads only put records on an in-memory queue (QueueHandler); one
+# background QueueListener thread formats and writes them to stdout, so a
+# slow stdout pipe never adds latency to a request. If the queue is full the
+# record is dropped (and counted) instead of blocking.
+#
+# Configuration (environment):
+#   LOG_LEVEL         root level, default INFO
+#   LOG_LEVELS        per-module levels, e.g. "comfy_client=DEBUG,werkzeug=WARNING"
+#   LOG_FORMAT        "text" (default) or "json" (one JSON object per line)
+#   LOG_DEBUG_SAMPLE  0..1: turn DEBUG on everywhere but keep only this
+#                     fraction of DEBUG records (e.g. 0.01 in production)
+#   LOG_QUEUE_SIZE    max records waiting to be written, default 10000
+
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+
+# Attributes every LogRecord has; anything else came from `extra=`
+_STANDARD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listener = None
+_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text or record.exc_info:
+            entry["exc"] = record.exc_text or self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DebugSampler(logging.Filter):
+    """Lets through only `rate` of DEBUG records; other levels always pass."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that never blocks: drops the record when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Keep exception text but let the listener thread do the formatting
+        record = copy.copy(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+def _parse_levels(spec):
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, level = item.partition("=")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging():
+    """Install the queue handler on the root logger (safe to call twice)."""
+    global _listener, _handler
+    if _listener is not None:
+        return
+
+    if os.getenv("LOG_FORMAT", "text").lower() == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+        )
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+    _handler = DroppingQueueHandler(log_queue)
+
+    root = logging.getLogger()
+    root.handlers[:] = [_handler]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+    sample = os.getenv("LOG_DEBUG_SAMPLE")
+    if sample:
+        root.setLevel(logging.DEBUG)
+        _handler.addFilter(DebugSampler(float(sample)))
+
+    for name, level in _parse_levels(os.getenv("LOG_LEVELS", "")).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def logging_stats():
+    return {
+        "queued": _handler.queue.qsize() if _handler else 0,
+        "dropped": _handler.dropped if _handler else 0,
+    }
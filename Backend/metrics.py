@@ -0,0 +1,326 @@
+# =============================================================================
+# METRICS (Prometheus text format on GET /metrics)
+# =============================================================================
+# Counters, gauges and histograms cheap enough to stay on under full load:
+# every thread updates its own shard (a plain dict only that thread writes),
+# so recording takes no lock. A scrape copies and sums the shards; shards of
+# threads that have exited are folded into a "retired" total so values stay
+# monotonic however many threads the server spawns.
+#
+# What is recorded (and where):
+#   http_request_duration_seconds      per route/method/status (init_app here,
+#                                      timed() for the native ASGI routes)
+#   db_queries_per_request /           queries and query time per request
+#   db_query_time_per_request_seconds  (instrument_engine: SQLAlchemy events)
+#   db_query_duration_seconds          every statement, by verb
+#   comfy_submit_duration_seconds      POST /prompt per backend (comfy_client)
+#   comfy_wait_duration_seconds        submit -> output image (render job)
+#   gemini_request_duration_seconds    per tool, outcome ok/error/blocked
+#   gemini_rejected_total              breaker / quota / concurrency rejections
+#   gemini_fallbacks_total             answers replaced by the tool's fallback
+#   jobs_in_flight                     running background jobs per kind (jobs)
+#   upload_bytes_total / uploads_total stored vs deduplicated (upload_store)
+#
+# Configuration (environment):
+#   METRICS_TOKEN   if set, /metrics requires "Authorization: Bearer <token>"
+
+import os
+import threading
+import time
+from bisect import bisect_left
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers cache hits (ms) up to long GPU renders
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Shards:
+    """One dict per thread; the owning thread is its only writer."""
+
+    def __init__(self, merge):
+        self._merge = merge
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._live = []       # (thread, cells)
+        self._retired = {}
+
+    def mine(self):
+        try:
+            return self._local.cells
+        except AttributeError:
+            cells = self._local.cells = {}
+            with self._lock:
+                # Thread-per-request servers register a shard per request:
+                # retire finished threads here too, not only on scrape, so
+                # _live stays bounded by the number of live threads
+                self._fold_dead()
+                self._live.append((threading.current_thread(), cells))
+            return cells
+
+    def _fold_dead(self):
+        # Called with self._lock held
+        live = []
+        for thread, cells in self._live:
+            if thread.is_alive():
+                live.append((thread, cells))
+            else:
+                self._merge(self._retired, cells)
+        self._live = live
+
+    def collect(self):
+        with self._lock:
+            self._fold_dead()
+            live = self._live
+
+            total = {}
+            self._merge(total, self._retired)
+            for _, cells in live:
+                # dict.copy() is atomic under the GIL, even mid-update
+                self._merge(total, cells.copy())
+        return total
+
+
+def _add_values(total, cells):
+    for key, value in cells.items():
+        total[key] = total.get(key, 0) + value
+
+
+def _add_buckets(total, cells):
+    for key, cell in cells.items():
+        cell = list(cell)
+        current = total.get(key)
+        if current is None:
+            total[key] = cell
+        else:
+            for i, value in enumerate(cell):
+                current[i] += value
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        with _registry_lock:
+            _registry.append(self)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}",
+                f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._shards = _Shards(_add_values)
+
+    def inc(self, amount=1, *labels):
+        cells = self._shards.mine()
+        cells[labels] = cells.get(labels, 0) + amount
+
+    def render(self):
+        lines = self._header()
+        for labels, value in sorted(self._shards.collect().items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    """Counter that may go down: add(-1) on another thread than add(1) is fine."""
+
+    kind = "gauge"
+
+    def add(self, amount, *labels):
+        self.inc(amount, *labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._shards = _Shards(_add_buckets)
+
+    def observe(self, value, *labels):
+        cells = self._shards.mine()
+        cell = cells.get(labels)
+        if cell is None:
+            # One slot per bucket, +Inf, then the sum
+            cell = cells[labels] = [0] * (len(self.buckets) + 2)
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def render(self):
+        lines = self._header()
+        bounds = self.buckets + (float("inf"),)
+        for labels, cell in sorted(self._shards.collect().items()):
+            cumulative = 0
+            for bound, count in zip(bounds, cell):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            suffix = _labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{suffix} {_number(cell[-1])}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+def render():
+    """The whole registry in Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ----------------------------
+# METRICS
+# ----------------------------
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time to produce the response, per route.",
+    ("method", "route", "status"))
+
+DB_QUERY_LATENCY = Histogram(
+    "db_query_duration_seconds", "SQL statement execution time.", ("verb",))
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request", "SQL statements executed per HTTP request.",
+    ("route",), buckets=COUNT_BUCKETS)
+DB_TIME_PER_REQUEST = Histogram(
+    "db_query_time_per_request_seconds", "SQL time spent per HTTP request.", ("route",))
+
+COMFY_SUBMIT_LATENCY = Histogram(
+    "comfy_submit_duration_seconds", "ComfyUI POST /prompt time per backend.",
+    ("backend", "outcome"))
+COMFY_WAIT_LATENCY = Histogram(
+    "comfy_wait_duration_seconds", "Time from ComfyUI submit to the output image.",
+    ("outcome",))
+
+GEMINI_LATENCY = Histogram(
+    "gemini_request_duration_seconds", "Gemini call time per tool.", ("tool", "outcome"))
+GEMINI_REJECTED = Counter(
+    "gemini_rejected_total", "Gemini calls refused before being made.", ("reason",))
+GEMINI_FALLBACKS = Counter(
+    "gemini_fallbacks_total", "Tool answers replaced by their fallback text.", ("tool",))
+
+JOBS_IN_FLIGHT = Gauge(
+    "jobs_in_flight", "Background jobs (generations) currently running.", ("kind",))
+
+UPLOAD_BYTES = Counter(
+    "upload_bytes_total", "Bytes received in uploaded files.", ("result",))
+UPLOADS = Counter(
+    "uploads_total", "Uploaded files, stored or deduplicated.", ("result",))
+
+
+# ----------------------------
+# FLASK / SQLALCHEMY / ASGI HOOKS
+# ----------------------------
+_request_state = threading.local()
+
+
+def _route():
+    from flask import request
+    rule = request.url_rule
+    return rule.rule if rule is not None else "<unmatched>"
+
+
+def init_app(app):
+    """Time every Flask request and count its SQL statements."""
+    from flask import request
+
+    @app.before_request
+    def _start_timer():
+        _request_state.start = time.perf_counter()
+        _request_state.queries = 0
+        _request_state.query_time = 0.0
+        _request_state.status = None
+
+    @app.after_request
+    def _status(response):
+        _request_state.status = response.status_code
+        return response
+
+    # Recorded at teardown, which also runs when the view raises (after_request
+    # is skipped for exceptions that propagate): those count as 500s
+    @app.teardown_request
+    def _record(exc):
+        start = getattr(_request_state, "start", None)
+        if start is None:
+            return
+        _request_state.start = None
+        status = _request_state.status
+        if exc is not None or status is None:
+            status = 500
+        route = _route()
+        HTTP_LATENCY.observe(time.perf_counter() - start,
+                             request.method, route, str(status))
+        DB_QUERIES_PER_REQUEST.observe(_request_state.queries, route)
+        DB_TIME_PER_REQUEST.observe(_request_state.query_time, route)
+
+
+def instrument_engine(engine):
+    """Time SQL statements on `engine`; also summed per request (see init_app)."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._metrics_start
+        DB_QUERY_LATENCY.observe(elapsed, statement.split(None, 1)[0].upper())
+        if getattr(_request_state, "start", None) is not None:
+            _request_state.queries += 1
+            _request_state.query_time += elapsed
+
+
+def timed(route, endpoint):
+    """
+    Starlette endpoint recording into HTTP_LATENCY under `route` (Flask rule
+    syntax, so both serving modes share series). Responses forwarded to
+    Flask carry no status here and are recorded by init_app instead. SQL the
+    handler runs in the thread pool isn't attributed to the request.
+    """
+    async def timed_endpoint(request):
+        start = time.perf_counter()
+        status = "500"
+        try:
+            response = await endpoint(request)
+            status = getattr(response, "status_code", None)
+            return response
+        finally:
+            if status is not None:
+                HTTP_LATENCY.observe(time.perf_counter() - start,
+                                     request.method, route, str(status))
+
+    return timed_endpoint
@@ -0,0 +1,284 @@
+# =============================================================================
+# SCHEMA MIGRATIONS
+# =============================================================================
+# Versioned migrations run once, in order, and are recorded in the
+# schema_migrations table. Repeatable migrations run again whenever their
+# checksum changes (edit the SQL -> it re-applies on next start).
+#
+# Every migration must be idempotent: version 1 creates the schema from the
+# current models on a fresh database, so later steps may find their work
+# already done (use checkfirst / IF NOT EXISTS).
+#
+# Usage (DATABASE_URL from the environment, like app.py):
+#   python migrations.py upgrade       apply pending migrations
+#   python migrations.py status        list applied / pending migrations
+#   python migrations.py check-plans   fail if a hot query does a full scan
+#                                      (on a fresh in-memory SQLite schema;
+#                                      add --live to use DATABASE_URL)
+
+import hashlib
+import inspect
+import logging
+import os
+import sys
+from datetime import datetime
+
+from sqlalchemy import (
+    and_, case, create_engine, func, inspect as sa_inspect, or_, select, text
+)
+from sqlalchemy.exc import IntegrityError
+
+from models import db, History, UsageCounter, UsageRollup, User
+
+log = logging.getLogger(__name__)
+
+
+class Migration:
+    def __init__(self, version, name, apply, repeatable=False):
+        self.version = version
+        self.name = name
+        self.apply = apply
+        self.repeatable = repeatable
+
+    @property
+    def checksum(self):
+        source = inspect.getsource(self.apply)
+        return hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+
+
+# -----------------------------------------------------------------------------
+# Versioned migrations
+# -----------------------------------------------------------------------------
+def m001_baseline(conn):
+    """Create every table the models declare (no-op on existing tables)."""
+    db.metadata.create_all(conn)
+
+
+def m002_history_indexes(conn):
+    """history: (user_id, id), (created_at), (tool_name, created_at)."""
+    for index in History.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def m003_usage_rollup(conn):
+    """usage_rollup table, backfilled from history when empty."""
+    table = UsageRollup.__table__
+    table.create(conn, checkfirst=True)
+    for index in table.indexes:
+        index.create(conn, checkfirst=True)
+
+    if conn.execute(select(func.count()).select_from(table)).scalar():
+        return
+
+    h = History.__table__
+    day = func.date(h.c.created_at)
+    has_output = or_(
+        and_(h.c.output_text.isnot(None), h.c.output_text != ""),
+        and_(h.c.output_img.isnot(None), h.c.output_img != ""),
+    )
+    conn.execute(table.insert().from_select(
+        ["day", "tool_name", "user_id", "count", "completed"],
+        select(day, h.c.tool_name, h.c.user_id, func.count(),
+               func.sum(case((has_output, 1), else_=0)))
+        .where(h.c.created_at.isnot(None))
+        .group_by(day, h.c.tool_name, h.c.user_id)
+    ))
+
+
+def m004_usage_counters(conn):
+    """usage_counters table, with the user count backfilled."""
+    table = UsageCounter.__table__
+    table.create(conn, checkfirst=True)
+
+    exists = conn.execute(
+        select(table.c.name).where(table.c.name == "users")
+    ).first()
+    if exists:
+        return
+    users = conn.execute(select(func.count()).select_from(User.__table__)).scalar()
+    conn.execute(table.insert().values(name="users", value=users))
+
+
+def m005_history_counters(conn):
+    """usage_counters: history_total / history_completed from the rollup."""
+    counters = UsageCounter.__table__
+    rollup = UsageRollup.__table__
+    sums = {
+        "history_total": rollup.c.count,
+        "history_completed": rollup.c.completed,
+    }
+    for name, column in sums.items():
+        exists = conn.execute(
+            select(counters.c.name).where(counters.c.name == name)
+        ).first()
+        if exists:
+            continue
+        value = conn.execute(select(func.coalesce(func.sum(column), 0))).scalar()
+        conn.execute(counters.insert().values(name=name, value=int(value)))
+
+
+MIGRATIONS = [
+    Migration(1, "baseline", m001_baseline),
+    Migration(2, "history_indexes", m002_history_indexes),
+    Migration(3, "usage_rollup", m003_usage_rollup),
+    Migration(4, "usage_counters", m004_usage_counters),
+    Migration(5, "history_counters", m005_history_counters),
+]
+
+
+# -----------------------------------------------------------------------------
+# Repeatable migrations
+# -----------------------------------------------------------------------------
+def r_planner_stats(conn):
+    """ANALYZE so the planner knows about the indexes (sqlite/postgresql)."""
+    if conn.dialect.name in ("sqlite", "postgresql"):
+        conn.execute(text("ANALYZE"))
+
+
+REPEATABLE = [
+    Migration(None, "planner_stats", r_planner_stats, repeatable=True),
+]
+
+
+# -----------------------------------------------------------------------------
+# Runner
+# -----------------------------------------------------------------------------
+def _ensure_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        " name VARCHAR(200) PRIMARY KEY,"
+        " version INTEGER,"
+        " checksum VARCHAR(64) NOT NULL,"
+        " applied_at TIMESTAMP NOT NULL)"
+    ))
+
+
+def _applied(conn):
+    rows = conn.execute(text("SELECT name, checksum FROM schema_migrations"))
+    return {name: checksum for name, checksum in rows}
+
+
+def _record(conn, migration):
+    conn.execute(text("DELETE FROM schema_migrations WHERE name = :name"),
+                 {"name": migration.name})
+    conn.execute(text(
+        "INSERT INTO schema_migrations (name, version, checksum, applied_at)"
+        " VALUES (:name, :version, :checksum, :applied_at)"
+    ), {
+        "name": migration.name,
+        "version": migration.version,
+        "checksum": migration.checksum,
+        "applied_at": datetime.utcnow(),
+    })
+
+
+def pending(engine):
+    with engine.begin() as conn:
+        _ensure_table(conn)
+        applied = _applied(conn)
+    return [
+        m for m in MIGRATIONS if m.name not in applied
+    ] + [
+        m for m in REPEATABLE if applied.get(m.name) != m.checksum
+    ]
+
+
+def run_migrations(engine):
+    """Apply pending migrations, each in its own transaction."""
+    applied_now = []
+    for migration in pending(engine):
+        try:
+            with engine.begin() as conn:
+                migration.apply(conn)
+                _record(conn, migration)
+        except IntegrityError:
+            # Another worker recorded it first; the work itself is idempotent
+            continue
+        applied_now.append(migration.name)
+        log.info("Migration applied: %s", migration.name)
+    return applied_now
+
+
+# -----------------------------------------------------------------------------
+# Query plan check (SQLite)
+# -----------------------------------------------------------------------------
+# The hot queries behind /api/history, /api/admin/history and delete_user.
+HOT_QUERIES = {
+    "history page": (
+        "SELECT id FROM history WHERE user_id = 1 AND id < 100"
+        " ORDER BY id DESC LIMIT 51"
+    ),
+    "history page by tool": (
+        "SELECT id FROM history WHERE user_id = 1 AND tool_name = 'x'"
+        " ORDER BY id DESC LIMIT 51"
+    ),
+    "admin page": "SELECT id FROM history WHERE id < 100 ORDER BY id DESC LIMIT 101",
+    "admin by tool and date": (
+        "SELECT id FROM history WHERE tool_name = 'x'"
+        " AND created_at >= '2024-01-01' ORDER BY id DESC LIMIT 101"
+    ),
+    "admin by date": (
+        "SELECT id FROM history WHERE created_at >= '2024-01-01'"
+        " AND created_at < '2024-02-01'"
+    ),
+    "delete user history": "SELECT id FROM history WHERE user_id = 1",
+}
+
+
+def check_query_plans(engine):
+    """
+    EXPLAIN QUERY PLAN every hot query; returns a list of (name, plan) that
+    fall back to a full table scan. Empty list means all good.
+    """
+    if engine.dialect.name != "sqlite":
+        raise RuntimeError("check-plans only understands SQLite plans")
+
+    failures = []
+    with engine.connect() as conn:
+        for name, sql in HOT_QUERIES.items():
+            plan = [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+            full_scan = any(
+                step.startswith("SCAN history") and "USING" not in step
+                for step in plan
+            )
+            if full_scan:
+                failures.append((name, plan))
+    return failures
+
+
+def _engine_from_env():
+    return create_engine(os.getenv("DATABASE_URL", "sqlite:///default.db"))
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    engine = _engine_from_env()
+
+    if command == "upgrade":
+        applied = run_migrations(engine)
+        print(f"{len(applied)} migration(s) applied")
+
+    elif command == "status":
+        todo = {m.name for m in pending(engine)}
+        for m in MIGRATIONS + REPEATABLE:
+            label = f"v{m.version}" if m.version else "repeatable"
+            print(f"{'pending' if m.name in todo else 'applied':8} {label:11} {m.name}")
+        tables = sa_inspect(engine).get_table_names()
+        print(f"tables: {', '.join(sorted(tables))}")
+
+    elif command == "check-plans":
+        # Planner statistics of a tiny dev database make scans look cheap;
+        # by default check what the migrated schema itself supports.
+        if "--live" not in sys.argv:
+            engine = create_engine("sqlite://")
+        run_migrations(engine)
+        failures = check_query_plans(engine)
+        for name, plan in failures:
+            print(f"❌ full scan: {name}: {' | '.join(plan)}")
+        if failures:
+            sys.exit(1)
+        print(f"✅ {len(HOT_QUERIES)} hot queries use indexes")
+
+    else:
+        print("usage: python migrations.py [upgrade|status|check-plans]")
+        sys.exit(2)
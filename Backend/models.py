@@ -12,6 +12,12 @@ db = SQLAlchemy()
 # =============================================================================
 class History(db.Model):
     __tablename__ = "history"
+    # Indexes for the hot queries (created by migrations.py on old databases)
+    __table_args__ = (
+        db.Index("ix_history_user_id_id", "user_id", "id"),
+        db.Index("ix_history_created_at", "created_at"),
+        db.Index("ix_history_tool_name_created_at", "tool_name", "created_at"),
+    )
 
     id=db.Column(db.Integer,primary_key=True)
     tool_name=db.Column(db.String(200),nullable=False)
@@ -53,6 +59,29 @@ class History(db.Model):
         }
 
 
+class UsageRollup(db.Model):
+    """Per-day, per-tool, per-user history counters (see usage_stats.py)."""
+    __tablename__ = "usage_rollup"
+    __table_args__ = (
+        db.Index("ix_usage_rollup_user_id", "user_id"),
+    )
+
+    day = db.Column(db.Date, primary_key=True)
+    tool_name = db.Column(db.String(200), primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    # rows that came back with an output (text or image)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+
+
+class UsageCounter(db.Model):
+    """Named running totals, e.g. the number of users (see usage_stats.py)."""
+    __tablename__ = "usage_counters"
+
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+
 class User(db.Model):
     __tablename__ = 'users'
 
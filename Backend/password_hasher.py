@@ -0,0 +1,170 @@
+# =============================================================================
+# PASSWORD HASHING POOL
+# =============================================================================
+# scrypt / PBKDF2 cost tens to hundreds of milliseconds of CPU per call. Done
+# inline in /api/login and /api/register, a login burst eats every request
+# thread. Hashes are computed in a small bounded pool instead:
+#   PASSWORD_HASH_POOL         "process" (default), "thread" or "inline"
+#   PASSWORD_HASH_WORKERS      pool size (default: CPU count, max 4)
+#   PASSWORD_HASH_MAX_PENDING  queued + running hashes before we refuse
+#                              with HashingBusy (-> 503 + Retry-After)
+#   PASSWORD_HASH_TIMEOUT      seconds to wait for a result
+#   PASSWORD_HASH_METHOD       werkzeug method string = hash cost for new
+#                              hashes, e.g. "scrypt:16384:8:1" or
+#                              "pbkdf2:sha256:600000" (existing hashes keep
+#                              verifying: they carry their own parameters)
+#
+# The process pool uses the "fork" start method where available: "spawn"
+# would re-import app.py in every worker. Forking a process that already
+# runs threads (log listener, ComfyUI listeners, history writer) can leave
+# children deadlocked on locks those threads held, so the workers are forked
+# once, eagerly, when auth.py is imported and the process is still single
+# threaded. If that's no longer true, or the pool breaks later, hashing
+# falls back to a thread pool instead of forking again. Platforms without
+# fork use threads too (hashlib releases the GIL while hashing, so threads
+# still help there).
+#
+# A hash that times out is cancelled if it hasn't started; one already
+# running keeps its slot in `pending` until it finishes, so
+# PASSWORD_HASH_MAX_PENDING bounds the real amount of queued work.
+
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+log = logging.getLogger(__name__)
+
+
+PASSWORD_HASH_POOL = os.getenv("PASSWORD_HASH_POOL", "process")
+PASSWORD_HASH_WORKERS = int(os.getenv(
+    "PASSWORD_HASH_WORKERS", str(min(os.cpu_count() or 1, 4))
+))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv(
+    "PASSWORD_HASH_MAX_PENDING", str(PASSWORD_HASH_WORKERS * 8)
+))
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", "10"))
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt")
+
+
+class HashingBusy(Exception):
+    """Too many password hashes queued (or the pool broke); retry shortly."""
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _verify(password_hash, password):
+    return check_password_hash(password_hash, password)
+
+
+class PasswordHasher:
+    def __init__(self, mode=PASSWORD_HASH_POOL, workers=PASSWORD_HASH_WORKERS,
+                 max_pending=PASSWORD_HASH_MAX_PENDING,
+                 timeout=PASSWORD_HASH_TIMEOUT, method=PASSWORD_HASH_METHOD):
+        if mode == "process" and "fork" not in multiprocessing.get_all_start_methods():
+            mode = "thread"
+        if mode == "process" and threading.active_count() > 1:
+            log.warning("Password hash pool created after threads started; "
+                        "using threads instead of forking")
+            mode = "thread"
+        self.mode = mode
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.method = method
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._pool = None
+        if mode != "inline":
+            self._pool = self._new_pool()
+
+    def _new_pool(self):
+        if self.mode == "process":
+            pool = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("fork")
+            )
+            # The first submit forks every worker: do it now, while we're
+            # still single threaded
+            pool.submit(int).result()
+            return pool
+        return ThreadPoolExecutor(self.workers, thread_name_prefix="password-hash")
+
+    def hash(self, password):
+        return self._run(_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(_verify, password_hash, password)
+
+    def _release(self, _future):
+        with self._lock:
+            self.pending -= 1
+
+    def _run(self, fn, *args):
+        if self.mode == "inline":
+            return fn(*args)
+
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HashingBusy(f"{self.pending} password hashes pending")
+            self.pending += 1
+            pool = self._pool
+
+        try:
+            future = pool.submit(fn, *args)
+        except Exception:
+            self._release(None)
+            raise
+        # The slot is freed when the work is really done (or cancelled),
+        # not when we stop waiting for it
+        future.add_done_callback(self._release)
+
+        try:
+            result = future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            with self._lock:
+                self.timed_out += 1
+            raise HashingBusy("password hash timed out")
+        except BrokenProcessPool:
+            # Don't fork again from a (by now) multithreaded process
+            log.error("Password hash worker died, switching to a thread pool")
+            with self._lock:
+                self.failed += 1
+                if self._pool is pool:
+                    self.mode = "thread"
+                    self._pool = self._new_pool()
+            pool.shutdown(wait=False)
+            raise HashingBusy("password hash pool restarted")
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+
+        with self._lock:
+            self.completed += 1
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "workers": self.workers,
+                "method": self.method,
+                "pending": self.pending,
+                "max_pending": self.max_pending,
+                "completed": self.completed,
+                "failed": self.failed,
+                "timed_out": self.timed_out,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,129 @@
+# =============================================================================
+# RESULT CACHE (content addressed prompt-to-image outputs)
+# =============================================================================
+# Opt-in (RESULT_CACHE_ENABLED=True). Key = sha256 of the fully resolved
+# workflow parameters; the seed is only part of the key when the client pinned
+# it (otherwise any seed is an acceptable answer). Images live on disk as
+# <RESULT_CACHE_DIR>/<key>.png and are evicted least-recently-used once the
+# directory grows past RESULT_CACHE_MAX_MB.
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "False") == "True"
+RESULT_CACHE_MAX_MB = int(os.getenv("RESULT_CACHE_MAX_MB", "2048"))
+
+
+def result_key(workflow_name, params, seed_pinned):
+    """Stable cache key for a generation request."""
+    params = dict(params)
+    if not seed_pinned:
+        params.pop("seed", None)
+    canonical = json.dumps(
+        {"workflow": workflow_name, "params": params},
+        sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, directory, max_bytes, enabled=True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._index = OrderedDict()  # key -> size, oldest first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        if enabled:
+            os.makedirs(directory, exist_ok=True)
+            self._load_index()
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".png"):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._bytes += size
+
+    @staticmethod
+    def filename(key):
+        return f"{key}.png"
+
+    def path(self, filename):
+        """Disk path of a cached output filename, or None if not cached."""
+        key = filename[:-4] if filename.endswith(".png") else None
+        with self._lock:
+            if key not in self._index:
+                return None
+        return os.path.join(self.directory, filename)
+
+    def get(self, key):
+        """Return the cached output filename for key (and count hit/miss)."""
+        with self._lock:
+            if key not in self._index:
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+            self.hits += 1
+        try:
+            os.utime(os.path.join(self.directory, self.filename(key)))
+        except OSError:
+            # Deleted behind our back: forget it
+            with self._lock:
+                self._bytes -= self._index.pop(key, 0)
+                self.hits -= 1
+                self.misses += 1
+            return None
+        return self.filename(key)
+
+    def put(self, key, content):
+        final_path = os.path.join(self.directory, self.filename(key))
+        tmp_path = f"{final_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, final_path)
+
+        with self._lock:
+            self._bytes -= self._index.pop(key, 0)
+            self._index[key] = len(content)
+            self._bytes += len(content)
+            self.stores += 1
+            evict = []
+            while self._bytes > self.max_bytes and len(self._index) > 1:
+                old_key, size = self._index.popitem(last=False)
+                self._bytes -= size
+                self.evictions += 1
+                evict.append(old_key)
+
+        for old_key in evict:
+            try:
+                os.remove(os.path.join(self.directory, self.filename(old_key)))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._index),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,108 @@
+# =============================================================================
+# SINGLE FLIGHT (coalesce concurrent identical upstream calls)
+# =============================================================================
+# While a call for a key is in flight, other callers asking for the same key
+# wait for it and share its result (or its exception) instead of firing a
+# duplicate Gemini request / ComfyUI render. AsyncSingleFlight does the same
+# for coroutines on one event loop (the ASGI app).
+
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0      # upstream calls actually made
+        self.coalesced = 0  # upstream calls saved
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) once per key at a time; share the result."""
+        with self._lock:
+            call = self._inflight.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._inflight[key] = call
+                self.calls += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "inflight": len(self._inflight),
+            }
+
+
+class AsyncSingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._inflight = {}  # key -> asyncio.Future
+
+    async def do(self, key, fn, *args, **kwargs):
+        """Await fn(*args, **kwargs) once per key at a time; share the result."""
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # shield: a follower giving up must not cancel the leader's call
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self.calls += 1
+        try:
+            result = await fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # retrieved: no warning when nobody was waiting
+            raise
+        finally:
+            del self._inflight[key]
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+        }
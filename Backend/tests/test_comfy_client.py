@@ -0,0 +1,132 @@
+"""
+ComfyPool / AsyncComfyClient failover: a /prompt may only be resubmitted to
+another backend when it never reached the first one. Run from Backend/:
+    python -m pytest -q tests
+"""
+
+import asyncio
+import os
+import sys
+from http.client import RemoteDisconnected
+
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import comfy_client  # noqa: E402
+from comfy_client import AsyncComfyClient, ComfyPool, ComfyUnavailable  # noqa: E402
+
+FIRST = "http://comfy-a"
+SECOND = "http://comfy-b"
+WORKFLOW = {"1": {"class_type": "SaveImage", "inputs": {}}}
+
+
+class FakeResponse:
+    status_code = 200
+    text = ""
+
+    def json(self):
+        return {"prompt_id": "p1"}
+
+
+def make_pool():
+    pool = ComfyPool([FIRST, SECOND])
+    # No health thread / websocket listeners; always try FIRST, then SECOND
+    pool.start = lambda: None
+    pool.candidates = lambda checkpoint=None: list(pool.backends)
+    return pool
+
+
+def sync_submit(pool, first_error):
+    posted = []
+
+    def post(url, **kwargs):
+        posted.append(url)
+        if url.startswith(FIRST):
+            raise first_error
+        return FakeResponse()
+
+    pool.session.post = post
+    return posted
+
+
+def test_refused_connection_fails_over():
+    pool = make_pool()
+    refused = requests.ConnectionError(MaxRetryError(
+        None, "/prompt", NewConnectionError(None, "Connection refused")))
+    posted = sync_submit(pool, refused)
+
+    backend, prompt_id = pool.submit(WORKFLOW)
+
+    assert (backend.url, prompt_id) == (SECOND, "p1")
+    assert posted == [f"{FIRST}/prompt", f"{SECOND}/prompt"]
+    assert not pool.backends[0].healthy
+
+
+@pytest.mark.parametrize("error", [
+    requests.ConnectionError(ProtocolError(
+        "Connection aborted.", RemoteDisconnected("closed without response"))),
+    requests.ReadTimeout("read timed out"),
+])
+def test_error_after_send_is_not_resubmitted(error):
+    pool = make_pool()
+    posted = sync_submit(pool, error)
+
+    with pytest.raises(ComfyUnavailable):
+        pool.submit(WORKFLOW)
+
+    assert posted == [f"{FIRST}/prompt"]
+    assert pool.backends[0].healthy
+
+
+httpx = pytest.importorskip("httpx")
+
+
+def async_submit(first_error):
+    pool = make_pool()
+    client = AsyncComfyClient(pool)
+    posted = []
+
+    def handler(request):
+        posted.append(str(request.url))
+        if str(request.url).startswith(FIRST):
+            raise first_error
+        return httpx.Response(200, json={"prompt_id": "p1"})
+
+    async def run():
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            return await client.submit(WORKFLOW)
+        finally:
+            await client._client.aclose()
+
+    return run, posted
+
+
+def test_async_connect_error_fails_over():
+    run, posted = async_submit(httpx.ConnectError("refused"))
+
+    backend, _ = asyncio.run(run())
+
+    assert backend.url == SECOND
+    assert posted == [f"{FIRST}/prompt", f"{SECOND}/prompt"]
+
+
+@pytest.mark.parametrize("error", [
+    httpx.RemoteProtocolError("Server disconnected without sending a response."),
+    httpx.ReadTimeout("read timed out"),
+])
+def test_async_error_after_send_is_not_resubmitted(error):
+    run, posted = async_submit(error)
+
+    with pytest.raises(ComfyUnavailable):
+        asyncio.run(run())
+
+    assert posted == [f"{FIRST}/prompt"]
+
+
+def test_never_sent():
+    assert comfy_client.never_sent(requests.ConnectTimeout("connect timed out"))
+    assert not comfy_client.never_sent(requests.ConnectionError("Connection aborted."))
@@ -0,0 +1,121 @@
+# =============================================================================
+# THUMBNAILS / DERIVATIVE IMAGE CACHE
+# =============================================================================
+# /generated/<file>?w=256 and /comfy_output/<file>?w=256 serve a resized copy
+# instead of the full image. Each derivative is made once, in a small worker
+# pool (concurrent requests for the same one share the work), and stored in
+#   THUMBNAIL_DIR/<key[0:2]>/<key>.webp
+# where key = hash(source digest, width). Upload-store files already have a
+# content digest; other files use (path, size, mtime) as their digest, so an
+# overwritten source gets a new derivative. The key doubles as a strong ETag.
+#
+# Requested widths snap up to THUMBNAIL_WIDTHS so clients can't fill the disk
+# with arbitrary sizes. Needs Pillow (optional): without it ?w= is ignored
+# and the original is served.
+
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from singleflight import SingleFlight
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+
+THUMBNAIL_WIDTHS = sorted(
+    int(w) for w in os.getenv("THUMBNAIL_WIDTHS", "64,128,256,512").split(",")
+)
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+THUMBNAIL_TIMEOUT = float(os.getenv("THUMBNAIL_TIMEOUT", "20"))
+
+
+def snap_width(width):
+    """Smallest configured width >= width (largest one if width is bigger)."""
+    for allowed in THUMBNAIL_WIDTHS:
+        if width <= allowed:
+            return allowed
+    return THUMBNAIL_WIDTHS[-1]
+
+
+def _render(source_path, target_path, width, quality):
+    """Runs in the worker pool: resize source to `width` and write WEBP."""
+    with Image.open(source_path) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.width > width:
+            height = max(1, round(img.height * width / img.width))
+            img = img.resize((width, height), Image.LANCZOS)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target_path))
+        try:
+            with os.fdopen(fd, "wb") as out:
+                img.save(out, "WEBP", quality=quality, method=4)
+            os.replace(tmp_path, target_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+
+class ThumbnailCache:
+    def __init__(self, directory, workers=THUMBNAIL_WORKERS):
+        self.directory = directory
+        self.enabled = Image is not None
+        self.rendered = 0
+        self.hits = 0
+        self.flight = SingleFlight("thumbnails")
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="thumbnail")
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def source_digest(path, digest=None):
+        if digest:
+            return digest
+        st = os.stat(path)
+        return f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}"
+
+    def key(self, source_digest, width):
+        return hashlib.sha256(f"{source_digest}|w{width}".encode()).hexdigest()[:40]
+
+    def get(self, source_path, width, digest=None):
+        """
+        Path and ETag of the `width` derivative of source_path (rendered on
+        first request), or None when thumbnails are unavailable / the source
+        isn't an image Pillow can read.
+        """
+        if not self.enabled:
+            return None
+
+        key = self.key(self.source_digest(source_path, digest), width)
+        target = os.path.join(self.directory, key[:2], f"{key}.webp")
+        if os.path.exists(target):
+            self.hits += 1
+            return target, key
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            self.flight.do(key, self._render, source_path, target, width)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            return None
+        return target, key
+
+    def _render(self, source_path, target, width):
+        if os.path.exists(target):
+            return
+        future = self._pool.submit(_render, source_path, target, width, THUMBNAIL_QUALITY)
+        future.result(timeout=THUMBNAIL_TIMEOUT)
+        self.rendered += 1
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "widths": THUMBNAIL_WIDTHS,
+            "rendered": self.rendered,
+            "hits": self.hits,
+            "single_flight": self.flight.stats(),
+        }
@@ -0,0 +1,152 @@
+# =============================================================================
+# TOOL ENDPOINT PIPELINE
+# =============================================================================
+# Every AI tool route is registered with @tools.route(...). Before the view
+# runs, the pipeline (in this order, all cheap):
+#   1. rejects bodies over the tool's size limit (Content-Length, no read)
+#   2. authenticates the caller (401 before any upload/Gemini/ComfyUI work)
+#   3. checks required JSON / form fields, text lengths and uploaded files
+# The view then gets the authenticated user as `current_user`, so there is
+# no way to reach the expensive part of a tool without passing all three.
+
+import logging
+import os
+from functools import wraps
+
+from flask import jsonify, request
+
+log = logging.getLogger(__name__)
+
+TOOL_MAX_UPLOAD_MB = float(os.getenv("TOOL_MAX_UPLOAD_MB", "10"))
+TOOL_MAX_JSON_KB = float(os.getenv("TOOL_MAX_JSON_KB", "64"))
+TOOL_MAX_TEXT_CHARS = int(os.getenv("TOOL_MAX_TEXT_CHARS", "2000"))
+ALLOWED_IMAGE_EXTENSIONS = {"png", "jpg", "jpeg", "webp", "gif", "bmp"}
+
+
+def _is_image(filename, mimetype):
+    # The extension decides: the mimetype is whatever the client claimed
+    ext = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    return ext in ALLOWED_IMAGE_EXTENSIONS
+
+
+def _fail(message, status=400):
+    return jsonify({"success": False, "error": message}), status
+
+
+class ToolSpec:
+    """
+    What a tool accepts. The checks take plain values (no Flask request), so
+    the ASGI app (asgi.py) validates its native routes with the same specs.
+    They return None when fine, or an error message (status 400).
+    """
+
+    def __init__(self, name, rule, json_fields, form_fields, files,
+                 optional_files, max_bytes):
+        self.name = name
+        self.rule = rule
+        self.json_fields = json_fields
+        self.form_fields = form_fields
+        self.files = files
+        self.optional_files = optional_files
+        self.max_bytes = max_bytes
+
+    def too_large(self, content_length):
+        """413 message when the declared body size is over the limit."""
+        if content_length and content_length > self.max_bytes:
+            return f"Request too large (limit {self.max_bytes / 1024 / 1024:.1f} MB)"
+        return None
+
+    def validate(self, data, form, uploads):
+        """
+        data: parsed JSON body (None if not JSON); form: text fields;
+        uploads: {field: (filename, mimetype)} of the uploaded files.
+        """
+        if self.json_fields:
+            if not isinstance(data, dict):
+                return "Expected a JSON body"
+            error = self._check_text(data, self.json_fields)
+            if error:
+                return error
+        elif self.form_fields or form:
+            error = self._check_text(form, self.form_fields)
+            if error:
+                return error
+
+        for field, label in self.files.items():
+            filename, _ = uploads.get(field, (None, None))
+            if not filename:
+                return f"{label} is required"
+        for field in list(self.files) + list(self.optional_files):
+            filename, mimetype = uploads.get(field, (None, None))
+            if filename and not _is_image(filename, mimetype):
+                return f"Unsupported image type for '{field}'"
+        return None
+
+    @staticmethod
+    def _check_text(values, required):
+        for field, label in required.items():
+            value = values.get(field)
+            if not isinstance(value, str) or not value.strip():
+                return f"{label} is required"
+        for field, value in values.items():
+            if isinstance(value, str) and len(value) > TOOL_MAX_TEXT_CHARS:
+                return f"'{field}' is too long (max {TOOL_MAX_TEXT_CHARS} characters)"
+        return None
+
+
+class ToolRegistry:
+    def __init__(self, app, authenticate):
+        self.app = app
+        self.authenticate = authenticate   # () -> (user, error_response)
+        self.tools = {}
+        self.specs = {}
+
+    def route(self, rule, *, name, json_fields=None, form_fields=None,
+              files=None, optional_files=(), max_upload_mb=None):
+        """
+        json_fields / form_fields / files: {field: label} that must be present
+        and non-empty (label is used in the error message).
+        optional_files: upload fields that are validated only when sent.
+        max_upload_mb: body limit for upload tools (JSON tools get
+        TOOL_MAX_JSON_KB).
+        """
+        files = files or {}
+        if files or optional_files:
+            max_bytes = (max_upload_mb or TOOL_MAX_UPLOAD_MB) * 1024 * 1024
+        else:
+            max_bytes = TOOL_MAX_JSON_KB * 1024
+        spec = ToolSpec(name, rule, json_fields or {}, form_fields or {},
+                        files, optional_files, max_bytes)
+
+        def decorator(view):
+            @wraps(view)
+            def pipeline(*args, **kwargs):
+                # 1. Size: decided from the header, before the body is read
+                error = spec.too_large(request.content_length)
+                if error:
+                    return _fail(error, 413)
+
+                # 2. Auth
+                current_user, error = self.authenticate()
+                if error:
+                    return error
+
+                # 3. Validation
+                uploads = {
+                    field: (upload.filename, upload.mimetype)
+                    for field, upload in request.files.items()
+                }
+                error = spec.validate(request.get_json(silent=True),
+                                      request.form, uploads)
+                if error:
+                    return _fail(error)
+
+                log.debug("tool %s called by user %s", name, current_user.id)
+                return view(current_user, *args, **kwargs)
+
+            self.tools[name] = rule
+            self.specs[name] = spec
+            self.app.add_url_rule(rule, view.__name__, pipeline, methods=["POST"])
+            return pipeline
+
+        return decorator
@@ -0,0 +1,117 @@
+# =============================================================================
+# CONTENT-ADDRESSED UPLOAD STORE
+# =============================================================================
+# Uploads are hashed (SHA-256) while they stream to a temp file, then moved to
+#   UPLOAD_DIR/<d[0:2]>/<d[2:4]>/<digest>.<ext>
+# The key saved in History.input_img is "<digest>.<ext>". Identical content
+# is stored once (the second upload just deletes its temp file), client
+# filenames can no longer collide or overwrite each other, and the two-level
+# sharding keeps every directory small even with millions of files.
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+
+import metrics
+from tool_pipeline import ALLOWED_IMAGE_EXTENSIONS
+
+
+CHUNK_SIZE = 64 * 1024
+KEY_RE = re.compile(r"^[0-9a-f]{64}\.[a-z0-9]{1,5}$")
+# Normalised so the same bytes uploaded as .jpeg and .jpg share a file
+EXTENSION_ALIASES = {"jpeg": "jpg", "jpe": "jpg", "tif": "tiff"}
+MIMETYPE_EXTENSIONS = {
+    "image/png": "png", "image/jpeg": "jpg", "image/webp": "webp",
+    "image/gif": "gif", "image/bmp": "bmp",
+}
+
+
+def upload_extension(filename, mimetype):
+    # Stored files are served back (with a mimetype guessed from this
+    # extension) from our own origin, so only image extensions are kept: an
+    # "x.html" sent as image/png must not come back as text/html
+    name = filename or ""
+    ext = name.rsplit(".", 1)[-1].lower() if "." in name else ""
+    if ext in ALLOWED_IMAGE_EXTENSIONS:
+        return EXTENSION_ALIASES.get(ext, ext)
+    return MIMETYPE_EXTENSIONS.get(mimetype or "", "bin")
+
+
+class UploadStore:
+    def __init__(self, root):
+        self.root = root
+        self.stored = 0
+        self.deduped = 0
+        self.bytes_saved = 0
+        self._tmp = os.path.join(root, "tmp")
+        self._lock = threading.Lock()
+        os.makedirs(self._tmp, exist_ok=True)
+
+    @staticmethod
+    def is_key(key):
+        return bool(KEY_RE.match(key))
+
+    def relpath(self, key):
+        return os.path.join(key[:2], key[2:4], key)
+
+    def path(self, key):
+        """Absolute path of a stored upload, or None."""
+        if not self.is_key(key):
+            return None
+        full = os.path.join(self.root, self.relpath(key))
+        return full if os.path.isfile(full) else None
+
+    def save(self, upload):
+        """Stream a werkzeug FileStorage into the store; returns its key."""
+        return self.save_stream(upload.stream, upload.filename, upload.mimetype)
+
+    def save_stream(self, stream, filename, mimetype):
+        """Store a readable binary stream (e.g. a Starlette UploadFile.file)."""
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+
+            key = f"{digest.hexdigest()}.{upload_extension(filename, mimetype)}"
+            target = os.path.join(self.root, self.relpath(key))
+
+            if os.path.exists(target):
+                os.remove(tmp_path)
+                with self._lock:
+                    self.deduped += 1
+                    self.bytes_saved += size
+                metrics.UPLOADS.inc(1, "deduped")
+                metrics.UPLOAD_BYTES.inc(size, "deduped")
+                return key
+
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # Atomic: concurrent identical uploads just replace equal bytes
+            os.replace(tmp_path, target)
+            with self._lock:
+                self.stored += 1
+            metrics.UPLOADS.inc(1, "stored")
+            metrics.UPLOAD_BYTES.inc(size, "stored")
+            return key
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def stats(self):
+        with self._lock:
+            return {
+                "root": self.root,
+                "stored": self.stored,
+                "deduped": self.deduped,
+                "bytes_saved": self.bytes_saved,
+            }
@@ -0,0 +1,206 @@
+# =============================================================================
+# USAGE ROLLUP (incrementally maintained admin statistics)
+# =============================================================================
+# Every history write also bumps a (day, tool_name, user_id) counter in
+# usage_rollup, inside the same transaction. The admin stats endpoints read
+# only this table, so they cost a fixed number of small queries no matter
+# how many history rows exist. Version 3 in migrations.py backfills it.
+#
+# Totals that aren't per day live in usage_counters (name -> value): the
+# user count is bumped by register / delete_user, the history totals by
+# record_usage / delete_user_usage, each in the writer's transaction, so the
+# stats page never sums the rollup or counts users. Versions 4 and 5 backfill
+# them.
+
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import UsageCounter, UsageRollup, User
+
+
+rollup = UsageRollup.__table__
+counters = UsageCounter.__table__
+USERS = "users"
+HISTORY_TOTAL = "history_total"
+HISTORY_COMPLETED = "history_completed"
+
+
+def _real_value(conn, name):
+    """What a counter should hold, computed the slow way (backfill)."""
+    if name == USERS:
+        return conn.execute(select(func.count()).select_from(User.__table__)).scalar()
+    column = rollup.c.count if name == HISTORY_TOTAL else rollup.c.completed
+    return conn.execute(select(func.coalesce(func.sum(column), 0))).scalar()
+
+
+def _bump(conn, name, delta):
+    """Adjust a counter; call before the change it counts is written."""
+    if not delta:
+        return
+    result = conn.execute(
+        update(counters)
+        .where(counters.c.name == name)
+        .values(value=counters.c.value + delta)
+    )
+    if result.rowcount == 0:
+        # Its migration isn't applied yet: start from the real value, which
+        # doesn't include the change being made (hence + delta)
+        conn.execute(counters.insert().values(
+            name=name, value=int(_real_value(conn, name)) + delta))
+
+
+def _usage_counts(rows):
+    """{(day, tool_name, user_id): (count, completed)} for history rows."""
+    counts = Counter()
+    completed = Counter()
+    for row in rows:
+        created_at = row.get("created_at") or datetime.utcnow()
+        key = (created_at.date(), row["tool_name"], row["user_id"])
+        counts[key] += 1
+        if row.get("output_text") or row.get("output_img"):
+            completed[key] += 1
+    return {key: (n, completed[key]) for key, n in counts.items()}
+
+
+def record_usage(conn, rows):
+    """Add history rows (dicts) to the rollup using connection `conn`."""
+    values = [
+        {"day": day, "tool_name": tool, "user_id": user_id,
+         "count": n, "completed": done}
+        for (day, tool, user_id), (n, done) in _usage_counts(rows).items()
+    ]
+    if not values:
+        return
+    _bump(conn, HISTORY_TOTAL, sum(v["count"] for v in values))
+    _bump(conn, HISTORY_COMPLETED, sum(v["completed"] for v in values))
+
+    dialect = conn.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert = (sqlite if dialect == "sqlite" else postgresql).insert
+        for value in values:
+            stmt = insert(rollup).values(**value)
+            conn.execute(stmt.on_conflict_do_update(
+                index_elements=["day", "tool_name", "user_id"],
+                set_={
+                    "count": rollup.c.count + stmt.excluded.count,
+                    "completed": rollup.c.completed + stmt.excluded.completed,
+                }
+            ))
+        return
+
+    # Other databases: update, insert when the counter doesn't exist yet
+    for value in values:
+        result = conn.execute(
+            update(rollup)
+            .where(rollup.c.day == value["day"],
+                   rollup.c.tool_name == value["tool_name"],
+                   rollup.c.user_id == value["user_id"])
+            .values(count=rollup.c.count + value["count"],
+                    completed=rollup.c.completed + value["completed"])
+        )
+        if result.rowcount == 0:
+            conn.execute(rollup.insert().values(**value))
+
+
+def delete_user_usage(conn, user_id):
+    total, completed = conn.execute(
+        select(func.coalesce(func.sum(rollup.c.count), 0),
+               func.coalesce(func.sum(rollup.c.completed), 0))
+        .where(rollup.c.user_id == user_id)
+    ).one()
+    _bump(conn, HISTORY_TOTAL, -int(total))
+    _bump(conn, HISTORY_COMPLETED, -int(completed))
+    conn.execute(rollup.delete().where(rollup.c.user_id == user_id))
+
+
+def add_users(conn, delta):
+    """Adjust the user counter; call in the transaction that adds/deletes."""
+    _bump(conn, USERS, delta)
+
+
+# -----------------------------------------------------------------------------
+# Read side (admin endpoints)
+# -----------------------------------------------------------------------------
+def _since(days):
+    return (datetime.utcnow() - timedelta(days=days - 1)).date() if days else None
+
+
+def _counter_values(conn, names):
+    values = dict(conn.execute(
+        select(counters.c.name, counters.c.value).where(counters.c.name.in_(names))
+    ).all())
+    return [int(values.get(name) or 0) for name in names]
+
+
+def user_count(conn):
+    return _counter_values(conn, [USERS])[0]
+
+
+def totals(conn):
+    today = datetime.utcnow().date()
+    total, completed = _counter_values(conn, [HISTORY_TOTAL, HISTORY_COMPLETED])
+    # Today's rows only (day leads the primary key)
+    active_today, today_count = conn.execute(
+        select(func.count(func.distinct(rollup.c.user_id)),
+               func.coalesce(func.sum(rollup.c.count), 0))
+        .where(rollup.c.day == today)
+    ).one()
+    return {
+        "total_history": int(total),
+        "completed_history": int(completed),
+        "history_today": int(today_count),
+        "active_users_today": int(active_today),
+    }
+
+
+def per_tool(conn, days=None):
+    total = func.sum(rollup.c.count).label("count")
+    query = (
+        select(rollup.c.tool_name, total,
+               func.sum(rollup.c.completed).label("completed"),
+               func.count(func.distinct(rollup.c.user_id)).label("users"))
+        .group_by(rollup.c.tool_name)
+        .order_by(total.desc())
+    )
+    if days:
+        query = query.where(rollup.c.day >= _since(days))
+    return [
+        {"tool_name": tool, "count": int(n), "completed": int(done),
+         "users": int(users)}
+        for tool, n, done, users in conn.execute(query)
+    ]
+
+
+def daily_active(conn, days=30):
+    query = (
+        select(rollup.c.day,
+               func.count(func.distinct(rollup.c.user_id)),
+               func.sum(rollup.c.count))
+        .where(rollup.c.day >= _since(days))
+        .group_by(rollup.c.day)
+        .order_by(rollup.c.day)
+    )
+    return [
+        {"day": day.isoformat() if hasattr(day, "isoformat") else str(day),
+         "active_users": int(users), "count": int(n)}
+        for day, users, n in conn.execute(query)
+    ]
+
+
+def top_users(conn, days=None, limit=10):
+    total = func.sum(rollup.c.count).label("count")
+    query = (
+        select(rollup.c.user_id, total)
+        .group_by(rollup.c.user_id)
+        .order_by(total.desc())
+        .limit(limit)
+    )
+    if days:
+        query = query.where(rollup.c.day >= _since(days))
+    return [
+        {"user_id": user_id, "count": int(n)}
+        for user_id, n in conn.execute(query)
+    ]
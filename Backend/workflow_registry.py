@@ -0,0 +1,195 @@
+# =============================================================================
+# WORKFLOW REGISTRY (compiled ComfyUI workflow templates)
+# =============================================================================
+# Each workflows/<name>.json is read, validated and compiled once into a
+# WorkflowTemplate with named parameter slots, found by walking the graph
+# from the KSampler instead of hard-coding node ids:
+#
+#   prompt, negative          -> CLIPTextEncode on KSampler positive/negative
+#   seed, steps, cfg, sampler, scheduler, denoise -> KSampler
+#   width, height, batch_size -> EmptyLatentImage on KSampler latent_image
+#   checkpoint                -> CheckpointLoaderSimple ckpt_name
+#
+# instantiate() returns a copy-on-write graph: only nodes whose inputs change
+# are copied, the rest are shared with the template and must not be mutated.
+# The registry re-stats files at most every WORKFLOW_CHECK_INTERVAL seconds
+# and recompiles a workflow when its mtime/size changes, so edits need no
+# restart.
+
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+WORKFLOW_CHECK_INTERVAL = float(os.getenv("WORKFLOW_CHECK_INTERVAL", "2"))
+
+SAMPLER_SLOTS = {
+    "seed": "seed",
+    "steps": "steps",
+    "cfg": "cfg",
+    "sampler": "sampler_name",
+    "scheduler": "scheduler",
+    "denoise": "denoise",
+}
+LATENT_SLOTS = {"width": "width", "height": "height", "batch_size": "batch_size"}
+
+
+class WorkflowError(Exception):
+    """Workflow file missing, unreadable or not a usable graph."""
+
+
+def _link_target(value):
+    """ComfyUI links look like ["<node id>", <output index>]."""
+    if isinstance(value, list) and len(value) == 2 and isinstance(value[0], str):
+        return value[0]
+    return None
+
+
+class WorkflowTemplate:
+    def __init__(self, name, graph):
+        self.name = name
+        self.graph = graph
+        self.slots = {}  # slot name -> (node id, input key)
+        self.output_node = None
+        self._compile()
+
+    def _compile(self):
+        graph = self.graph
+        if not isinstance(graph, dict) or not graph:
+            raise WorkflowError(f"{self.name}: workflow must be a JSON object")
+
+        for node_id, node in graph.items():
+            if not isinstance(node, dict) or "class_type" not in node \
+                    or not isinstance(node.get("inputs"), dict):
+                raise WorkflowError(f"{self.name}: node {node_id} is malformed")
+            for key, value in node["inputs"].items():
+                target = _link_target(value)
+                if target is not None and target not in graph:
+                    raise WorkflowError(
+                        f"{self.name}: node {node_id}.{key} links to "
+                        f"missing node {target}"
+                    )
+
+        samplers = self._nodes_of("KSampler")
+        if len(samplers) != 1:
+            raise WorkflowError(f"{self.name}: expected exactly one KSampler")
+        sampler_id = samplers[0]
+        sampler_inputs = graph[sampler_id]["inputs"]
+
+        for slot, key in SAMPLER_SLOTS.items():
+            if key in sampler_inputs:
+                self.slots[slot] = (sampler_id, key)
+
+        for slot, link_key in (("prompt", "positive"), ("negative", "negative")):
+            text_id = _link_target(sampler_inputs.get(link_key))
+            if text_id and "text" in graph[text_id]["inputs"]:
+                self.slots[slot] = (text_id, "text")
+
+        latent_id = _link_target(sampler_inputs.get("latent_image"))
+        if latent_id:
+            for slot, key in LATENT_SLOTS.items():
+                if key in graph[latent_id]["inputs"]:
+                    self.slots[slot] = (latent_id, key)
+
+        for node_id in self._nodes_of("CheckpointLoaderSimple")[:1]:
+            self.slots["checkpoint"] = (node_id, "ckpt_name")
+
+        outputs = self._nodes_of("SaveImage")
+        if not outputs:
+            raise WorkflowError(f"{self.name}: no SaveImage output node")
+        self.output_node = outputs[0]
+
+        if "prompt" not in self.slots:
+            raise WorkflowError(f"{self.name}: no positive prompt node found")
+
+    def _nodes_of(self, class_type):
+        return sorted(
+            (node_id for node_id, node in self.graph.items()
+             if node["class_type"] == class_type),
+            key=lambda node_id: (len(node_id), node_id),
+        )
+
+    @property
+    def defaults(self):
+        return {
+            slot: self.graph[node_id]["inputs"][key]
+            for slot, (node_id, key) in self.slots.items()
+        }
+
+    def resolve(self, **params):
+        """Full slot values for this request (template defaults + params)."""
+        unknown = set(params) - set(self.slots)
+        if unknown:
+            raise WorkflowError(
+                f"{self.name}: unknown parameter(s) {', '.join(sorted(unknown))}"
+            )
+        resolved = self.defaults
+        resolved.update(params)
+        return resolved
+
+    def instantiate(self, **params):
+        """Copy-on-write graph with params written into their slots."""
+        self.resolve(**params)
+        graph = dict(self.graph)
+        copied = set()
+        for slot, value in params.items():
+            node_id, key = self.slots[slot]
+            if node_id not in copied:
+                node = graph[node_id]
+                graph[node_id] = {**node, "inputs": dict(node["inputs"])}
+                copied.add(node_id)
+            graph[node_id]["inputs"][key] = value
+        return graph
+
+
+class WorkflowRegistry:
+    def __init__(self, directory):
+        self.directory = directory
+        self._templates = {}  # name -> (template, (mtime, size), checked_at)
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        if not name or os.path.basename(name) != name:
+            raise WorkflowError(f"Invalid workflow name: {name!r}")
+        return os.path.join(self.directory, f"{name}.json")
+
+    def get(self, name):
+        """Compiled template for workflows/<name>.json (reloaded on change)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._templates.get(name)
+        if entry and now - entry[2] < WORKFLOW_CHECK_INTERVAL:
+            return entry[0]
+
+        path = self._path(name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            if entry:
+                return entry[0]  # keep serving the last good version
+            raise WorkflowError(f"Workflow not found: {name}")
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        if entry and entry[1] == signature:
+            with self._lock:
+                self._templates[name] = (entry[0], signature, now)
+            return entry[0]
+
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                template = WorkflowTemplate(name, json.load(f))
+        except (OSError, ValueError, WorkflowError) as e:
+            if entry:
+                log.error("Workflow reload error (%s), keeping old version: %s", name, e)
+                with self._lock:
+                    self._templates[name] = (entry[0], signature, now)
+                return entry[0]
+            raise WorkflowError(f"Workflow load error ({name}): {e}")
+
+        with self._lock:
+            self._templates[name] = (template, signature, now)
+        return template